@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import re
+import shutil
+import sys
+import tempfile
+from collections import Counter
+
+import s3repo
+from s3repo.s3repomain import *
+
+"""
+Benchmark of s3RepoMain operations against in-process S3 stand-in ( moto ) - no AWS account is needed
+
+Every scenario ( number of files x file size ) runs in fresh empty S3 and covers plain , parallel and streamed
+transfers , dedup / compressed / chunked upload modes , directory sync and bulk user create / tear down ; for each
+operation we record latency of every call , throughput and number of S3 API calls by name ( taken from repo's
+RepoStats ) - API call counts do not depend on machine speed so they catch regressions like per-file tag scans even
+when timings are noisy
+Report is JSON so two runs can be compared ( --compare=old-report.json )
+"""
+
+logger = logger_setup.logger
+logger.name = "s3repo.benchmark"
+
+REPORT_VERSION = 1
+BENCH_USER = "benchw9user"
+BENCH_PASSWORD = "Bench$Passw0rd"
+BENCH_EMAIL = "bench@s3users.com"
+
+
+def usage():
+    programName = os.path.basename(sys.argv[0])
+    logger.info("%s [--files=<n,n,..>] [--size-kb=<n,n,..>] [--output=<report.json>] [--compare=<old-report.json>] "
+                "[--threshold=<ratio>]", programName)
+    logger.info("Defaults: --files=1,10,100 --size-kb=4,1024 --output=benchmark.json --threshold=2")
+    logger.info("With --compare operation is reported as regression if it makes more S3 API calls than in old report "
+                "or its median latency is more than threshold times old one ; exit code is 1 if any regression found")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class OperationStats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.bytes = 0
+        self.api_calls = Counter()
+
+    def to_dict(self):
+        seconds = sum(self.latencies)
+        return {
+            "calls": len(self.latencies),
+            "seconds": round(seconds, 6),
+            "latency_ms": {"mean": round(1000 * seconds / len(self.latencies), 3),
+                           "p50": round(1000 * percentile(self.latencies, 0.5), 3),
+                           "p95": round(1000 * percentile(self.latencies, 0.95), 3),
+                           "max": round(1000 * max(self.latencies), 3)},
+            "ops_per_s": round(len(self.latencies) / seconds, 3) if seconds else None,
+            "mb_per_s": round(self.bytes / seconds / (1024 * 1024), 3) if self.bytes and seconds else None,
+            "api_calls": dict(sorted(self.api_calls.items())),
+            "api_calls_per_call": round(sum(self.api_calls.values()) / float(len(self.latencies)), 3)
+        }
+
+
+class Benchmark(object):
+
+    def __init__(self, file_count, file_size, work_folder):
+        self.file_count = file_count
+        self.file_size = file_size
+        self.work_folder = work_folder
+        self.operations = {}
+        self.repo = None
+
+    def measure(self, operation, function, *args, **kwargs):
+        """
+        Run one call of operation and record its latency and S3 API calls it made
+        :param operation: name in report
+        :param function:
+        :param args:
+        :param kwargs: transfer_bytes=<n> is taken out and counted as data moved by this call
+        :return: result of function
+        """
+        transfer_bytes = kwargs.pop("transfer_bytes", 0)
+        stats = self.operations.setdefault(operation, OperationStats())
+        calls_before = self.repo.stats.api_call_counts()
+        # Operations print tables and progress - keep benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            stats.latencies.append(time.perf_counter() - start)
+        stats.bytes += transfer_bytes
+        stats.api_calls.update(self.repo.stats.api_call_counts() - calls_before)
+        if result is False:
+            raise RuntimeError(operation + " failed - see log")
+        return result
+
+    def run(self):
+        from moto import mock_aws
+        import boto3
+
+        input_folder = os.path.join(self.work_folder, "input")
+        text_folder = os.path.join(self.work_folder, "text")
+        output_folder = os.path.join(self.work_folder, "output")
+        os.makedirs(input_folder)
+        os.makedirs(text_folder)
+        # Each kind of download writes to its own folder so no file is overwritten
+        for folder in ("get", "get-parallel", "download", "modes"):
+            os.makedirs(os.path.join(output_folder, folder))
+        files = []
+        for number in range(self.file_count):
+            file = os.path.join(input_folder, "bench-%06d.bin" % number)
+            with open(file, "wb") as f:
+                f.write(os.urandom(self.file_size))
+            files.append(file)
+        # Random data does not compress and has no line ends to cut chunks at - compressed and chunked modes use text
+        text_files = []
+        for number in range(self.file_count):
+            file = os.path.join(text_folder, "bench-%06d.log" % number)
+            line = "file %06d line %%08d of benchmark text for compressed and chunked uploads\n" % number
+            lines = (line % line_number for line_number in range(self.file_size // len(line % 0) + 1))
+            with open(file, "w") as f:
+                f.write("".join(lines)[:self.file_size])
+            text_files.append(file)
+
+        with mock_aws():
+            repo = s3RepoMain(lazy_connect=True)
+            # Stand-in S3 does not need real credentials or profile
+            repo._session = boto3.session.Session(aws_access_key_id="benchmark", aws_secret_access_key="benchmark",
+                                                  region_name=repo.region)
+            repo.output_folder = output_folder
+            # Sync state and tear down journal of benchmark must not mix with real ones
+            repo.state_folder = os.path.join(self.work_folder, "state")
+            self.repo = repo
+
+            self.measure("create_user", repo.create_user, BENCH_USER, BENCH_PASSWORD, BENCH_EMAIL)
+            for number, file in enumerate(files):
+                self.measure("uploadFile", repo.uploadFile, BENCH_USER, BENCH_PASSWORD, "key-%06d" % number, file,
+                             transfer_bytes=self.file_size)
+            self.measure("listFiles", repo.listFiles, BENCH_USER, BENCH_PASSWORD)
+            self.measure("iterFiles", lambda: list(repo.iterFiles(BENCH_USER, BENCH_PASSWORD)))
+            self.measure("iterFiles(no tags)", lambda: list(repo.iterFiles(BENCH_USER, BENCH_PASSWORD,
+                                                                             with_tags=False)))
+            for number in range(self.file_count):
+                self.measure("getFile", repo.getFile, BENCH_USER, BENCH_PASSWORD, "key-%06d" % number,
+                             os.path.join(output_folder, "get"),
+                             transfer_bytes=self.file_size)
+            for number in range(self.file_count):
+                # Four ranges per file
+                self.measure("getFile(parallel)", repo.getFile, BENCH_USER, BENCH_PASSWORD, "key-%06d" % number,
+                             os.path.join(output_folder, "get-parallel"), parallel=True,
+                             part_size=max(1, self.file_size // 4), concurrency=4, transfer_bytes=self.file_size)
+            for number in range(self.file_count):
+                self.measure("iterFile", lambda key: sum(len(chunk) for chunk in
+                                                         repo.iterFile(BENCH_USER, BENCH_PASSWORD, key)),
+                             "key-%06d" % number, transfer_bytes=self.file_size)
+            for file in files:
+                self.measure("downloadFile", repo.downloadFile, BENCH_USER, BENCH_PASSWORD, os.path.basename(file),
+                             output_location=os.path.join(output_folder, "download"), transfer_bytes=self.file_size)
+            self.measure("rebuild_index", repo.rebuild_index, BENCH_USER, BENCH_PASSWORD)
+            self.measure("usage_report", repo.usage_report, repo.admin_password)
+            for number in range(self.file_count):
+                self.measure("deleteFile", repo.deleteFile, BENCH_USER, BENCH_PASSWORD, "key-%06d" % number)
+
+            self.run_upload_modes(files, text_files)
+            self.measure("syncDirectory", repo.syncDirectory, BENCH_USER, BENCH_PASSWORD, input_folder, "sync/",
+                         transfer_bytes=self.file_size * self.file_count)
+            self.measure("syncDirectory(unchanged)", repo.syncDirectory, BENCH_USER, BENCH_PASSWORD, input_folder,
+                         "sync/")
+            self.measure("delete_user", repo.delete_user, BENCH_USER)
+
+            batch = [("benchw9batch%06d" % number, BENCH_PASSWORD, BENCH_EMAIL) for number in range(self.file_count)]
+            results = self.measure("create_users", repo.create_users, batch)
+            if any(error is not None for error in results.values()):
+                raise RuntimeError("create_users failed - see log")
+            self.measure("tear_down_all", repo.tear_down_all, repo.admin_password)
+
+        return {"files": self.file_count, "size": self.file_size,
+                "operations": {operation: stats.to_dict() for operation, stats in self.operations.items()},
+                "stats": repo.stats.snapshot()}
+
+    def run_upload_modes(self, files, text_files):
+        """
+        Upload modes other than plain upload - each writes its own object keys ( user-keys ) so modes do not overwrite
+        each other's files
+        :param files: random data files
+        :param text_files: compressible text files ( compressed and chunked modes )
+        :return:
+        """
+        repo = self.repo
+        modes_folder = os.path.join(repo.output_folder, "modes")
+        for number, file in enumerate(files):
+            self.measure("uploadFile(multipart)", repo.uploadFile, BENCH_USER, BENCH_PASSWORD,
+                         "multipart-%06d" % number, file, multipart=True, part_size=MIN_PART_SIZE,
+                         transfer_bytes=self.file_size)
+        for number, file in enumerate(files):
+            with open(file, "rb") as stream:
+                self.measure("uploadStream", repo.uploadStream, BENCH_USER, BENCH_PASSWORD, "stream-%06d" % number,
+                             stream, object_key="stream-%06d.bin" % number, transfer_bytes=self.file_size)
+        for number, file in enumerate(files):
+            self.measure("uploadFile(dedup)", repo.uploadFile, BENCH_USER, BENCH_PASSWORD, "dedup-%06d" % number,
+                         file, dedup=True, transfer_bytes=self.file_size)
+        for number, file in enumerate(files):
+            # Same content under other user-key - only index is written
+            self.measure("uploadFile(dedup hit)", repo.uploadFile, BENCH_USER, BENCH_PASSWORD, "dup-%06d" % number,
+                         file, dedup=True)
+        for number, file in enumerate(text_files):
+            self.measure("uploadFile(compressed)", repo.uploadFile, BENCH_USER, BENCH_PASSWORD,
+                         "compressed-%06d" % number, file, compress=True, transfer_bytes=self.file_size)
+        for number in range(len(text_files)):
+            self.measure("getFile(compressed)", repo.getFile, BENCH_USER, BENCH_PASSWORD, "compressed-%06d" % number,
+                         modes_folder, transfer_bytes=self.file_size)
+        for number, file in enumerate(text_files):
+            self.measure("uploadFile(chunked)", repo.uploadFile, BENCH_USER, BENCH_PASSWORD, "chunked-%06d" % number,
+                         file, chunked=True, transfer_bytes=self.file_size)
+        for number, file in enumerate(text_files):
+            # Unchanged file - every chunk is already in repo
+            self.measure("uploadFile(chunked unchanged)", repo.uploadFile, BENCH_USER, BENCH_PASSWORD,
+                         "chunked-%06d" % number, file, chunked=True)
+        for number in range(len(text_files)):
+            self.measure("getFile(chunked)", repo.getFile, BENCH_USER, BENCH_PASSWORD, "chunked-%06d" % number,
+                         modes_folder, transfer_bytes=self.file_size)
+
+
+def compare(old_report, new_report, threshold):
+    """
+    Compare two reports - only scenarios and operations present in both are compared
+    :param old_report:
+    :param new_report:
+    :param threshold: median latency ratio ( new / old ) above which operation is slower
+    :return: number of regressions
+    """
+    from prettytable import PrettyTable
+    x = PrettyTable()
+    x.field_names = ["Files", "Size", "Operation", "API calls/call old", "API calls/call new", "p50 ms old",
+                     "p50 ms new", "Regression"]
+    old_scenarios = {(scenario["files"], scenario["size"]): scenario for scenario in old_report["scenarios"]}
+    regressions = 0
+    for scenario in new_report["scenarios"]:
+        old_scenario = old_scenarios.get((scenario["files"], scenario["size"]))
+        if old_scenario is None:
+            continue
+        for operation, new in scenario["operations"].items():
+            old = old_scenario["operations"].get(operation)
+            if old is None:
+                continue
+            reasons = []
+            if new["api_calls_per_call"] > old["api_calls_per_call"]:
+                reasons.append("more API calls")
+            if old["latency_ms"]["p50"] > 0 and new["latency_ms"]["p50"] / old["latency_ms"]["p50"] > threshold:
+                reasons.append("slower")
+            regressions += 1 if reasons else 0
+            x.add_row([scenario["files"], scenario["size"], operation, old["api_calls_per_call"],
+                       new["api_calls_per_call"], old["latency_ms"]["p50"], new["latency_ms"]["p50"],
+                       ", ".join(reasons)])
+    print(x)
+    return regressions
+
+
+if __name__ == "__main__":
+    options = {"--files": "1,10,100", "--size-kb": "4,1024", "--output": "benchmark.json", "--compare": None,
+               "--threshold": "2"}
+    for argument in sys.argv[1:]:
+        name, separator, value = argument.partition("=")
+        if not separator or name not in options:
+            logger.error("Unknown argument [%s]", argument)
+            usage()
+            sys.exit(-1)
+        options[name] = value
+
+    try:
+        file_counts = [int(number) for number in options["--files"].split(",")]
+        file_sizes = [int(number) * 1024 for number in options["--size-kb"].split(",")]
+        threshold = float(options["--threshold"])
+        if min(file_counts) < 1 or min(file_sizes) < 1:
+            raise ValueError("must be positive")
+    except ValueError:
+        logger.error("File counts / sizes must be positive numbers and threshold a number")
+        usage()
+        sys.exit(-1)
+
+    try:
+        import moto
+    except ImportError:
+        logger.error("Benchmark needs moto ( pip install moto ) for in-process S3")
+        sys.exit(-1)
+
+    # Only benchmark's own progress is logged
+    logger.setLevel(logging.WARNING)
+    report = {"version": REPORT_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+              "python": sys.version.split()[0], "moto": moto.__version__, "scenarios": []}
+    for file_count in file_counts:
+        for file_size in file_sizes:
+            work_folder = tempfile.mkdtemp(prefix="s3repo-bench-")
+            try:
+                print("Running scenario: files [" + str(file_count) + "] size [" + str(file_size) + "] bytes",
+                      flush=True)
+                report["scenarios"].append(Benchmark(file_count, file_size, work_folder).run())
+            finally:
+                shutil.rmtree(work_folder)
+
+    from prettytable import PrettyTable
+    x = PrettyTable()
+    x.field_names = ["Files", "Size", "Operation", "Calls", "p50 ms", "p95 ms", "MB/s", "API calls/call", "API calls"]
+    for scenario in report["scenarios"]:
+        for operation, stats in scenario["operations"].items():
+            x.add_row([scenario["files"], scenario["size"], operation, stats["calls"], stats["latency_ms"]["p50"],
+                       stats["latency_ms"]["p95"], stats["mb_per_s"] or "", stats["api_calls_per_call"],
+                       " ".join(name + "=" + str(count) for name, count in stats["api_calls"].items())])
+    print(x)
+
+    with open(options["--output"], "w") as f:
+        json.dump(report, f, indent=2)
+    print("Report written to [" + options["--output"] + "]")
+
+    if options["--compare"] is not None:
+        with open(options["--compare"]) as f:
+            old_report = json.load(f)
+        regressions = compare(old_report, report, threshold)
+        if regressions:
+            print("[" + str(regressions) + "] operation(s) regressed")
+            sys.exit(1)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import csv
+import os
+import re
+import sys
+
+import s3repo
+from s3repo.helper import logger_setup
+from s3repo.s3repomain import s3RepoMain
+
+"""
+Create many users at once from CSV file with one user per line : username,password,email
+"""
+s3repo = s3RepoMain(lazy_connect=True)
+logger = logger_setup.logger
+logger.name = "s3repo.createUsers"
+
+
+def usage():
+    programName = os.path.basename(sys.argv[0])
+    logger.info("%s <csv-file-with-username,password,email> [concurrency]", programName)
+
+
+if len(sys.argv) not in (2, 3):
+    programName = os.path.basename(sys.argv[0])
+    logger.error("Expected 2 or 3 arguments got [%s) - re-run program with correct arguments", len(sys.argv))
+    usage()
+    sys.exit(-1)
+
+concurrency = 8
+if len(sys.argv) == 3:
+    if not sys.argv[2].isdigit() or int(sys.argv[2]) < 1:
+        logger.error("Concurrency must be a positive number [%s]", sys.argv[2])
+        sys.exit(-1)
+    concurrency = int(sys.argv[2])
+
+if not os.path.isfile(sys.argv[1]):
+    logger.error("File [%s] does not exists", sys.argv[1])
+    sys.exit(-1)
+
+users = []
+with open(sys.argv[1], newline='') as csv_file:
+    for line_number, row in enumerate(csv.reader(csv_file), 1):
+        if not row or row[0].startswith("#"):
+            continue
+        if len(row) != 3:
+            logger.error("Line [%s] must have 3 values username,password,email - skipping it", line_number)
+            continue
+        user_name, password, email_id = [value.strip() for value in row]
+        if not re.fullmatch(r"[^@]+@[^@]+\.[^@]+", email_id):
+            logger.error("Email address provided for user [%s] is not valid [%s] - skipping it", user_name, email_id)
+            continue
+        users.append((user_name, password, email_id))
+
+s3repo.logger.info("About to create [%s] user(s) from [%s]", len(users), sys.argv[1])
+
+results = s3repo.create_users(users, concurrency=concurrency)
+if any(error is not None for error in results.values()):
+    sys.exit(1)
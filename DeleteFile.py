@@ -1,29 +1,43 @@
 #!/usr/bin/env python3
+import os
 import re
 import sys
 
-import s3repo
-from s3repo.s3repomain import *
+from s3repo.daemon import DaemonClient, DaemonError, DaemonUnavailable
+from s3repo.helper import logger_setup
 
-s3repo = s3RepoMain()
 logger = logger_setup.logger
 logger.name = "s3repo.deleteFile"
-logger.setLevel(logging.DEBUG)
 
 
 def usage():
     programName = os.path.basename(sys.argv[0])
-    logger.info(programName + " <username> <userpassword> file-key")
+    logger.info("%s <username> <userpassword> file-key", programName)
 
 
 if len(sys.argv) != 4:
     programName = os.path.basename(sys.argv[0])
-    logger.error("Expected 4 arguments got [" + str(len(sys.argv)) + ") - re-run program with correct arguments")
+    logger.error("Expected 4 arguments got [%s) - re-run program with correct arguments", len(sys.argv))
     usage()
     sys.exit(-1)
 
-logger.info(
-    "About to delete file for user with this info \n\r Username: [" + sys.argv[1] + "] \r\n password: [******]" +
-    "\n\r file-key: [" + sys.argv[3] + "]")
-
+logger.info("About to delete file for user with this info \n\r Username: [%s] \r\n password: [******]\n\r file-key: "
+            "[%s]", sys.argv[1], sys.argv[3])
+
+# Running repo daemon ( see RepoDaemon.py ) does the work with its warm connection
+try:
+    if not DaemonClient().call("deleteFile", bucket_name=sys.argv[1], user_password=sys.argv[2], user_Key=sys.argv[3]):
+        logger.error("File could not be deleted - see repo daemon log")
+        sys.exit(1)
+    logger.info("File with user-key [%s] has been deleted ( by repo daemon )", sys.argv[3])
+    sys.exit(0)
+except DaemonUnavailable:
+    pass
+except DaemonError as e:
+    logger.error("File could not be deleted - repo daemon failed: %s", e)
+    sys.exit(1)
+
+from s3repo.s3repomain import s3RepoMain
+
+s3repo = s3RepoMain(lazy_connect=True)
 s3repo.deleteFile(bucket_name=sys.argv[1], user_password=sys.argv[2], user_Key=sys.argv[3])
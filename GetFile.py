@@ -1,29 +1,67 @@
 #!/usr/bin/env python3
+import os
 import re
 import sys
 
-import s3repo
-from s3repo.s3repomain import *
+from s3repo.daemon import DaemonClient, DaemonError, DaemonUnavailable
+from s3repo.helper import logger_setup
 
-s3repo = s3RepoMain()
 logger = logger_setup.logger
 logger.name = "s3repo.getFile"
-logger.setLevel(logging.DEBUG)
 
 
 def usage():
     programName = os.path.basename(sys.argv[0])
-    logger.info(programName + " <username> <userpassword> file-key path-to-save-file-to")
+    logger.info("%s <username> <userpassword> file-key path-to-save-file-to [concurrency]", programName)
+    logger.info("With concurrency file is downloaded as parallel byte ranges - re-run same command to resume")
+    logger.info("Use - as path to write file content to standard output")
 
 
-if len(sys.argv) != 5:
+if len(sys.argv) not in (5, 6):
     programName = os.path.basename(sys.argv[0])
-    logger.error("Expected 5 arguments got [" + str(len(sys.argv)) + ") - re-run program with correct arguments")
+    logger.error("Expected 5 or 6 arguments got [%s) - re-run program with correct arguments", len(sys.argv))
     usage()
     sys.exit(-1)
 
-logger.info(
-    "About to get file for user with this info \n\r Username: [" + sys.argv[1] + "] \r\n password: [******]" +
-    "\n\r file-key: [" + sys.argv[3] + "] \r\n output location: [" + sys.argv[4] + "]")
+concurrency = 1
+if len(sys.argv) == 6:
+    if not sys.argv[5].isdigit() or int(sys.argv[5]) < 1:
+        logger.error("Concurrency must be a positive number [%s]", sys.argv[5])
+        sys.exit(-1)
+    concurrency = int(sys.argv[5])
 
-s3repo.getFile(bucket_name=sys.argv[1], user_password=sys.argv[2], user_Key=sys.argv[3], output_location=sys.argv[4])
+if sys.argv[4] == "-":
+    # stdout carries file content - log has to go somewhere else
+    logger_setup.console_to_stderr()
+
+logger.info("About to get file for user with this info \n\r Username: [%s] \r\n password: [******]\n\r file-key: [%s] "
+            "\r\n output location: [%s]", sys.argv[1], sys.argv[3], sys.argv[4])
+
+if sys.argv[4] != "-":
+    # Running repo daemon ( see RepoDaemon.py ) does the work with its warm connection ; content written to stdout
+    # is always fetched by this program
+    try:
+        output_location = os.path.abspath(sys.argv[4]) if sys.argv[4].strip() else ""
+        if not DaemonClient().call("getFile", bucket_name=sys.argv[1], user_password=sys.argv[2],
+                                   user_Key=sys.argv[3], output_location=output_location,
+                                   parallel=len(sys.argv) == 6, concurrency=concurrency):
+            logger.error("File could not be downloaded - see repo daemon log")
+            sys.exit(1)
+        logger.info("File with user-key [%s] has been downloaded ( by repo daemon )", sys.argv[3])
+        sys.exit(0)
+    except DaemonUnavailable:
+        pass
+    except DaemonError as e:
+        logger.error("File could not be downloaded - repo daemon failed: %s", e)
+        sys.exit(1)
+
+from s3repo.s3repomain import s3RepoMain
+
+s3repo = s3RepoMain(lazy_connect=True)
+if sys.argv[4] == "-":
+    if not s3repo.getFileToStream(bucket_name=sys.argv[1], user_password=sys.argv[2], user_Key=sys.argv[3],
+                                  output_stream=sys.stdout.buffer):
+        sys.exit(1)
+else:
+    s3repo.getFile(bucket_name=sys.argv[1], user_password=sys.argv[2], user_Key=sys.argv[3],
+                   output_location=sys.argv[4], parallel=len(sys.argv) == 6, concurrency=concurrency)
@@ -1,28 +1,105 @@
 #!/usr/bin/env python3
+import itertools
+import json
+import os
 import re
 import sys
 
-import s3repo
-from s3repo.s3repomain import *
+from s3repo.daemon import DaemonClient, DaemonError, DaemonUnavailable
+from s3repo.helper import logger_setup
 
-s3repo = s3RepoMain()
 logger = logger_setup.logger
 logger.name = "s3repo.listFiles"
-logger.setLevel(logging.DEBUG)
 
 
 def usage():
     programName = os.path.basename(sys.argv[0])
-    logger.info(programName + " <username> <userpassword>")
+    logger.info("%s [--json] [--prefix=<prefix>] [--start-after=<file-name>] [--limit=<count>] <username> "
+                "<userpassword> [concurrency]", programName)
+    logger.info("With --json one JSON record per file is written to standard output ( logs go to standard error )")
+    logger.info("Use --start-after with file name of last record to continue listing from there")
 
 
-if len(sys.argv) != 3:
+# Optional flags can be given anywhere
+json_output = "--json" in sys.argv
+if json_output:
+    sys.argv.remove("--json")
+    logger_setup.console_to_stderr()
+
+options = {"--prefix": "", "--start-after": "", "--limit": None}
+for argument in list(sys.argv[1:]):
+    name, separator, value = argument.partition("=")
+    if separator and name in options:
+        options[name] = value
+        sys.argv.remove(argument)
+
+if options["--limit"] is not None and (not options["--limit"].isdigit() or int(options["--limit"]) < 1):
+    logger.error("Limit must be a positive number [%s]", options["--limit"])
+    sys.exit(-1)
+limit = int(options["--limit"]) if options["--limit"] is not None else None
+
+if len(sys.argv) not in (3, 4):
     programName = os.path.basename(sys.argv[0])
-    logger.error("Expected 3 arguments got [" + str(len(sys.argv)) + ") - re-run program with correct arguments")
+    logger.error("Expected 3 or 4 arguments got [%s) - re-run program with correct arguments", len(sys.argv))
     usage()
     sys.exit(-1)
 
-logger.info(
-    "About to list files for user with this info \n\r Username: [" + sys.argv[1] + "] \r\n password: [******]")
+# With concurrency tags are fetched in parallel and rows are printed as soon as they are available
+concurrency = 1
+if len(sys.argv) == 4:
+    if not sys.argv[3].isdigit() or int(sys.argv[3]) < 1:
+        logger.error("Concurrency must be a positive number [%s]", sys.argv[3])
+        sys.exit(-1)
+    concurrency = int(sys.argv[3])
+
+logger.info("About to list files for user with this info \n\r Username: [%s] \r\n password: [******]", sys.argv[1])
 
-s3repo.listFiles(bucket_name=sys.argv[1], user_password=sys.argv[2])
+arguments = {"bucket_name": sys.argv[1], "user_password": sys.argv[2], "prefix": options["--prefix"],
+             "start_after": options["--start-after"], "limit": limit, "concurrency": concurrency}
+record_mode = json_output or options["--prefix"] or options["--start-after"] or limit is not None
+
+try:
+    # Running repo daemon ( see RepoDaemon.py ) does the work with its warm connection
+    records = DaemonClient().iterate("iterFiles", **arguments)
+    try:
+        records = itertools.chain([next(records)], records)
+    except StopIteration:
+        records = iter([])
+    except DaemonUnavailable:
+        records = None
+
+    if records is None:
+        from s3repo.s3repomain import s3RepoMain
+
+        s3repo = s3RepoMain(lazy_connect=True)
+        if not record_mode:
+            s3repo.listFiles(bucket_name=sys.argv[1], user_password=sys.argv[2], concurrency=concurrency,
+                             stream=concurrency > 1)
+            sys.exit(0)
+        records = ({"key": record.key, "user_key": record.user_key, "size": record.size,
+                    "last_modified": record.last_modified.isoformat()} for record in s3repo.iterFiles(**arguments))
+
+    if record_mode:
+        for record in records:
+            if json_output:
+                print(json.dumps(record), flush=True)
+            else:
+                print(record["key"] + "\t" + record["user_key"] + "\t" + record["last_modified"] + "\t" +
+                      str(record["size"]), flush=True)
+    else:
+        # Same table listFiles prints
+        from prettytable import PrettyTable
+        x = PrettyTable()
+        x.field_names = ["File", "User key/Tag", "lastModified", "Size"]
+        for record in records:
+            x.add_row([record["key"], record["user_key"], record["last_modified"], record["size"]])
+        if len(x.rows):
+            print(x)
+        else:
+            logger.warning("User's repo is empty")
+except ValueError as e:
+    logger.error(str(e))
+    sys.exit(-1)
+except DaemonError as e:
+    logger.error("Files could not be listed - repo daemon failed: %s", e)
+    sys.exit(1)
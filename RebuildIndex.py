@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+import re
+import sys
+
+import s3repo
+from s3repo.s3repomain import *
+
+s3repo = s3RepoMain(lazy_connect=True)
+logger = logger_setup.logger
+logger.name = "s3repo.rebuildIndex"
+
+
+def usage():
+    programName = os.path.basename(sys.argv[0])
+    logger.info("%s <username> <userpassword>", programName)
+
+
+if len(sys.argv) != 3:
+    programName = os.path.basename(sys.argv[0])
+    logger.error("Expected 3 arguments got [%s) - re-run program with correct arguments", len(sys.argv))
+    usage()
+    sys.exit(-1)
+
+logger.info("About to re-build file index for user with this info \n\r Username: [%s] \r\n password: [******]",
+            sys.argv[1])
+
+s3repo.rebuild_index(user_name=sys.argv[1], user_password=sys.argv[2])
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+from s3repo.daemon import DaemonClient, DaemonError, RepoDaemon, socket_path
+from s3repo.helper import logger_setup
+
+logger = logger_setup.logger
+logger.name = "s3repo.repoDaemon"
+
+
+def usage():
+    programName = os.path.basename(sys.argv[0])
+    logger.info("%s start|stop|status [socket-path]", programName)
+    logger.info("While daemon runs UploadFile.py , GetFile.py , ListFiles.py and DeleteFile.py send their request to it "
+                "instead of connecting to AWS themselves")
+    logger.info("Default socket is [%s] ( or S3REPO_SOCKET environment variable )", socket_path())
+
+
+if len(sys.argv) not in (2, 3) or sys.argv[1] not in ("start", "stop", "status"):
+    programName = os.path.basename(sys.argv[0])
+    logger.error("Expected 1 or 2 arguments got [%s] - re-run program with correct arguments", len(sys.argv) - 1)
+    usage()
+    sys.exit(-1)
+
+path = sys.argv[2] if len(sys.argv) == 3 else None
+client = DaemonClient(path)
+
+if sys.argv[1] == "status":
+    if client.available():
+        logger.info("Repo daemon is running on [%s]", client.path)
+    else:
+        logger.info("Repo daemon is not running on [%s]", client.path)
+        sys.exit(1)
+elif sys.argv[1] == "stop":
+    if client.available():
+        try:
+            client.call("shutdown")
+        except DaemonError as e:
+            logger.error("Repo daemon on [%s] could not be stopped: %s", client.path, e)
+            sys.exit(1)
+        logger.info("Repo daemon on [%s] has been stopped", client.path)
+    else:
+        logger.warning("Repo daemon is not running on [%s]", client.path)
+else:
+    try:
+        daemon = RepoDaemon(path=path)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(-1)
+    # Pay for boto3 import , session and client creation now instead of on first request
+    daemon.repo.s3_client
+    daemon.serve()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import re
+import sys
+
+import s3repo
+from s3repo.s3repomain import *
+
+s3repo = s3RepoMain(lazy_connect=True)
+logger = logger_setup.logger
+logger.name = "s3repo.syncDirectory"
+
+
+def usage():
+    programName = os.path.basename(sys.argv[0])
+    logger.info("%s <username> <userpassword> <directory-to-upload> [key-prefix [concurrency]]", programName)
+    logger.info("Only new or changed files are uploaded ; relative path of file ( with key-prefix ) is its user-key")
+
+
+if len(sys.argv) not in (4, 5, 6):
+    programName = os.path.basename(sys.argv[0])
+    logger.error("Expected 4 to 6 arguments got [%s) - re-run program with correct arguments", len(sys.argv))
+    usage()
+    sys.exit(-1)
+
+key_prefix = sys.argv[4] if len(sys.argv) > 4 else ""
+concurrency = 8
+if len(sys.argv) == 6:
+    if not sys.argv[5].isdigit() or int(sys.argv[5]) < 1:
+        logger.error("Concurrency must be a positive number [%s]", sys.argv[5])
+        sys.exit(-1)
+    concurrency = int(sys.argv[5])
+
+logger.info("About to sync directory for user with this info \n\r Username: [%s] \r\n password: [******] \r\n "
+            "directory: %s", sys.argv[1], sys.argv[3])
+
+s3repo.syncDirectory(user_name=sys.argv[1], user_password=sys.argv[2], directory=sys.argv[3], key_prefix=key_prefix,
+                     concurrency=concurrency)
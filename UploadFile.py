@@ -1,30 +1,85 @@
 #!/usr/bin/env python3
+import os
 import re
 import sys
 
-import s3repo
-from s3repo.s3repomain import *
+from s3repo.daemon import DaemonClient, DaemonError, DaemonUnavailable
+from s3repo.helper import logger_setup
 
-s3repo = s3RepoMain()
 logger = logger_setup.logger
 logger.name = "s3repo.uploadFile"
 
 def usage():
     programName = os.path.basename(sys.argv[0])
-    logger.info(programName + " <username> <userpassword> <user-key> <file-path-to-upload>")
+    logger.info("%s [--dedup] [--compress[=gzip|zstd]] [--chunked] <username> <userpassword> <user-key> "
+                "<file-path-to-upload> [part-size-MB [concurrency]]", programName)
+    logger.info("With part size file is uploaded as resumable multipart upload - re-run same command to resume")
+    logger.info("With --dedup file content already in repo is not uploaded again - only user-key is recorded")
+    logger.info("With --compress text-like files are compressed while uploaded ( and decompressed by GetFile.py )")
+    logger.info("With --chunked file is stored as content-defined chunks - upload of changed file only sends chunks "
+                "that are not in repo yet")
+    logger.info("Use - as file path to upload data piped to standard input ( stored under user-key as file name )")
 
 
-if len(sys.argv) != 5:
+# Optional flag can be given anywhere
+dedup = "--dedup" in sys.argv
+if dedup:
+    sys.argv.remove("--dedup")
+chunked = "--chunked" in sys.argv
+if chunked:
+    sys.argv.remove("--chunked")
+compress = False
+for argument in [argument for argument in sys.argv if re.match(r"^--compress(=.*)?$", argument)]:
+    compress = argument.partition("=")[2] or True
+    sys.argv.remove(argument)
+
+if len(sys.argv) not in (5, 6, 7):
     programName = os.path.basename(sys.argv[0])
-    logger.error("Expected 5 arguments got [" + str(len(sys.argv)) + ") - re-run program with correct arguments")
+    logger.error("Expected 5 to 7 arguments got [%s) - re-run program with correct arguments", len(sys.argv))
     usage()
     sys.exit(-1)
 
-logger.info(
-    "About to upload file for user with this info \n\r Username: [" + sys.argv[1] + "] \r\n password: [******] \r\n "
-                                                                                    "user-key: "+sys.argv[3]+"")
+for number in sys.argv[5:]:
+    if not number.isdigit() or int(number) < 1:
+        logger.error("Part size and concurrency must be positive numbers [%s]", number)
+        usage()
+        sys.exit(-1)
+
+multipart = len(sys.argv) > 5
+part_size = int(sys.argv[5]) * 1024 * 1024 if multipart else 8 * 1024 * 1024
+concurrency = int(sys.argv[6]) if len(sys.argv) > 6 else 4
+
+logger.info("About to upload file for user with this info \n\r Username: [%s] \r\n password: [******] \r\n "
+            "user-key: %s", sys.argv[1], sys.argv[3])
+
+if sys.argv[4] != "-":
+    # Running repo daemon ( see RepoDaemon.py ) does the work with its warm connection ; data piped to stdin is always
+    # sent by this program
+    try:
+        if not DaemonClient().call("uploadFile", user_name=sys.argv[1], user_password=sys.argv[2],
+                                   file_key=sys.argv[3], file=os.path.abspath(sys.argv[4]), multipart=multipart,
+                                   part_size=part_size, concurrency=concurrency, dedup=dedup,
+                                   compress=compress, chunked=chunked):
+            logger.error("File could not be uploaded - see repo daemon log")
+            sys.exit(1)
+        logger.info("File [%s] has been uploaded ( by repo daemon )", sys.argv[4])
+        sys.exit(0)
+    except DaemonUnavailable:
+        pass
+    except DaemonError as e:
+        logger.error("File could not be uploaded - repo daemon failed: %s", e)
+        sys.exit(1)
+
+from s3repo.s3repomain import s3RepoMain
 
-s3repo.uploadFile(user_name=sys.argv[1],user_password=sys.argv[2],file_key=sys.argv[3],file=sys.argv[4])
+s3repo = s3RepoMain(lazy_connect=True)
+if sys.argv[4] == "-":
+    s3repo.uploadStream(user_name=sys.argv[1], user_password=sys.argv[2], file_key=sys.argv[3],
+                        stream=sys.stdin.buffer, chunk_size=part_size, concurrency=concurrency)
+else:
+    s3repo.uploadFile(user_name=sys.argv[1],user_password=sys.argv[2],file_key=sys.argv[3],file=sys.argv[4],
+                      multipart=multipart, part_size=part_size, concurrency=concurrency, dedup=dedup,
+                      compress=compress, chunked=chunked)
 
 
 # print('Argument List:', str(sys.argv))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import re
+import sys
+from getpass import getpass
+
+import s3repo
+from s3repo.s3repomain import *
+
+s3repo = s3RepoMain(lazy_connect=True)
+logger = logger_setup.logger
+logger.name = "s3repo.usageReport"
+
+
+def usage():
+    programName = os.path.basename(sys.argv[0])
+    logger.info("%s [--json] [concurrency [largest-files-per-user]]", programName)
+    logger.info("With --json one JSON record per user is written to standard output as soon as user is scanned")
+
+
+# Optional flag can be given anywhere
+json_output = "--json" in sys.argv
+if json_output:
+    sys.argv.remove("--json")
+    logger_setup.console_to_stderr()
+
+if len(sys.argv) > 3:
+    logger.error("Expected at most 2 arguments got [%s] - re-run program with correct arguments", len(sys.argv) - 1)
+    usage()
+    sys.exit(-1)
+
+for number in sys.argv[1:]:
+    if not number.isdigit() or int(number) < 1:
+        logger.error("Concurrency and largest files per user must be positive numbers [%s]", number)
+        usage()
+        sys.exit(-1)
+
+# Number of user repos scanned in parallel
+concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+top = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+logger.info("About to create usage report of all users")
+
+input_admin_password = getpass("Enter admin password: ")
+if json_output:
+    try:
+        for user_usage in s3repo.iter_usage(input_admin_password, concurrency=concurrency, top=top):
+            print(json.dumps(user_usage._asdict()), flush=True)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(-1)
+elif s3repo.usage_report(input_admin_password, concurrency=concurrency, top=top) is False:
+    sys.exit(-1)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+"""
+Long running repo daemon - one warmed s3RepoMain ( S3 connection pool , auth cache , index ) serves requests of command
+line programs over local Unix socket so each command does not pay for interpreter warm up , boto3 import and session
+
+Protocol is JSON lines - client sends one request per line :
+    {"method": "getFile", "kwargs": {...}}
+daemon answers with zero or more item lines ( only for generator methods such as iterFiles ) and one final line :
+    {"item": {...}}
+    {"ok": true, "result": <return value>}   or   {"ok": false, "error": "<message>", "type": "<exception class>"}
+Socket file is only accessible by user that started daemon ( mode 0600 ) ; passwords are checked by repo as usual
+This module does not import s3repomain ( or boto3 ) unless daemon itself is started so clients stay cheap
+"""
+
+SOCKET_ENV = "S3REPO_SOCKET"
+DEFAULT_SOCKET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../state/s3repo.sock")
+CONNECT_TIMEOUT = 0.5
+
+# Methods of s3RepoMain that can be called through daemon
+ALLOWED_METHODS = frozenset(["authenticate_user", "uploadFile", "getFile", "deleteFile", "iterFiles"])
+GENERATOR_METHODS = frozenset(["iterFiles"])
+
+
+class DaemonUnavailable(Exception):
+    """
+    No daemon is listening on socket - caller should do the work itself
+    """
+    pass
+
+
+class DaemonError(Exception):
+    """
+    Daemon ran request but it failed with exception other than ValueError
+    """
+    pass
+
+
+def socket_path(path=None):
+    return path or os.environ.get(SOCKET_ENV) or DEFAULT_SOCKET
+
+
+def to_json(value):
+    # FileRecord and other namedtuples go as objects , dates as ISO text
+    if hasattr(value, "_asdict"):
+        return {name: to_json(field) for name, field in value._asdict().items()}
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+class DaemonClient(object):
+
+    def __init__(self, path=None):
+        self.path = socket_path(path)
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(CONNECT_TIMEOUT)
+        try:
+            connection.connect(self.path)
+        except (FileNotFoundError, ConnectionRefusedError, socket.timeout) as e:
+            connection.close()
+            raise DaemonUnavailable("No repo daemon at [" + self.path + "]: " + str(e))
+        # Operations such as upload can take long - only connect is limited
+        connection.settimeout(None)
+        return connection
+
+    def available(self):
+        """
+        :return: True if daemon answers on socket
+        """
+        try:
+            self.call("ping")
+            return True
+        except (DaemonUnavailable, DaemonError, OSError):
+            return False
+
+    def iterate(self, method, **kwargs):
+        """
+        Send request and return what daemon answers
+        :param method: s3RepoMain method name
+        :param kwargs: its arguments ( JSON serialisable ; local paths must be absolute )
+        :return: generator of items ; return value of method is value of StopIteration
+        :raise DaemonUnavailable: if daemon is not running
+        :raise ValueError: if method raised ValueError ( e.g. authentication failed )
+        :raise DaemonError: if method raised other exception
+        """
+        connection = self._connect()
+        try:
+            connection.sendall((json.dumps({"method": method, "kwargs": kwargs}) + "\n").encode("utf-8"))
+            with connection.makefile("r", encoding="utf-8") as response:
+                for line in response:
+                    message = json.loads(line)
+                    if "item" in message:
+                        yield message["item"]
+                    elif message.get("ok"):
+                        return message.get("result")
+                    elif message.get("type") == "ValueError":
+                        raise ValueError(message.get("error"))
+                    else:
+                        raise DaemonError(message.get("type", "") + ": " + message.get("error", ""))
+            raise DaemonError("Daemon closed connection without answer")
+        finally:
+            connection.close()
+
+    def call(self, method, **kwargs):
+        """
+        Same as iterate for methods that do not produce items
+        :return: return value of method
+        """
+        items = self.iterate(method, **kwargs)
+        while True:
+            try:
+                next(items)
+            except StopIteration as e:
+                return e.value
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+                method = request.get("method")
+                kwargs = request.get("kwargs") or {}
+                if method == "ping":
+                    self._send({"ok": True, "result": "pong"})
+                elif method == "shutdown":
+                    self._send({"ok": True, "result": None})
+                    # shutdown waits for serve_forever - must not be called from its own thread
+                    threading.Thread(target=self.server.shutdown).start()
+                    return
+                elif method in GENERATOR_METHODS:
+                    for item in getattr(self.server.repo, method)(**kwargs):
+                        self._send({"item": to_json(item)})
+                    self._send({"ok": True, "result": None})
+                elif method in ALLOWED_METHODS:
+                    self._send({"ok": True, "result": to_json(getattr(self.server.repo, method)(**kwargs))})
+                else:
+                    self._send({"ok": False, "error": "Unknown method [" + str(method) + "]", "type": "DaemonError"})
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                self.server.repo.logger.error("Daemon request failed: %s", e)
+                try:
+                    self._send({"ok": False, "error": str(e), "type": type(e).__name__})
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+class RepoDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, repo=None, path=None):
+        """
+        :param repo: s3RepoMain to serve - created ( lazy connect ) if not given
+        :param path: socket path ( default S3REPO_SOCKET environment variable or state/s3repo.sock )
+        :raise RuntimeError: if another daemon is already listening on path
+        """
+        if repo is None:
+            from s3repo.s3repomain import s3RepoMain
+            repo = s3RepoMain(lazy_connect=True)
+        self.repo = repo
+        self.path = socket_path(path)
+        if os.path.exists(self.path):
+            if DaemonClient(self.path).available():
+                raise RuntimeError("Repo daemon is already running on [" + self.path + "]")
+            # Left over by daemon that was killed
+            os.remove(self.path)
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(folder):
+            os.makedirs(folder, mode=0o700)
+        # Socket is created with umask applied - make sure nobody else can connect even for a moment
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.path, stat.S_IRUSR | stat.S_IWUSR)
+
+    def serve(self):
+        """
+        Serve until shutdown request ( or Ctrl+C ) - socket file is removed at the end
+        :return:
+        """
+        self.repo.logger.info("Repo daemon listening on [%s]", self.path)
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.repo.logger.info("Repo daemon stopped")
+
+
+if __name__ == "__main__":
+    RepoDaemon().serve()
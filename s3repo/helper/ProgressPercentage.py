@@ -1,27 +1,169 @@
+import itertools
 import os
 import sys
 import threading
+import time
+import weakref
 
 """
 This code has been borrowed from : https://boto3.amazonaws.com/v1/documentation/api/latest/guide/s3-uploading-files.html
+
+All transfers running in program share one progress line ( on stderr ) that is redrawn at most every REFRESH_SECONDS
+and shows bytes , throughput and ETA of whole batch ; when stderr is not a terminal nothing is drawn
+S3REPO_PROGRESS environment variable : auto ( default ) , on ( draw even when not a terminal ) or off
 """
 
+PROGRESS_ENV = "S3REPO_PROGRESS"
+REFRESH_SECONDS = 0.2
+
+
+class TransferProgress(object):
+
+    def __init__(self, stream=None, interval=REFRESH_SECONDS, enabled=None):
+        """
+        :param stream: where progress line is drawn ( default stderr )
+        :param interval: minimum seconds between two redraws
+        :param enabled: draw progress - default is S3REPO_PROGRESS environment variable or if stream is a terminal
+        """
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        if enabled is None:
+            setting = os.environ.get(PROGRESS_ENV, "auto").lower()
+            enabled = setting in ("on", "1", "always") or \
+                (setting == "auto" and hasattr(self.stream, "isatty") and self.stream.isatty())
+        self.enabled = enabled
+        self._ids = itertools.count()
+        self._transfers = {}
+        self._lock = threading.Lock()
+        self._last_draw = 0.0
+        self._width = 0
+        self._reset_batch()
+
+    def _reset_batch(self):
+        # Batch is all transfers that ran while progress line was on screen
+        self._batch_start = None
+        self._batch_files = 0
+        self._batch_size = 0
+        self._batch_seen = 0
+        self._batch_resumed = 0
+        self._batch_labels = set()
+        self._batch_name = None
+        self._drawn = False
+
+    def add(self, label, name, size):
+        """
+        :return: id of transfer for update / remove
+        """
+        with self._lock:
+            transfer_id = next(self._ids)
+            if not self._transfers:
+                self._reset_batch()
+                self._batch_start = time.monotonic()
+            self._transfers[transfer_id] = [label, name, size, 0]
+            self._batch_files += 1
+            self._batch_size += size
+            self._batch_labels.add(label)
+            self._batch_name = name
+            return transfer_id
+
+    def update(self, transfer_id, bytes_amount, resumed=False):
+        with self._lock:
+            transfer = self._transfers.get(transfer_id)
+            if transfer is None:
+                return
+            transfer[3] += bytes_amount
+            self._batch_seen += bytes_amount
+            if resumed:
+                self._batch_resumed += bytes_amount
+            if transfer[3] >= transfer[2]:
+                self._finish(transfer_id)
+            elif time.monotonic() - self._last_draw >= self.interval:
+                self._draw()
+
+    def remove(self, transfer_id):
+        """
+        Stop showing transfer ( it failed or its size was not reached )
+        """
+        with self._lock:
+            if transfer_id in self._transfers:
+                self._finish(transfer_id)
+
+    def _finish(self, transfer_id):
+        label, name, size, seen = self._transfers.pop(transfer_id)
+        # Unfinished part of failed transfer is not counted any more
+        self._batch_size -= max(0, size - seen)
+        if self._drawn or not self._transfers:
+            self._draw()
+        if not self._transfers:
+            self.stream.write("\n")
+            self.stream.flush()
+            self._width = 0
+
+    def _draw(self):
+        now = time.monotonic()
+        self._last_draw = now
+        elapsed = now - self._batch_start
+        throughput = (self._batch_seen - self._batch_resumed) / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self._batch_size - self._batch_seen)
+        percentage = (self._batch_seen / self._batch_size) * 100 if self._batch_size else 100.0
+        label = next(iter(self._batch_labels)) if len(self._batch_labels) == 1 else "Transferring"
+        if self._batch_files == 1:
+            title = "%s: %s" % (label, self._batch_name)
+        else:
+            title = "%s: %d/%d files" % (label, self._batch_files - len(self._transfers), self._batch_files)
+        eta = "%d:%02d" % divmod(int(remaining / throughput), 60) if throughput > 0 else "--:--"
+        line = "%s  %.2f / %.2f MB  (%.2f%%)  %.2f MB/s  ETA %s" % (
+            title, self._batch_seen / 1000000, self._batch_size / 1000000, percentage, throughput / 1000000, eta)
+        # Pad over longer line drawn before
+        self.stream.write("\r" + line.ljust(self._width))
+        self.stream.flush()
+        self._width = len(line)
+        self._drawn = True
+
+
+# Shared by all transfers of program so concurrent transfers draw one line
+reporter = TransferProgress()
+
 
 class ProgressPercentage(object):
 
-    def __init__(self, filename):
-        self._filename = filename
-        self._size = float(os.path.getsize(filename))
-        self._seen_so_far = 0
+    def __init__(self, filename, size=None, label="Uploading", progress=None):
+        # size has to be given when file is not on local disk yet ( download )
+        self._progress = progress if progress is not None else reporter
+        self._id = None
+        if self._progress.enabled:
+            self._id = self._progress.add(label, filename, os.path.getsize(filename) if size is None else size)
+            # Transfer that stops early ( error ) leaves progress line when callback is dropped
+            weakref.finalize(self, self._progress.remove, self._id)
+
+    def resume(self, bytes_amount):
+        # Bytes transferred by earlier ( interrupted ) run - counted in progress but not in throughput
+        if self._id is not None:
+            self._progress.update(self._id, bytes_amount, resumed=True)
+
+    def __call__(self, bytes_amount):
+        if self._id is not None:
+            self._progress.update(self._id, bytes_amount)
+
+
+def progress_callback(filename, size=None, label="Uploading"):
+    """
+    :return: ProgressPercentage for transfer or None when progress is not drawn ( boto3 then skips callbacks )
+    """
+    if not reporter.enabled:
+        return None
+    return ProgressPercentage(filename, size=size, label=label)
+
+
+class ByteCounter(object):
+    """
+    Callback that only counts bytes - for streams where total size is not known up front
+    """
+
+    def __init__(self):
+        self.total = 0
         self._lock = threading.Lock()
 
     def __call__(self, bytes_amount):
-        # To simplify, assume this is hooked up to a single filename
         with self._lock:
-            self._seen_so_far += bytes_amount
-            percentage = (self._seen_so_far / self._size) * 100
-            sys.stdout.write(
-                "\rUploading: %s  %s / %s  (%.2f%%)" % (
-                    self._filename, (self._seen_so_far / 1000000), (self._size / 1000000),
-                    percentage))
-            sys.stdout.flush()
+            self.total += bytes_amount
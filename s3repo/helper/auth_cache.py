@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+"""
+In-process cache of users password hash ( as stored in users bucket ) so repeated operations by same user do not
+have to go to users bucket every time ; password itself is still checked against the hash on every call
+"""
+
+
+class AuthCache(object):
+
+    def __init__(self, ttl_seconds=30, max_entries=1024):
+        """
+        :param ttl_seconds: how long cached entry is valid ; 0 disables the cache
+        :param max_entries: maximum number of users kept - least recently used user is dropped first
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get(self, user_name):
+        """
+        :param user_name:
+        :return: cached password hash or None if user is not cached or entry has expired
+        """
+        if not self.enabled():
+            return None
+        with self._lock:
+            entry = self._entries.get(user_name)
+            if entry is None:
+                return None
+            password_hash, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[user_name]
+                return None
+            self._entries.move_to_end(user_name)
+            return password_hash
+
+    def put(self, user_name, password_hash):
+        if not self.enabled():
+            return
+        with self._lock:
+            self._entries[user_name] = (password_hash, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_name=None):
+        """
+        Drop one user from cache or everything when user_name is None
+        :param user_name:
+        :return:
+        """
+        with self._lock:
+            if user_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_name, None)
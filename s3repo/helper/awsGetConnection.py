@@ -2,28 +2,38 @@ import json
 import sys
 from pathlib import Path
 
-import boto3
-import botocore
 from botocore.exceptions import NoRegionError, NoCredentialsError
 from botocore.exceptions import ClientError
 
 
 class awsHelper:
 
-    def __init__(self, region_name, profile="default"):
-        print('Python version: ' + sys.version)
-        print('Boto3 version: ' + boto3.__version__)
+    def __init__(self, region_name, profile="default", verbose=True):
+        # boto3 is imported only when it is needed - importing it is most of the program start up time
+        if verbose:
+            import boto3
+            print('Python version: ' + sys.version)
+            print('Boto3 version: ' + boto3.__version__)
         self.region_name = region_name
         self.profile = profile
 
-    def get_aws_connection(self):
+    def get_aws_connection(self, validate=True):
+        """
+        Create boto3 session
+        :param validate: when True make one ListBuckets call to make sure credentials work ; when False only check that
+        credentials are configured ( no network call ) - any problem will then show up on first real request
+        :return: boto3 session
+        """
         try:
             session = self.getsession(self.region_name)
-            s3 = session.resource('s3')
-            for bucket in s3.buckets.all():
-                break;
-
-            print("Connection to AWS was successful");
+            if validate:
+                s3 = session.resource('s3')
+                for bucket in s3.buckets.all():
+                    break;
+
+                print("Connection to AWS was successful");
+            elif session.get_credentials() is None:
+                raise NoCredentialsError()
             return session
 
         except (NoRegionError, NoCredentialsError) as e:
@@ -35,6 +45,8 @@ class awsHelper:
             sys.exit()
 
     def getsession(self, region_name=None):
+        import boto3
+        import botocore.session
         session = botocore.session.Session(profile=self.profile)
         try:
             session3 = boto3.session.Session(region_name=region_name, profile_name=self.profile)
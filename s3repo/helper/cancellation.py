@@ -0,0 +1,47 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+"""
+Cancellation of running repo operations
+
+Caller ( e.g. AsyncS3Repo when awaiting task is cancelled ) runs operation inside cancellable( event ) and sets event
+to stop it ; transfer loops ( multipart parts , ranged download parts , chunks , sync files ) call check_cancelled
+between units of work so operation stops after parts already in flight - what was done so far is kept as checkpoint
+Event is carried in context so worker threads of ContextThreadPoolExecutor see it too
+Transfers handed to boto3 managed transfer ( plain upload / download , compressed upload ) can't be stopped half way
+"""
+
+_cancel_event = contextvars.ContextVar("s3repo_cancel_event", default=None)
+
+
+class OperationCancelled(RuntimeError):
+    """
+    Operation was cancelled by its caller
+    """
+    pass
+
+
+@contextmanager
+def cancellable(event=None):
+    """
+    Run code inside with block so it can be cancelled by setting event
+    :param event: threading.Event - new one is created if not given
+    :return: the event
+    """
+    event = event if event is not None else threading.Event()
+    token = _cancel_event.set(event)
+    try:
+        yield event
+    finally:
+        _cancel_event.reset(token)
+
+
+def check_cancelled():
+    """
+    :return:
+    :raise OperationCancelled: if current operation has been cancelled
+    """
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise OperationCancelled("Operation has been cancelled")
@@ -0,0 +1,371 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from s3repo.helper.cancellation import check_cancelled
+from s3repo.helper.instrumentation import ContextThreadPoolExecutor
+from s3repo.helper.repo_index import RESERVED_PREFIX, is_reserved_key
+
+"""
+Chunked storage of large files - file is cut into content-defined chunks , each chunk is stored once per repo under
+reserved prefix by its sha256 and file itself is stored as small JSON manifest ( list of chunks ) ; re-upload of changed
+file only sends chunks that are not in repo yet
+
+Chunk boundaries depend only on content around them ( not on offset ) so insert or delete in file changes only chunks
+near the change : boundary candidates are line ends and candidate becomes boundary when crc32 of WINDOW bytes before
+it has its low bits zero ; data without line ends is cut at MAX_CHUNK_SIZE
+Per byte rolling hash ( gear / Rabin ) is not used as in pure Python it runs at few MB/s - search for candidates and
+crc32 run in C
+
+Chunks are shared by all chunked files of repo so deleting or overwriting file does not delete its chunks ;
+collect_chunks ( run by rebuild_index ) deletes chunks no manifest uses any more
+"""
+
+CHUNK_PREFIX = RESERVED_PREFIX + "chunks/"
+MANIFEST_METADATA = "s3repo-manifest"
+MANIFEST_VERSION = 1
+
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+WINDOW = 64
+BOUNDARY_MASK = (1 << 12) - 1  # ~0.5 MB chunks for text , ~1.3 MB for binary data
+CANDIDATE = b"\n"
+READ_CHUNK_SIZE = 1024 * 1024
+# Largest manifest - objects bigger than this are not checked for being manifests ( ~75 bytes per chunk )
+MAX_MANIFEST_SIZE = 16 * 1024 * 1024
+# Unused chunks younger than this are kept - they may belong to upload whose manifest is not written yet
+GC_GRACE_SECONDS = 24 * 60 * 60
+
+
+def chunk_key(sha256):
+    return CHUNK_PREFIX + sha256
+
+
+def find_boundary(data, start, end):
+    """
+    :param data: bytes
+    :param start: first position where chunk may end ( at least WINDOW )
+    :param end: last position where chunk may end
+    :return: end of chunk - position after first boundary in data[start:end] or end if there is none
+    """
+    position = data.find(CANDIDATE, start, end)
+    while position >= 0:
+        if not zlib.crc32(data[position - WINDOW:position]) & BOUNDARY_MASK:
+            return position + 1
+        position = data.find(CANDIDATE, position + 1, end)
+    return end
+
+
+def iter_content_chunks(stream, min_size=MIN_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """
+    Cut stream into content-defined chunks - at most max_size + READ_CHUNK_SIZE bytes are held in memory
+    :param stream: binary stream
+    :param min_size:
+    :param max_size:
+    :return: generator of bytes
+    """
+    min_size = max(min_size, WINDOW)
+    data = b""
+    eof = False
+    while True:
+        while not eof and len(data) < max_size:
+            block = stream.read(READ_CHUNK_SIZE)
+            if block:
+                data += block
+            else:
+                eof = True
+        if len(data) <= min_size:
+            if data:
+                yield data
+            return
+        # Until end of stream data holds at least max_size bytes so whole search range is there
+        end = find_boundary(data, min_size, min(len(data), max_size))
+        yield data[:end]
+        data = data[end:]
+
+
+def load_manifest(response):
+    """
+    :param response: get_object response of file
+    :return: manifest dictionary or None if file is not stored as chunks
+    """
+    if MANIFEST_METADATA not in response.get("Metadata", {}):
+        return None
+    manifest = json.loads(response["Body"].read().decode("utf-8"))
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("Unknown chunk manifest version [" + str(manifest.get("version")) + "]")
+    return manifest
+
+
+class ChunkedUploader(object):
+
+    def __init__(self, s3_client, bucket_name, object_key, file, concurrency=4, callback=None, extra_args=None):
+        """
+        :param s3_client:
+        :param bucket_name:
+        :param object_key: key of manifest ( name of file in repo )
+        :param file: local file to upload
+        :param concurrency: number of chunks uploaded in parallel
+        :param callback: called with number of bytes of file as they are processed ( sent or found in repo )
+        :param extra_args: extra arguments for put_object of manifest e.g. Metadata
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.file = file
+        self.concurrency = max(1, concurrency)
+        self.callback = callback
+        self.extra_args = extra_args or {}
+        self.chunks = []
+        self.sent_chunks = 0
+        self.sent_bytes = 0
+        self._lock = threading.Lock()
+
+    def upload(self):
+        """
+        Upload chunks missing in repo and then manifest - manifest goes after chunks it uses
+        :return: response of put_object of manifest
+        """
+        existing = self.existing_chunks()
+        scheduled = set()
+        size = 0
+        pending = deque()
+        with ContextThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            with open(self.file, "rb") as f:
+                for data in iter_content_chunks(f):
+                    sha256 = hashlib.sha256(data).hexdigest()
+                    self.chunks.append([sha256, len(data)])
+                    size += len(data)
+                    if sha256 in existing or sha256 in scheduled:
+                        if self.callback is not None:
+                            self.callback(len(data))
+                        continue
+                    scheduled.add(sha256)
+                    # Bound memory - at most 2 x concurrency chunks wait for upload
+                    if len(pending) >= 2 * self.concurrency:
+                        pending.popleft().result()
+                    pending.append(executor.submit(self._upload_chunk, sha256, data))
+            while pending:
+                pending.popleft().result()
+
+        manifest = {"version": MANIFEST_VERSION, "size": size, "chunks": self.chunks}
+        extra_args = dict(self.extra_args)
+        extra_args["Metadata"] = dict(extra_args.get("Metadata", {}), **{MANIFEST_METADATA: str(MANIFEST_VERSION)})
+        response = self.s3_client.put_object(Bucket=self.bucket_name, Key=self.object_key, Body=json.dumps(manifest),
+                                             ContentType="application/json", **extra_args)
+
+        # Chunks found in repo at start could have been deleted by collect_chunks that read manifests before this one
+        # was written - checked after manifest is there so collection starting now keeps them
+        reused = set(sha256 for sha256, length in self.chunks) & existing
+        if reused:
+            missing = reused - self.existing_chunks()
+            if missing:
+                self._upload_missing(missing)
+        return response
+
+    def existing_chunks(self):
+        """
+        :return: sha256 of all chunks already in repo
+        """
+        existing = set()
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=CHUNK_PREFIX):
+            for item in page.get("Contents", []):
+                existing.add(item["Key"][len(CHUNK_PREFIX):])
+        return existing
+
+    def _upload_missing(self, missing):
+        with open(self.file, "rb") as f:
+            for data in iter_content_chunks(f):
+                sha256 = hashlib.sha256(data).hexdigest()
+                if sha256 in missing:
+                    missing.discard(sha256)
+                    self._upload_chunk(sha256, data, report=False)
+
+    def _upload_chunk(self, sha256, data, report=True):
+        check_cancelled()
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=chunk_key(sha256), Body=data)
+        with self._lock:
+            self.sent_chunks += 1
+            self.sent_bytes += len(data)
+        if report and self.callback is not None:
+            self.callback(len(data))
+
+
+def collect_chunks(s3_client, bucket_name, grace_seconds=GC_GRACE_SECONDS):
+    """
+    Delete chunks that are not used by any manifest in repo
+    Every object small enough to be manifest is checked with head_object ( one request per such object ) and
+    manifests are read ; chunks newer than grace_seconds are kept even if unused
+    Manifests are listed once more right before chunks are deleted so file uploaded meanwhile ( which may reuse old
+    chunks ) keeps its chunks ; upload that writes its manifest after that re-checks its chunks itself
+    :param s3_client:
+    :param bucket_name:
+    :param grace_seconds:
+    :return: ( dict of manifest object key -> file size , number of chunks deleted , bytes freed )
+    :raise RuntimeError: if S3 refused to delete some of the chunks
+    """
+    oldest = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+    chunks = []
+    manifests = _read_manifests(s3_client, bucket_name, {}, chunks)
+    used = set()
+    for etag, manifest in manifests.values():
+        used.update(sha256 for sha256, length in manifest["chunks"])
+    unused = [s3_object for s3_object in chunks
+              if s3_object["Key"][len(CHUNK_PREFIX):] not in used and s3_object["LastModified"] <= oldest]
+    if unused:
+        # Only new or re-written files are read again
+        manifests = _read_manifests(s3_client, bucket_name, manifests)
+        for etag, manifest in manifests.values():
+            used.update(sha256 for sha256, length in manifest["chunks"])
+        unused = [s3_object for s3_object in unused if s3_object["Key"][len(CHUNK_PREFIX):] not in used]
+
+    failed = []
+    for start in range(0, len(unused), 1000):
+        response = s3_client.delete_objects(Bucket=bucket_name,
+                                            Delete={"Objects": [{"Key": s3_object["Key"]} for s3_object in
+                                                                unused[start:start + 1000]], "Quiet": True})
+        failed.extend(response.get("Errors", []))
+    if failed:
+        raise RuntimeError("Failed to delete [" + str(len(failed)) + "] unused chunk(s) from repo [" + bucket_name +
+                           "] first error: " + failed[0]["Key"] + " - " + failed[0].get("Code", ""))
+    sizes = {object_key: manifest["size"] for object_key, (etag, manifest) in manifests.items()}
+    return sizes, len(unused), sum(s3_object["Size"] for s3_object in unused)
+
+
+def _read_manifests(s3_client, bucket_name, known, chunks=None):
+    """
+    :param known: manifests read before - object key -> ( ETag , manifest ) ; unchanged ones are not read again
+    :param chunks: list that gets listed chunk objects ( None = chunks are not needed )
+    :return: object key -> ( ETag , manifest ) of all manifests in repo
+    """
+    manifests = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name):
+        for s3_object in page.get("Contents", []):
+            if s3_object["Key"].startswith(CHUNK_PREFIX):
+                if chunks is not None:
+                    chunks.append(s3_object)
+                continue
+            if is_reserved_key(s3_object["Key"]) or s3_object["Size"] > MAX_MANIFEST_SIZE:
+                continue
+            if s3_object["Key"] in known and known[s3_object["Key"]][0] == s3_object["ETag"]:
+                manifests[s3_object["Key"]] = known[s3_object["Key"]]
+                continue
+            try:
+                response = s3_client.head_object(Bucket=bucket_name, Key=s3_object["Key"])
+                if MANIFEST_METADATA not in response.get("Metadata", {}):
+                    continue
+                response = s3_client.get_object(Bucket=bucket_name, Key=s3_object["Key"])
+                manifests[s3_object["Key"]] = (response["ETag"], load_manifest(response))
+            except ClientError as e:
+                # File deleted after listing - its chunks are not needed
+                if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                    continue
+                raise e
+    return manifests
+
+
+class ChunkedDownloader(object):
+
+    def __init__(self, s3_client, bucket_name, manifest, destination, concurrency=4, callback=None):
+        """
+        :param s3_client:
+        :param bucket_name:
+        :param manifest: manifest of file ( see load_manifest )
+        :param destination: final path of downloaded file
+        :param concurrency: number of chunks downloaded in parallel
+        :param callback: called with number of bytes as they are written
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.manifest = manifest
+        self.destination = destination
+        self.temp_file = destination + ".s3repo-part"
+        self.concurrency = max(1, concurrency)
+        self.callback = callback
+
+    def download(self):
+        """
+        Fetch chunks in parallel into temporary file ( chunk used more than once is fetched once ) and rename it to
+        destination when all are there
+        :return: size of file
+        :raise ValueError: if chunk content does not match its sha256
+        """
+        offsets = {}
+        offset = 0
+        for sha256, length in self.manifest["chunks"]:
+            offsets.setdefault(sha256, []).append(offset)
+            offset += length
+        with open(self.temp_file, "wb") as f:
+            f.truncate(offset)
+        with ContextThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self._download_chunk, offsets.items()))
+        os.replace(self.temp_file, self.destination)
+        return offset
+
+    def _download_chunk(self, item):
+        check_cancelled()
+        sha256, offsets = item
+        data = read_chunk(self.s3_client, self.bucket_name, sha256)
+        with open(self.temp_file, "r+b") as f:
+            for offset in offsets:
+                f.seek(offset)
+                f.write(data)
+                if self.callback is not None:
+                    self.callback(len(data))
+
+
+def read_chunk(s3_client, bucket_name, sha256):
+    """
+    :return: content of chunk
+    :raise ValueError: if content does not match its sha256
+    """
+    data = s3_client.get_object(Bucket=bucket_name, Key=chunk_key(sha256))["Body"].read()
+    if hashlib.sha256(data).hexdigest() != sha256:
+        raise ValueError("Chunk [" + sha256 + "] is corrupted")
+    return data
+
+
+class ChunkedStream(object):
+    """
+    Content of chunked file as stream - read( size ) , readinto( buffer ) and iter_chunks( chunk_size ) ; chunks are
+    fetched one after another so only one chunk is held in memory
+    """
+
+    def __init__(self, s3_client, bucket_name, manifest):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self._chunks = deque(sha256 for sha256, length in manifest["chunks"])
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(self.iter_chunks())
+        while len(self._buffer) < size and self._chunks:
+            self._buffer += read_chunk(self.s3_client, self.bucket_name, self._chunks.popleft())
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def iter_chunks(self, chunk_size=READ_CHUNK_SIZE):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self._chunks.clear()
+        self._buffer = bytearray()
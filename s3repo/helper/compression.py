@@ -0,0 +1,178 @@
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+Streaming compression of repo files
+
+File is compressed while it is read for upload and codec is recorded in object metadata ( s3repo-codec ) ; download
+and read of such object decompress while data arrives so compressed copy is never written to local disk
+zstd is used when zstandard package is installed , gzip otherwise
+"""
+
+CODEC_METADATA = "s3repo-codec"
+GZIP = "gzip"
+ZSTD = "zstd"
+CODECS = (GZIP, ZSTD) if zstandard is not None else (GZIP,)
+DEFAULT_CODEC = ZSTD if zstandard is not None else GZIP
+
+READ_CHUNK_SIZE = 1024 * 1024
+SAMPLE_SIZE = 64 * 1024
+# Sample has to shrink at least this much for compression to be worth it
+MAX_SAMPLE_RATIO = 0.9
+
+COMPRESSIBLE_EXTENSIONS = frozenset([".txt", ".log", ".csv", ".tsv", ".json", ".xml", ".html", ".htm", ".md", ".yaml",
+                                     ".yml", ".sql", ".ini", ".conf", ".py", ".js", ".css", ".out"])
+# Already compressed formats - compressing them again only costs CPU
+INCOMPRESSIBLE_EXTENSIONS = frozenset([".gz", ".tgz", ".zst", ".bz2", ".xz", ".zip", ".7z", ".rar", ".jar", ".jpg",
+                                       ".jpeg", ".png", ".gif", ".webp", ".mp3", ".mp4", ".mkv", ".avi", ".mov",
+                                       ".pdf", ".docx", ".xlsx", ".pptx", ".parquet"])
+
+
+def choose_codec(file, codec=None):
+    """
+    Pick codec for file - by extension and if that does not tell by compressing sample from start of file
+    :param file:
+    :param codec: codec to use when file is worth compressing ( default zstd if available else gzip )
+    :return: codec name or None if file should be stored as it is
+    """
+    codec = codec or DEFAULT_CODEC
+    if codec not in CODECS:
+        raise ValueError("Unknown or unavailable compression codec [" + codec + "] - use one of " + ", ".join(CODECS))
+    extension = os.path.splitext(file)[1].lower()
+    if extension in INCOMPRESSIBLE_EXTENSIONS:
+        return None
+    if extension in COMPRESSIBLE_EXTENSIONS:
+        return codec
+    with open(file, "rb") as f:
+        sample = f.read(SAMPLE_SIZE)
+    if not sample:
+        return None
+    return codec if len(zlib.compress(sample, 1)) <= len(sample) * MAX_SAMPLE_RATIO else None
+
+
+def _compressor(codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    # wbits 31 gives gzip header so object can also be read with gunzip
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def _decompressor(codec):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ValueError("File is compressed with zstd - install zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == GZIP:
+        return zlib.decompressobj(31)
+    raise ValueError("Unknown compression codec [" + str(codec) + "]")
+
+
+class CompressingReader(object):
+    """
+    Read-only stream that gives compressed content of source stream ( for upload_fileobj )
+    """
+
+    def __init__(self, source, codec, callback=None):
+        """
+        :param source: binary stream to compress
+        :param codec:
+        :param callback: called with number of source ( not compressed ) bytes as they are read
+        """
+        self.source = source
+        self.callback = callback
+        self._compressor = _compressor(codec)
+        self._buffer = bytearray()
+        self._eof = False
+        self.sent_bytes = 0  # compressed bytes given out so far
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            chunk = self.source.read(READ_CHUNK_SIZE)
+            if chunk:
+                self._buffer += self._compressor.compress(chunk)
+                if self.callback is not None:
+                    self.callback(len(chunk))
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.sent_bytes += len(data)
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+class DecompressingStream(object):
+    """
+    Wraps body of compressed object - read( size ) , readinto( buffer ) and iter_chunks( chunk_size ) give original
+    content
+    """
+
+    def __init__(self, body, codec):
+        self.body = body
+        self._decompressor = _decompressor(codec)
+        self._buffer = bytearray()
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            chunk = self.body.read(READ_CHUNK_SIZE)
+            if chunk:
+                self._buffer += self._decompressor.decompress(chunk)
+            else:
+                self._buffer += self._decompressor.flush()
+                self._eof = True
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def iter_chunks(self, chunk_size=READ_CHUNK_SIZE):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.body.close()
+
+
+def open_object_body(response):
+    """
+    :param response: get_object response
+    :return: stream of original content - body itself if object is not compressed
+    """
+    codec = response.get("Metadata", {}).get(CODEC_METADATA)
+    if codec is None:
+        return response["Body"]
+    return DecompressingStream(response["Body"], codec)
+
+
+def decompress_file(file, codec):
+    """
+    Replace compressed file with its original content
+    :param file:
+    :param codec:
+    :return:
+    """
+    temp_file = file + ".s3repo-decompress"
+    with open(file, "rb") as source, open(temp_file, "wb") as target:
+        for chunk in DecompressingStream(source, codec).iter_chunks():
+            target.write(chunk)
+    os.replace(temp_file, file)
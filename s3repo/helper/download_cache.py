@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows - cache is then only safe between threads of one program
+    fcntl = None
+
+"""
+Local cache of downloaded files keyed by bucket / object key / ETag
+
+Cached copy is only used after S3 confirmed ( conditional request with If-None-Match ) that object still has same
+ETag ; when cache grows over its size limit least recently used files are removed
+Cache index is small JSON file next to cached files - it is re-read before every change and every change holds
+exclusive lock ( fcntl.flock on lock file in cache folder and thread lock ) so more than one program can share same
+cache folder
+"""
+
+INDEX_FILE = "cache.json"
+LOCK_FILE = "cache.lock"
+
+
+class DownloadCache(object):
+
+    def __init__(self, folder, max_bytes):
+        """
+        :param folder: where cached files and index are kept
+        :param max_bytes: total size of cached files ( least recently used are removed above it )
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(folder, INDEX_FILE)
+        self._lock = threading.Lock()
+
+    def lookup(self, bucket_name, object_key):
+        """
+        :param bucket_name:
+        :param object_key:
+        :return: ETag of cached copy or None if object is not in cache
+        """
+        with self._locked():
+            entry = self._load().get(self._entry_id(bucket_name, object_key))
+        if entry is None or not os.path.isfile(self._path(bucket_name, object_key)):
+            return None
+        return entry["etag"]
+
+    def copy_to(self, bucket_name, object_key, destination, etag):
+        """
+        Copy cached file to destination ( destination is replaced at once ) and mark it as recently used
+        Copy is made under lock so other program can not evict or replace cached file meanwhile
+        :param bucket_name:
+        :param object_key:
+        :param destination:
+        :param etag: ETag S3 confirmed - cached copy is only used if it is still this version
+        :return: size of file or None if cache no longer has that version
+        """
+        temp_file = destination + ".s3repo-cache"
+        with self._locked():
+            index = self._load()
+            entry = index.get(self._entry_id(bucket_name, object_key))
+            if entry is None or entry["etag"] != etag or not os.path.isfile(self._path(bucket_name, object_key)):
+                return None
+            shutil.copyfile(self._path(bucket_name, object_key), temp_file)
+            entry["last_used"] = time.time()
+            self._save(index)
+        os.replace(temp_file, destination)
+        return os.path.getsize(destination)
+
+    def store(self, bucket_name, object_key, etag, source_file):
+        """
+        Add copy of downloaded file to cache ( replaces older version of same object ) and evict least recently used
+        files if cache is over its size
+        :param bucket_name:
+        :param object_key:
+        :param etag: ETag of downloaded object
+        :param source_file: downloaded file
+        :return: True if file has been cached ( file bigger than whole cache is not )
+        """
+        size = os.path.getsize(source_file)
+        if size > self.max_bytes:
+            return False
+        path = self._path(bucket_name, object_key)
+        # Other processes sharing cache may create folder at same time
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = path + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+        shutil.copyfile(source_file, temp_file)
+        with self._locked():
+            os.replace(temp_file, path)
+            index = self._load()
+            index[self._entry_id(bucket_name, object_key)] = {"bucket": bucket_name, "key": object_key, "etag": etag,
+                                                               "size": size, "last_used": time.time()}
+            self._evict(index)
+            self._save(index)
+        return True
+
+    def invalidate(self, bucket_name, object_key):
+        with self._locked():
+            index = self._load()
+            if index.pop(self._entry_id(bucket_name, object_key), None) is not None:
+                self._save(index)
+            if os.path.exists(self._path(bucket_name, object_key)):
+                os.remove(self._path(bucket_name, object_key))
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold cache lock - thread lock for threads of this program and flock for other programs
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder, exist_ok=True)
+            with open(os.path.join(self.folder, LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict(self, index):
+        total = sum(entry["size"] for entry in index.values())
+        for entry_id, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            path = os.path.join(self.folder, "objects", entry_id)
+            if os.path.exists(path):
+                os.remove(path)
+            del index[entry_id]
+            total -= entry["size"]
+
+    def _entry_id(self, bucket_name, object_key):
+        return hashlib.sha256((bucket_name + "/" + object_key).encode("utf-8")).hexdigest()
+
+    def _path(self, bucket_name, object_key):
+        return os.path.join(self.folder, "objects", self._entry_id(bucket_name, object_key))
+
+    def _load(self):
+        if os.path.isfile(self.index_file):
+            try:
+                with open(self.index_file) as f:
+                    return json.load(f)
+            except ValueError:
+                pass
+        return {}
+
+    def _save(self, index):
+        os.makedirs(self.folder, exist_ok=True)
+        temp_file = self.index_file + ".%d.tmp" % os.getpid()
+        with open(temp_file, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_file, self.index_file)
@@ -0,0 +1,345 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Per operation statistics of S3 API calls - hooked into botocore events of S3 client
+
+Every API call is attributed to public s3RepoMain method that caused it ( outermost one when methods call each other ,
+e.g. getFile -> downloadFile is counted as getFile ) ; method name is kept in context variable which is copied into
+worker threads started with ContextThreadPoolExecutor
+Threads started by boto3 transfer manager do not get context - their calls are attributed to active method when only
+one method is running in this process and to 'unattributed' otherwise
+"""
+
+UNATTRIBUTED = "unattributed"
+# Upper bounds ( seconds ) of latency histogram buckets - last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_method = contextvars.ContextVar("s3repo_method", default=None)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that runs every task in copy of submitter's context so API calls made by worker threads are
+    attributed to method that started them
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        return super(ContextThreadPoolExecutor, self).submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            position = len(self.buckets)
+        self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, fraction):
+        """
+        Upper bound of bucket that holds given fraction of observations
+        :param fraction: e.g. 0.95
+        :return: seconds ( inf if it is in last bucket ) or None if nothing observed
+        """
+        if not self.count:
+            return None
+        seen = 0
+        for position, count in enumerate(self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                return self.buckets[position] if position < len(self.buckets) else float("inf")
+
+    def to_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], self.counts))}
+
+
+class RepoStats(object):
+
+    def __init__(self, logger=None):
+        """
+        :param logger: calls that needed botocore retries are logged as warning when given
+        """
+        self.logger = logger
+        self.api_calls = Counter()  # ( method , API operation ) -> calls
+        self.api_errors = Counter()  # ( method , API operation , error code ) -> calls
+        self.retries = Counter()  # ( method , API operation ) -> retry attempts made by botocore
+        self.policy_retries = Counter()  # ( method , API operation , error code ) -> retries made by RetryPolicy
+        self.bytes_sent = Counter()  # method -> bytes
+        self.bytes_received = Counter()  # method -> bytes
+        self.api_latency = {}  # ( method , API operation ) -> Histogram
+        self.method_calls = Counter()  # method -> calls
+        self.method_latency = {}  # method -> Histogram
+        self._active = Counter()  # methods running right now ( in any thread )
+        self._lock = threading.Lock()
+
+    def register(self, event_emitter):
+        """
+        Hook into events of S3 client ( client.meta.events ) - can be called for more than one client
+        :param event_emitter:
+        :return:
+        """
+        event_emitter.register("before-call.s3", self._before_call, unique_id="s3repo-stats-before-call")
+        event_emitter.register("before-send.s3", self._before_send, unique_id="s3repo-stats-before-send")
+        event_emitter.register("after-call.s3", self._after_call, unique_id="s3repo-stats-after-call")
+        event_emitter.register("after-call-error.s3", self._after_call_error, unique_id="s3repo-stats-after-error")
+
+    def current_method(self):
+        method = _current_method.get()
+        if method is not None:
+            return method
+        with self._lock:
+            active = [name for name, count in self._active.items() if count > 0]
+        return active[0] if len(active) == 1 else UNATTRIBUTED
+
+    @contextlib.contextmanager
+    def attribute(self, method):
+        """
+        Attribute API calls made inside with block to method ( unless some outer method is already attributed )
+        :param method:
+        :return: True if this is outermost method
+        """
+        if _current_method.get() is not None:
+            yield False
+            return
+        token = _current_method.set(method)
+        with self._lock:
+            self._active[method] += 1
+        try:
+            yield True
+        finally:
+            with self._lock:
+                self._active[method] -= 1
+            _current_method.reset(token)
+
+    def track(self, method, function, *args, **kwargs):
+        """
+        Run function attributing its API calls to method ; calls and latency of method are recorded too
+        :param method:
+        :param function:
+        :return: result of function
+        """
+        with self.attribute(method) as outermost:
+            if not outermost:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._record_method(method, time.perf_counter() - start)
+
+    def _record_method(self, method, elapsed):
+        with self._lock:
+            self.method_calls[method] += 1
+            if elapsed is not None:
+                self.method_latency.setdefault(method, Histogram()).observe(elapsed)
+
+    def reset(self):
+        with self._lock:
+            for counter in (self.api_calls, self.api_errors, self.retries, self.policy_retries, self.bytes_sent,
+                            self.bytes_received, self.method_calls):
+                counter.clear()
+            self.api_latency.clear()
+            self.method_latency.clear()
+
+    def api_call_counts(self, method=None):
+        """
+        :param method: only calls attributed to this method ( all methods if None )
+        :return: Counter of API operation -> calls
+        """
+        counts = Counter()
+        with self._lock:
+            for (name, operation), calls in self.api_calls.items():
+                if method is None or name == method:
+                    counts[operation] += calls
+        return counts
+
+    def snapshot(self):
+        """
+        :return: plain dict of all statistics ( safe to serialise as JSON )
+        """
+        with self._lock:
+            methods = {}
+            for method in set(self.method_calls) | set(name for name, operation in self.api_calls):
+                methods[method] = {
+                    "calls": self.method_calls[method],
+                    "latency": self.method_latency[method].to_dict() if method in self.method_latency else None,
+                    "bytes_sent": self.bytes_sent[method],
+                    "bytes_received": self.bytes_received[method],
+                    "api_calls": {operation: {"calls": calls,
+                                              "retries": self.retries[(name, operation)],
+                                              "policy_retries": {code: retries for (retry_method, retry_operation, code),
+                                                                 retries in self.policy_retries.items()
+                                                                 if (retry_method, retry_operation) == (name, operation)},
+                                              "errors": {code: errors for (error_method, error_operation, code), errors
+                                                         in self.api_errors.items()
+                                                         if (error_method, error_operation) == (name, operation)},
+                                              "latency": self.api_latency[(name, operation)].to_dict()}
+                                  for (name, operation), calls in self.api_calls.items() if name == method}
+                }
+            return methods
+
+    def to_prometheus(self):
+        """
+        Statistics in Prometheus text exposition format
+        :return: str
+        """
+        lines = []
+        with self._lock:
+            lines.append("# HELP s3repo_api_calls_total S3 API calls by s3repo method and API operation")
+            lines.append("# TYPE s3repo_api_calls_total counter")
+            for (method, operation), calls in sorted(self.api_calls.items()):
+                lines.append('s3repo_api_calls_total{method="%s",operation="%s"} %d' % (method, operation, calls))
+            lines.append("# HELP s3repo_api_errors_total Failed S3 API calls by error code")
+            lines.append("# TYPE s3repo_api_errors_total counter")
+            for (method, operation, code), calls in sorted(self.api_errors.items()):
+                lines.append('s3repo_api_errors_total{method="%s",operation="%s",code="%s"} %d' %
+                             (method, operation, code, calls))
+            lines.append("# HELP s3repo_policy_retries_total Calls retried by s3repo retry policy after botocore gave up")
+            lines.append("# TYPE s3repo_policy_retries_total counter")
+            for (method, operation, code), retries in sorted(self.policy_retries.items()):
+                lines.append('s3repo_policy_retries_total{method="%s",operation="%s",code="%s"} %d' %
+                             (method, operation, code, retries))
+            lines.append("# HELP s3repo_api_retries_total Retry attempts made by botocore")
+            lines.append("# TYPE s3repo_api_retries_total counter")
+            for (method, operation), retries in sorted(self.retries.items()):
+                lines.append('s3repo_api_retries_total{method="%s",operation="%s"} %d' % (method, operation, retries))
+            for name, counter in (("sent", self.bytes_sent), ("received", self.bytes_received)):
+                lines.append("# HELP s3repo_bytes_%s_total Bytes %s by s3repo method" % (name, name))
+                lines.append("# TYPE s3repo_bytes_%s_total counter" % name)
+                for method, count in sorted(counter.items()):
+                    lines.append('s3repo_bytes_%s_total{method="%s"} %d' % (name, method, count))
+            lines.append("# HELP s3repo_api_latency_seconds Latency of S3 API calls ( including retries )")
+            lines.append("# TYPE s3repo_api_latency_seconds histogram")
+            for (method, operation), histogram in sorted(self.api_latency.items()):
+                lines.extend(_histogram_lines("s3repo_api_latency_seconds",
+                                              'method="%s",operation="%s"' % (method, operation), histogram))
+            lines.append("# HELP s3repo_method_latency_seconds Latency of s3repo methods")
+            lines.append("# TYPE s3repo_method_latency_seconds histogram")
+            for method, histogram in sorted(self.method_latency.items()):
+                lines.extend(_histogram_lines("s3repo_method_latency_seconds", 'method="%s"' % method, histogram))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file):
+        """
+        Write Prometheus text format to file ( e.g. for node exporter textfile collector ) - file is replaced at once
+        :param file:
+        :return:
+        """
+        with open(file + ".tmp", "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(file + ".tmp", file)
+
+    def record_retry(self, operation, error_code):
+        """
+        Count retry made by RetryPolicy ( see helper/retry_policy.py ) - usable as its on_retry
+        :param operation:
+        :param error_code:
+        :return:
+        """
+        method = self.current_method()
+        with self._lock:
+            self.policy_retries[(method, operation, str(error_code))] += 1
+
+    def _before_call(self, model, context, **kwargs):
+        context["s3repo_method"] = self.current_method()
+        context["s3repo_start"] = time.perf_counter()
+
+    def _before_send(self, request, **kwargs):
+        # Sent once per attempt - so retried uploads are counted every time they are sent
+        # Streamed uploads with checksum are sent aws-chunked - then only decoded length is known up front
+        length = request.headers.get("X-Amz-Decoded-Content-Length") or request.headers.get("Content-Length")
+        if length:
+            method = self.current_method()
+            with self._lock:
+                self.bytes_sent[method] += int(length)
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        method = context.get("s3repo_method", UNATTRIBUTED)
+        elapsed = time.perf_counter() - context.get("s3repo_start", time.perf_counter())
+        length = http_response.headers.get("content-length") if http_response is not None else None
+        error_code = parsed.get("Error", {}).get("Code") if http_response is not None and \
+            http_response.status_code >= 300 else None
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        if retries and self.logger is not None:
+            self.logger.warning("S3 call [%s] of [%s] needed [%s] retries ( throttled or server error )", model.name,
+                                method, retries)
+        self._record(method, model.name, elapsed, retries, int(length) if length and model.name != "HeadObject" else 0,
+                     error_code)
+
+    def _after_call_error(self, context, exception, **kwargs):
+        # Request did not get any response ( e.g. connection error after all retries )
+        model = kwargs.get("model") or kwargs.get("operation_model")
+        self._record(context.get("s3repo_method", UNATTRIBUTED), model.name if model is not None else UNATTRIBUTED,
+                     time.perf_counter() - context.get("s3repo_start", time.perf_counter()), 0, 0,
+                     type(exception).__name__)
+
+    def _record(self, method, operation, elapsed, retries, received, error_code):
+        with self._lock:
+            self.api_calls[(method, operation)] += 1
+            self.retries[(method, operation)] += retries
+            self.bytes_received[method] += received
+            self.api_latency.setdefault((method, operation), Histogram()).observe(elapsed)
+            if error_code:
+                self.api_errors[(method, operation, error_code)] += 1
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip([str(bound) for bound in histogram.buckets] + ["+Inf"], histogram.counts):
+        cumulative += count
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+    lines.append("%s_sum{%s} %f" % (name, labels, histogram.sum))
+    lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+    return lines
+
+
+def instrumented(method):
+    """
+    Decorator for public s3RepoMain methods - API calls made while method runs are attributed to it in self.stats
+    Generator methods are tracked while they produce each item
+    :param method:
+    :return:
+    """
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            # Latency of generator depends on its consumer - only calls are counted
+            outermost = _current_method.get() is None
+            generator = method(self, *args, **kwargs)
+            while True:
+                with self.stats.attribute(method.__name__):
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        break
+                yield item
+            if outermost:
+                self.stats._record_method(method.__name__, None)
+
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.stats.track(method.__name__, method, self, *args, **kwargs)
+
+    return wrapper
@@ -1,23 +1,113 @@
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
 
-LOG_LEVEL = logging.DEBUG
-logger = logging.getLogger(__name__)
-logger.setLevel(LOG_LEVEL)
+"""
+Logging for repo and its command line programs
+
+Log calls only put record on in-memory queue ; background thread formats records and writes them to log file and
+console so slow disk or terminal does not hold up S3 work
+Level and destinations come from environment :
+    S3REPO_LOG_LEVEL    DEBUG , INFO ( default ) , WARNING , ERROR
+    S3REPO_LOG_FILE     log file path ( default s3repo/logs/s3repo.log next to this package ) or "none"
+    S3REPO_LOG_CONSOLE  stdout ( default ) , stderr or none
+"""
+
+LEVEL_ENV = "S3REPO_LOG_LEVEL"
+FILE_ENV = "S3REPO_LOG_FILE"
+CONSOLE_ENV = "S3REPO_LOG_CONSOLE"
+DEFAULT_LEVEL = "INFO"
+DEFAULT_LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../logs/s3repo.log")
 
-# create a file handler
-handler = logging.FileHandler('s3repo/logs/s3repo.log')
-handler.setLevel(LOG_LEVEL)
+# Record arguments of these types can not change after log call - their formatting is left to background thread
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+logger = logging.getLogger(__name__)
 
-# create a logging format
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)s - %(funcName)10s() ] '
                               '- %(message)s')
-handler.setFormatter(formatter)
 
-# add the handlers to the logger
-logger.addHandler(handler)
+consoleHandler = None
+fileHandler = None
+_listener = None
+_lock = threading.Lock()
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler formats message in calling thread ( arguments could change before background thread gets to it ) ;
+    this one skips that when all arguments are immutable
+    """
+
+    def prepare(self, record):
+        if record.exc_info or record.stack_info:
+            return super().prepare(record)
+        args = record.args
+        if isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args):
+            return record
+        return super().prepare(record)
+
+
+def _level(name):
+    level = logging.getLevelName(str(name).upper())
+    if not isinstance(level, int):
+        sys.stderr.write("Unknown log level [" + str(name) + "] in " + LEVEL_ENV + " - using " + DEFAULT_LEVEL + "\n")
+        level = logging.getLevelName(DEFAULT_LEVEL)
+    return level
+
+
+def configure_logging(level=None, log_file=None, console=None):
+    """
+    Set up logging ( only first call does work so every program and s3RepoMain can call it )
+    :param level: log level name - default S3REPO_LOG_LEVEL environment variable or INFO
+    :param log_file: log file path or "none" - default S3REPO_LOG_FILE environment variable or s3repo/logs/s3repo.log
+    :param console: stdout , stderr or none - default S3REPO_LOG_CONSOLE environment variable or stdout
+    :return: repo logger
+    """
+    global consoleHandler, fileHandler, _listener
+    with _lock:
+        if _listener is not None:
+            return logger
+        level = _level(level or os.environ.get(LEVEL_ENV) or DEFAULT_LEVEL)
+        log_file = log_file or os.environ.get(FILE_ENV) or DEFAULT_LOG_FILE
+        console = (console or os.environ.get(CONSOLE_ENV) or "stdout").lower()
+
+        handlers = []
+        if log_file.lower() != "none":
+            folder = os.path.dirname(os.path.abspath(log_file))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            fileHandler = logging.FileHandler(log_file)
+            fileHandler.setFormatter(formatter)
+            handlers.append(fileHandler)
+        if console != "none":
+            consoleHandler = logging.StreamHandler(sys.stderr if console == "stderr" else sys.stdout)
+            consoleHandler.setFormatter(formatter)
+            handlers.append(consoleHandler)
+
+        logger.setLevel(level)
+        # Attached to root so records of other loggers ( warnings of boto3 and like ) reach same destinations
+        queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+        logging.getLogger().addHandler(queue_handler)
+        _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # Records still on queue are written before program ends
+        atexit.register(_listener.stop)
+        return logger
+
+
+def console_to_stderr():
+    """
+    Send console log to stderr - needed when stdout carries data ( e.g. file content written to stdout )
+    :return:
+    """
+    configure_logging()
+    if consoleHandler is not None:
+        consoleHandler.setStream(sys.stderr)
+
 
-consoleHandler = logging.StreamHandler(sys.stdout)
-consoleHandler.setLevel(LOG_LEVEL)
-consoleHandler.setFormatter(formatter)
-logging.getLogger().addHandler(consoleHandler)
+configure_logging()
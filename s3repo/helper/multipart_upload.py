@@ -0,0 +1,179 @@
+import json
+import math
+import os
+import threading
+
+from botocore.exceptions import ClientError
+from s3repo.helper.cancellation import check_cancelled
+from s3repo.helper.instrumentation import ContextThreadPoolExecutor
+
+"""
+Multipart upload of one file with parallel parts and local checkpoint so interrupted upload can be resumed
+
+Checkpoint is a small JSON file that has upload id and parts that were already uploaded ; when upload is started again
+for same file ( same size and modification time ) only missing parts are sent
+"""
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for all parts but the last one
+MAX_PARTS = 10000  # S3 maximum number of parts in one upload
+
+
+class MultipartUploader(object):
+
+    def __init__(self, s3_client, bucket_name, object_key, file, checkpoint_file, part_size=8 * 1024 * 1024,
+                 concurrency=4, callback=None, extra_args=None):
+        """
+        :param s3_client:
+        :param bucket_name:
+        :param object_key:
+        :param file: local file to upload
+        :param checkpoint_file: where to keep upload state between runs
+        :param part_size: size of each part in bytes ( at least 5 MB - increased if file would need more than 10000
+        parts )
+        :param concurrency: number of parts uploaded in parallel
+        :param callback: called with number of bytes after each part ( e.g. ProgressPercentage ) ; if it has 'resume'
+        method that is called with bytes already uploaded by earlier run
+        :param extra_args: extra arguments for create_multipart_upload e.g. Metadata
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.file = file
+        self.checkpoint_file = checkpoint_file
+        self.concurrency = max(1, concurrency)
+        self.callback = callback
+        self.extra_args = extra_args or {}
+        self.file_size = os.path.getsize(file)
+        self.file_mtime = os.path.getmtime(file)
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        while math.ceil(self.file_size / self.part_size) > MAX_PARTS:
+            self.part_size *= 2
+        self.part_count = max(1, math.ceil(self.file_size / self.part_size))
+        self.upload_id = None
+        self.parts = {}  # part number -> ETag
+        self._lock = threading.Lock()
+
+    def upload(self):
+        """
+        Upload file - resumes earlier upload when checkpoint for same file is found
+        On error checkpoint is kept so that calling upload again continues from last finished part
+        :return: response of complete_multipart_upload
+        """
+        if not self._resume():
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=self.object_key,
+                                                              **self.extra_args)
+            self.upload_id = response["UploadId"]
+            self.parts = {}
+            self._save_checkpoint()
+
+        done_bytes = sum(self._part_length(part_number) for part_number in self.parts)
+        if done_bytes and self.callback is not None:
+            getattr(self.callback, "resume", self.callback)(done_bytes)
+
+        missing = [part_number for part_number in range(1, self.part_count + 1) if part_number not in self.parts]
+        with ContextThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # list() so that first failed part raises here
+            list(executor.map(self._upload_part, missing))
+
+        response = self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": part_number, "ETag": self.parts[part_number]}
+                                       for part_number in sorted(self.parts)]}
+        )
+        self._remove_checkpoint()
+        return response
+
+    def abort(self):
+        """
+        Abort upload on S3 side ( uploaded parts are dropped ) and forget checkpoint
+        :return:
+        """
+        if self.upload_id is None:
+            self._resume()
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.object_key,
+                                                  UploadId=self.upload_id)
+        self._remove_checkpoint()
+
+    def _part_length(self, part_number):
+        offset = (part_number - 1) * self.part_size
+        return min(self.part_size, self.file_size - offset)
+
+    def _upload_part(self, part_number):
+        check_cancelled()
+        offset = (part_number - 1) * self.part_size
+        with open(self.file, "rb") as f:
+            f.seek(offset)
+            data = f.read(self._part_length(part_number))
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        with self._lock:
+            self.parts[part_number] = response["ETag"]
+            self._save_checkpoint()
+        if self.callback is not None:
+            self.callback(len(data))
+
+    def _resume(self):
+        """
+        Load checkpoint and check with S3 which parts are really there
+        :return: True if earlier upload can be continued
+        """
+        if not os.path.isfile(self.checkpoint_file):
+            return False
+        try:
+            with open(self.checkpoint_file) as f:
+                state = json.load(f)
+        except ValueError:
+            return False
+
+        if (state.get("bucket") != self.bucket_name or state.get("key") != self.object_key or
+                state.get("size") != self.file_size or state.get("mtime") != self.file_mtime):
+            # File has changed since - old parts are useless
+            self._abort_quietly(state.get("bucket"), state.get("key"), state.get("upload_id"))
+            return False
+
+        self.upload_id = state["upload_id"]
+        self.part_size = state["part_size"]
+        self.part_count = max(1, math.ceil(self.file_size / self.part_size))
+        try:
+            # S3 is the source of truth - checkpoint may miss parts finished just before crash
+            self.parts = {}
+            paginator = self.s3_client.get_paginator("list_parts")
+            for page in paginator.paginate(Bucket=self.bucket_name, Key=self.object_key, UploadId=self.upload_id):
+                for part in page.get("Parts", []):
+                    if part["Size"] == self._part_length(part["PartNumber"]):
+                        self.parts[part["PartNumber"]] = part["ETag"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchUpload":
+                self.upload_id = None
+                return False
+            raise e
+        return True
+
+    def _abort_quietly(self, bucket_name, object_key, upload_id):
+        if not upload_id:
+            return
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id)
+        except ClientError:
+            pass
+
+    def _save_checkpoint(self):
+        state = {"bucket": self.bucket_name, "key": self.object_key, "size": self.file_size, "mtime": self.file_mtime,
+                 "part_size": self.part_size, "upload_id": self.upload_id,
+                 "parts": {str(part_number): etag for part_number, etag in self.parts.items()}}
+        temp_file = self.checkpoint_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_file, self.checkpoint_file)
+
+    def _remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import threading
+
+from botocore.exceptions import ClientError
+from s3repo.helper.cancellation import check_cancelled
+from s3repo.helper.instrumentation import ContextThreadPoolExecutor
+
+"""
+Download of one object as parallel byte ranges into pre-allocated temporary file
+
+Finished ranges are recorded in side-car checkpoint file next to temporary file so interrupted download continues
+where it stopped ; temporary file is renamed to its final name only when all ranges are there
+"""
+
+TEMP_SUFFIX = ".s3repo-part"
+CHECKPOINT_SUFFIX = TEMP_SUFFIX + ".json"
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class ObjectChangedError(Exception):
+    """
+    Object on S3 has been replaced while it was being downloaded
+    """
+    pass
+
+
+class RangedDownloader(object):
+
+    def __init__(self, s3_client, bucket_name, object_key, destination, part_size=8 * 1024 * 1024, concurrency=4,
+                 callback=None):
+        """
+        :param s3_client:
+        :param bucket_name:
+        :param object_key:
+        :param destination: final path of downloaded file
+        :param part_size: size of each byte range
+        :param concurrency: number of ranges downloaded in parallel
+        :param callback: called with number of bytes as they are written ; if it has 'resume' method that is called
+        with bytes already downloaded by earlier run
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.destination = destination
+        self.temp_file = destination + TEMP_SUFFIX
+        self.checkpoint_file = destination + CHECKPOINT_SUFFIX
+        self.part_size = max(1, part_size)
+        self.concurrency = max(1, concurrency)
+        self.callback = callback
+        self.size = None
+        self.etag = None
+        self.metadata = {}
+        self.parts = set()
+        self._lock = threading.Lock()
+
+    def download(self):
+        """
+        Download object - continues earlier download of same object version ( same ETag ) if checkpoint is found
+        On error temporary file and checkpoint are kept so calling download again continues
+        :return: ETag of downloaded object
+        """
+        if self.etag is None:
+            self.head()
+
+        if not self._resume():
+            self.parts = set()
+            with open(self.temp_file, "wb") as f:
+                f.truncate(self.size)  # pre-allocate so ranges can be written at their offset
+            self._save_checkpoint()
+
+        done_bytes = sum(self._part_length(part_number) for part_number in self.parts)
+        if done_bytes and self.callback is not None:
+            getattr(self.callback, "resume", self.callback)(done_bytes)
+
+        missing = [part_number for part_number in range(self._part_count()) if part_number not in self.parts]
+        try:
+            with ContextThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(self._download_part, missing))
+        except ObjectChangedError as e:
+            # Parts of two different versions can't be mixed - start from scratch next time
+            self._remove_state()
+            raise e
+
+        with open(self.temp_file, "r+b") as f:
+            os.fsync(f.fileno())
+        os.replace(self.temp_file, self.destination)
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+        return self.etag
+
+    def head(self):
+        """
+        Read size , ETag and user metadata of object ( done by download if not called before )
+        :return: object size in bytes
+        """
+        response = self.s3_client.head_object(Bucket=self.bucket_name, Key=self.object_key)
+        self.size = response["ContentLength"]
+        self.etag = response["ETag"]
+        self.metadata = response.get("Metadata", {})
+        return self.size
+
+    def _part_count(self):
+        return int(math.ceil(self.size / float(self.part_size)))
+
+    def _part_length(self, part_number):
+        return min(self.part_size, self.size - part_number * self.part_size)
+
+    def _download_part(self, part_number):
+        check_cancelled()
+        start = part_number * self.part_size
+        end = start + self._part_length(part_number) - 1
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.object_key,
+                                                 Range="bytes=%d-%d" % (start, end), IfMatch=self.etag)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "412"):
+                raise ObjectChangedError("Object [" + self.object_key + "] changed during download")
+            raise e
+
+        with open(self.temp_file, "r+b") as f:
+            f.seek(start)
+            for chunk in response["Body"].iter_chunks(READ_CHUNK_SIZE):
+                check_cancelled()
+                f.write(chunk)
+                if self.callback is not None:
+                    self.callback(len(chunk))
+
+        with self._lock:
+            self.parts.add(part_number)
+            self._save_checkpoint()
+
+    def _resume(self):
+        """
+        :return: True if checkpoint belongs to same object version and temporary file is still there
+        """
+        if not (os.path.isfile(self.checkpoint_file) and os.path.isfile(self.temp_file)):
+            return False
+        try:
+            with open(self.checkpoint_file) as f:
+                state = json.load(f)
+        except ValueError:
+            return False
+        if state.get("etag") != self.etag or state.get("size") != self.size or \
+                os.path.getsize(self.temp_file) != self.size:
+            return False
+        self.part_size = state["part_size"]
+        self.parts = set(state["parts"])
+        return True
+
+    def _save_checkpoint(self):
+        state = {"bucket": self.bucket_name, "key": self.object_key, "etag": self.etag, "size": self.size,
+                 "part_size": self.part_size, "parts": sorted(self.parts)}
+        temp_checkpoint = self.checkpoint_file + ".tmp"
+        with open(temp_checkpoint, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_checkpoint, self.checkpoint_file)
+
+    def _remove_state(self):
+        for path in (self.temp_file, self.checkpoint_file):
+            if os.path.exists(path):
+                os.remove(path)
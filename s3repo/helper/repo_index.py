@@ -0,0 +1,234 @@
+import hashlib
+import json
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+"""
+Index of user-key -> object key for a user's Repo ( S3 bucket )
+
+Index is stored as a small JSON object inside user's own bucket under reserved prefix '.s3repo/' so it goes away
+together with the bucket ; objects under reserved prefix are never shown to the user as files
+Index is only written if nobody else wrote it since it was read ( conditional put on its ETag ) - update() repeats
+read-modify-write until it wins so concurrent uploads to same repo do not lose each other's entries
+"""
+
+RESERVED_PREFIX = ".s3repo/"
+INDEX_KEY = RESERVED_PREFIX + "index.json"
+INDEX_VERSION = 1
+# Returned by S3 when conditional write lost against other writer
+CONFLICT_CODES = ("PreconditionFailed", "412", "ConditionalRequestConflict", "409")
+MAX_UPDATE_ATTEMPTS = 20
+
+
+class IndexConflict(RuntimeError):
+    """
+    Index was written by someone else after it was loaded
+    """
+    pass
+
+
+def is_reserved_key(object_key):
+    """
+    Check if given object key is used internally by repo ( index etc. ) and is not a user file
+    :param object_key:
+    :return: True if key is reserved
+    """
+    return object_key.startswith(RESERVED_PREFIX)
+
+
+def file_sha256(file, chunk_size=1024 * 1024):
+    """
+    sha256 of file content - file is read in chunks so memory use does not depend on file size
+    :param file:
+    :param chunk_size:
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for data in iter(lambda: f.read(chunk_size), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def get_user_key(tag_set):
+    """
+    Find value of 'user-key' tag from TagSet returned by get_object_tagging
+    :param tag_set:
+    :return: user-key or None if object does not have one
+    """
+    for tag in tag_set:
+        if tag["Key"] == "user-key":
+            return tag["Value"]
+    return None
+
+
+class RepoIndex(object):
+
+    def __init__(self, s3_client, bucket_name):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.keys = {}
+        # sha256 of file content -> object key ( only for files uploaded in dedup mode )
+        self.content = {}
+        # object key -> size of file content for files whose object is not the content itself ( chunk manifest ,
+        # compressed file ) - listing only gives size of object
+        self.sizes = {}
+        self.exists = False
+        self.etag = None
+
+    def load(self):
+        """
+        Read index from user's bucket
+        :return: True if index was found else False ( index is then empty )
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=INDEX_KEY)
+            data = json.loads(response["Body"].read().decode("utf-8"))
+            self.keys = data.get("keys", {})
+            self.content = data.get("content", {})
+            self.sizes = data.get("sizes", {})
+            self.exists = True
+            self.etag = response["ETag"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                self.keys = {}
+                self.content = {}
+                self.sizes = {}
+                self.exists = False
+                self.etag = None
+            else:
+                raise e
+        return self.exists
+
+    def save(self):
+        """
+        Write index back to user's bucket - only if it is still same version as loaded ( or still missing )
+        :return:
+        :raise IndexConflict: if index was written by someone else in between
+        """
+        body = json.dumps({"version": INDEX_VERSION, "keys": self.keys, "content": self.content, "sizes": self.sizes},
+                          sort_keys=True)
+        condition = {"IfMatch": self.etag} if self.etag is not None else {"IfNoneMatch": "*"}
+        try:
+            response = self.s3_client.put_object(Bucket=self.bucket_name, Key=INDEX_KEY, Body=body.encode("utf-8"),
+                                                 ContentType="application/json", **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in CONFLICT_CODES:
+                raise IndexConflict("Index of repo [" + self.bucket_name + "] has been changed by other writer")
+            raise e
+        self.exists = True
+        self.etag = response["ETag"]
+
+    def update(self, change, max_attempts=MAX_UPDATE_ATTEMPTS):
+        """
+        Load index , apply change and save it - repeated ( with fresh index ) when other writer saved index in between
+        :param change: function( index ) that changes index ; index is not saved when it returns False
+        :param max_attempts:
+        :return: return value of change
+        :raise IndexConflict: if index could not be saved in max_attempts
+        """
+        for attempt in range(max_attempts):
+            self.load()
+            result = change(self)
+            if result is False:
+                return result
+            try:
+                self.save()
+                return result
+            except IndexConflict:
+                time.sleep(random.uniform(0, min(1.0, 0.01 * 2 ** attempt)))
+        raise IndexConflict("Index of repo [" + self.bucket_name + "] could not be saved in [" + str(max_attempts) +
+                            "] attempts - too many concurrent writers")
+
+    def lookup(self, user_key):
+        return self.keys.get(user_key)
+
+    def put(self, user_key, object_key):
+        """
+        Map user-key to object key ; any other user-key that was pointing to same object is dropped as object
+        has been overwritten
+        :param user_key:
+        :param object_key:
+        :return:
+        """
+        self.remove_object(object_key)
+        self.keys[user_key] = object_key
+
+    def add_alias(self, user_key, object_key):
+        """
+        Map one more user-key to existing object ( dedup ) - other user-keys of that object are kept
+        :param user_key:
+        :param object_key:
+        :return:
+        """
+        self.keys[user_key] = object_key
+
+    def user_keys_of(self, object_key):
+        return [user_key for user_key, key in self.keys.items() if key == object_key]
+
+    def remove_user_key(self, user_key):
+        return self.keys.pop(user_key, None)
+
+    def lookup_content(self, sha256):
+        return self.content.get(sha256)
+
+    def put_content(self, sha256, object_key):
+        self.content[sha256] = object_key
+
+    def file_size(self, object_key, object_size):
+        """
+        :param object_key:
+        :param object_size: size of object as listed
+        :return: size of file content stored as given object
+        """
+        return self.sizes.get(object_key, object_size)
+
+    def put_size(self, object_key, size):
+        self.sizes[object_key] = size
+
+    def remove_object(self, object_key):
+        """
+        Drop all user-keys ( and content hash , file size ) pointing to given object key
+        :param object_key:
+        :return: list of user-keys that were removed
+        """
+        removed = self.user_keys_of(object_key)
+        for user_key in removed:
+            del self.keys[user_key]
+        for sha256 in [sha256 for sha256, key in self.content.items() if key == object_key]:
+            del self.content[sha256]
+        self.sizes.pop(object_key, None)
+        return removed
+
+    def rebuild(self):
+        """
+        Re-create index from 'user-key' tags of all objects in user's bucket
+        This is expensive ( one get_object_tagging per object ) and is only needed for repos created before index
+        existed or when index got out of sync
+        Extra user-keys of dedup files , content hashes and file sizes exist only in index - entries already loaded are
+        kept as long as their object still exists
+        :return: number of user-keys found
+        """
+        old_keys = self.keys
+        old_content = self.content
+        self.keys = {}
+        existing = set()
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name):
+            for s3_object in page.get("Contents", []):
+                if is_reserved_key(s3_object["Key"]):
+                    continue
+                existing.add(s3_object["Key"])
+                response = self.s3_client.get_object_tagging(Bucket=self.bucket_name, Key=s3_object["Key"])
+                user_key = get_user_key(response["TagSet"])
+                if user_key is not None:
+                    # Same as tag scan - first object ( in listing order ) with given user-key wins
+                    self.keys.setdefault(user_key, s3_object["Key"])
+        for user_key, object_key in old_keys.items():
+            if object_key in existing:
+                self.keys.setdefault(user_key, object_key)
+        self.content = {sha256: object_key for sha256, object_key in old_content.items() if object_key in existing}
+        self.sizes = {object_key: size for object_key, size in self.sizes.items() if object_key in existing}
+        return len(self.keys)
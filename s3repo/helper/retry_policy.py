@@ -0,0 +1,60 @@
+import random
+import time
+
+"""
+Retry of throttled S3 work that botocore does not retry itself
+
+botocore ( adaptive mode ) retries each failed request and slows client down when S3 answers SlowDown - that is the
+only layer failed requests are retried at , wrapping them again here would multiply attempts ; this policy is for
+per-key errors of delete_objects ( which come back in response of successful request so botocore never retries them )
+Delays use full jitter ( random between 0 and exponential cap ) so many threads that were throttled together do not
+retry together
+"""
+
+# Error codes that mean "try again later" - anything else is a real error and is raised right away
+RETRYABLE_CODES = frozenset(["SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded",
+                             "TooManyRequestsException", "RequestTimeout", "InternalError", "ServiceUnavailable",
+                             "500", "502", "503", "504"])
+
+
+class RetryPolicy(object):
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=20, logger=None, on_retry=None):
+        """
+        :param max_attempts: total attempts of one call ( 1 = no retry )
+        :param base_delay: cap of first delay in seconds - doubled after every attempt
+        :param max_delay: largest cap of delay in seconds
+        :param logger: every retry is logged as warning when given
+        :param on_retry: called with ( operation , error code ) before every retry e.g. to count retries
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.logger = logger
+        self.on_retry = on_retry
+
+    def is_retryable(self, error_code):
+        return error_code in RETRYABLE_CODES
+
+    def backoff(self, attempt):
+        """
+        :param attempt: number of attempts already made ( 1 for first retry )
+        :return: delay in seconds ( full jitter )
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def wait(self, operation, error_code, attempt):
+        """
+        Sleep before next attempt - logs and reports retry first
+        :param operation: name used in log / stats e.g. DeleteObjects
+        :param error_code:
+        :param attempt: number of attempts already made
+        :return:
+        """
+        delay = self.backoff(attempt)
+        if self.logger is not None:
+            self.logger.warning("S3 call [%s] failed with [%s] - retry %s/%s in %.2f seconds", operation, error_code,
+                                attempt, self.max_attempts - 1, delay)
+        if self.on_retry is not None:
+            self.on_retry(operation, error_code)
+        time.sleep(delay)
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+
+"""
+Helpers for directory sync - walk local tree , compute S3 style ETag of local file and keep local sync state
+
+Sync state remembers ( size , modification time , ETag ) of every file as of last sync so unchanged files can be
+skipped without reading them again
+"""
+
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024  # same as threshold / chunk size used for sync uploads
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def walk_files(directory):
+    """
+    All files under directory
+    :param directory:
+    :return: generator of ( relative path with '/' separators , full path )
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            relative_path = os.path.relpath(full_path, directory).replace(os.sep, "/")
+            yield relative_path, full_path
+
+
+def compute_etag(file, chunk_size=MULTIPART_CHUNK_SIZE):
+    """
+    Compute ETag S3 would give to this file when uploaded with given multipart chunk size
+    ( md5 for single part upload , md5 of part md5s + '-' + part count for multipart upload )
+    :param file:
+    :param chunk_size:
+    :return: ETag with quotes as returned by S3
+    """
+    part_digests = []
+    with open(file, "rb") as f:
+        while True:
+            part = hashlib.md5()
+            remaining = chunk_size
+            while remaining > 0:
+                data = f.read(min(READ_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                part.update(data)
+                remaining -= len(data)
+            if remaining == chunk_size and part_digests:
+                break
+            part_digests.append(part.digest())
+            if remaining > 0:
+                break
+
+    if os.path.getsize(file) < chunk_size:
+        # Below multipart threshold file is sent with single put_object
+        return '"' + part_digests[0].hex() + '"'
+    return '"' + hashlib.md5(b"".join(part_digests)).hexdigest() + "-" + str(len(part_digests)) + '"'
+
+
+def load_sync_state(state_file):
+    if os.path.isfile(state_file):
+        try:
+            with open(state_file) as f:
+                return json.load(f)
+        except ValueError:
+            pass
+    return {}
+
+
+def save_sync_state(state_file, state):
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(state_file + ".tmp", state_file)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from s3repo.helper.cancellation import cancellable
+from s3repo.s3repomain import s3RepoMain
+
+"""
+asyncio front end of s3RepoMain
+
+Every operation runs on a dedicated thread pool of max_concurrency threads ( boto3 is blocking ) so event loop is never
+blocked and at most max_concurrency S3 operations run at same time - others wait in queue
+Cancelling an awaiting call that has not started yet removes it from queue ; call that is already running is asked
+to stop ( see helper/cancellation.py ) - multipart / ranged / chunked transfers and directory sync stop after parts
+that are in flight , single request transfers and other operations finish in background ; result is dropped either way
+"""
+
+
+class AsyncS3Repo(object):
+
+    def __init__(self, repo=None, max_concurrency=16):
+        """
+        :param repo: s3RepoMain to use - if not given one is created with connection pool sized for max_concurrency
+        :param max_concurrency: maximum number of operations running at same time
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.repo = repo if repo is not None else s3RepoMain(lazy_connect=True,
+                                                             max_pool_connections=self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="s3repo-async")
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        cancel_event = threading.Event()
+        try:
+            # Cancelling the awaiting task cancels executor future too - that only succeeds if call has not started
+            return await loop.run_in_executor(self._executor, functools.partial(self._call, cancel_event, method,
+                                                                                *args, **kwargs))
+        except asyncio.CancelledError:
+            # Call that has already started stops at its next check_cancelled
+            cancel_event.set()
+            raise
+
+    @staticmethod
+    def _call(cancel_event, method, *args, **kwargs):
+        with cancellable(cancel_event):
+            return method(*args, **kwargs)
+
+    async def create_user(self, user_name, password, email_id):
+        return await self._run(self.repo.create_user, user_name, password, email_id)
+
+    async def authenticate_user(self, user_name, user_password):
+        return await self._run(self.repo.authenticate_user, user_name, user_password)
+
+    async def uploadFile(self, user_name, user_password, file_key, file, **kwargs):
+        return await self._run(self.repo.uploadFile, user_name, user_password, file_key, file, **kwargs)
+
+    async def listFiles(self, bucket_name, user_password, **kwargs):
+        return await self._run(self.repo.listFiles, bucket_name, user_password, **kwargs)
+
+    async def getFile(self, bucket_name, user_password, user_Key, output_location, **kwargs):
+        return await self._run(self.repo.getFile, bucket_name, user_password, user_Key, output_location, **kwargs)
+
+    async def downloadFile(self, user_name, user_password, file_name, output_location="--", **kwargs):
+        return await self._run(self.repo.downloadFile, user_name, user_password, file_name,
+                               output_location=output_location, **kwargs)
+
+    async def deleteFile(self, bucket_name, user_password, user_Key):
+        return await self._run(self.repo.deleteFile, bucket_name, user_password, user_Key)
+
+    async def close(self):
+        """
+        Stop thread pool - waits for operations that are already running
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self._executor.shutdown, wait=True, cancel_futures=True))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -1,15 +1,44 @@
 #!/usr/bin/env python3
+import atexit
+import hashlib
+import heapq
+import json
 import logging
 import os
+import random
 import re
+import threading
 import time
-
-from prettytable import PrettyTable
+from collections import deque, namedtuple
+from concurrent.futures import as_completed
+from urllib.parse import urlencode
 
 from botocore.exceptions import ClientError
-from s3repo.helper.ProgressPercentage import ProgressPercentage
+from s3repo.helper.ProgressPercentage import ByteCounter, progress_callback
 from s3repo.helper import awsGetConnection, password_helper, logger_setup
+from s3repo.helper.auth_cache import AuthCache
 from s3repo.helper.awsGetConnection import awsHelper
+from s3repo.helper.multipart_upload import MultipartUploader, MIN_PART_SIZE
+from s3repo.helper.ranged_download import RangedDownloader, ObjectChangedError
+from s3repo.helper.sync_helper import walk_files, compute_etag, load_sync_state, save_sync_state, \
+    MULTIPART_CHUNK_SIZE
+from s3repo.helper.chunked_storage import CHUNK_PREFIX, GC_GRACE_SECONDS, MANIFEST_METADATA, ChunkedDownloader, \
+    ChunkedStream, ChunkedUploader, collect_chunks, load_manifest
+from s3repo.helper.compression import CODEC_METADATA, CompressingReader, choose_codec, decompress_file, \
+    open_object_body
+from s3repo.helper.cancellation import check_cancelled
+from s3repo.helper.download_cache import DownloadCache
+from s3repo.helper.instrumentation import RepoStats, ContextThreadPoolExecutor, instrumented
+from s3repo.helper.retry_policy import RetryPolicy
+from s3repo.helper.repo_index import RepoIndex, is_reserved_key, get_user_key, file_sha256
+
+
+# One file in user's repo as returned by iterFiles
+FileRecord = namedtuple("FileRecord", ["key", "user_key", "size", "last_modified"])
+
+# Storage used by one user as returned by iter_usage ; largest is list of ( key , size )
+UserUsage = namedtuple("UserUsage", ["user_name", "files", "bytes", "overhead_files", "overhead_bytes", "largest",
+                                     "error"])
 
 
 def validate_bucket_Name(bucket_name):
@@ -29,10 +58,41 @@ def validate_bucket_Name(bucket_name):
         return False
 
 
+def validate_object_key(object_key):
+    """
+    Validate name of file in repo - it becomes local path when file is downloaded so it must stay relative
+    ( no leading '/' , no '.' / '..' or empty path segments )
+    :param object_key:
+    :return: True if valid else false
+    """
+    if not object_key or object_key.startswith("/"):
+        return False
+    return all(segment not in ("", ".", "..") for segment in object_key.split("/"))
+
+
 class s3RepoMain:
 
-    def __init__(self):
-        # logging setup ( default is Debug )
+    def __init__(self, auth_cache_ttl=30, auth_cache_size=1024, max_pool_connections=32, tcp_keepalive=True,
+                 lazy_connect=False, retry_mode="adaptive", max_attempts=3, bulk_retry_attempts=5,
+                 download_cache_bytes=None):
+        """
+        :param auth_cache_ttl: seconds a successful authentication is cached in this process ( 0 disables cache )
+        :param auth_cache_size: maximum number of users kept in authentication cache
+        :param max_pool_connections: size of HTTP connection pool of shared S3 client ( should be >= largest
+        concurrency used with this object )
+        :param tcp_keepalive: keep idle pooled connections alive
+        :param lazy_connect: don't connect to AWS here - boto3 session is created and credentials are checked on first
+        real request ( no ListBuckets call , no version banner ) ; used by command line programs to start fast
+        :param retry_mode: botocore retry mode - 'adaptive' ( default ) also slows client down when S3 throttles ,
+        'standard' or 'legacy'
+        :param max_attempts: attempts botocore makes for each request ( including first one ) - this is the only
+        retry of failed requests so bulk paths ( tear down , tag scans ) do not multiply attempts
+        :param bulk_retry_attempts: attempts of keys batch delete could not delete ( per-key errors come in successful
+        response so botocore does not retry them ) - see helper/retry_policy.py
+        :param download_cache_bytes: size of local download cache ( see helper/download_cache.py ) ; 0 disables it ,
+        None reads size in MB from S3REPO_DOWNLOAD_CACHE_MB environment variable ( not set = disabled )
+        """
+        # logging setup ( level and destinations come from S3REPO_LOG_* environment variables )
         self.logger = logger_setup.logger
         self.logger.name = "s3repo.s3repomain"
         # System bucket that will hold all user information (username , password )
@@ -45,13 +105,77 @@ class s3RepoMain:
         self.admin_email = "s3admin@s3users.com"
         # When user tries to download file from Repo it will be sored here
         self.output_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../output/")
+        # Local state such as checkpoints of interrupted uploads is kept here
+        self.state_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../state/")
+        # Password hash of recently authenticated users ( saves round trip to users bucket )
+        self.auth_cache = AuthCache(auth_cache_ttl, auth_cache_size)
+        # Set once users bucket is known to exist ( see init_users_bucket )
+        self._users_bucket_ready = False
+        # S3 API calls , bytes , retries and latency per public method ( see helper/instrumentation.py )
+        self.stats = RepoStats(logger=self.logger)
+        self.retry_mode = retry_mode
+        self.max_attempts = max_attempts
+        if download_cache_bytes is None:
+            download_cache_bytes = int(os.environ.get("S3REPO_DOWNLOAD_CACHE_MB", "0")) * 1024 * 1024
+        # Files downloaded before are served from here as long as S3 says they did not change
+        self.download_cache = DownloadCache(os.path.join(self.state_folder, "download-cache"),
+                                            download_cache_bytes) if download_cache_bytes > 0 else None
+        self.retry_policy = RetryPolicy(max_attempts=bulk_retry_attempts, logger=self.logger,
+                                        on_retry=self.stats.record_retry)
+        if os.environ.get("S3REPO_PROMETHEUS_FILE"):
+            # Dump statistics in Prometheus text format when program ends
+            atexit.register(self.stats.write_prometheus, os.environ["S3REPO_PROMETHEUS_FILE"])
 
         # AWS S3 info
         self.region = "us-west-2"
         self.profile = "default"  # "SharedAccount"
-        aws_helper = awsHelper(self.region, self.profile)
-        self.session = aws_helper.get_aws_connection()  # boto3 object
-        self.s3 = self.session.resource('s3')  # boto3 object
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self.lazy_connect = lazy_connect
+        self._aws_helper = awsHelper(self.region, self.profile, verbose=not lazy_connect)
+        # Session and client are created on first use - see properties below
+        self._session = None
+        self._s3_client = None
+        self._connect_lock = threading.RLock()
+        if not lazy_connect:
+            self._session = self._aws_helper.get_aws_connection()  # boto3 object
+
+    @property
+    def session(self):
+        """
+        boto3 session - with lazy_connect it is created ( and credentials are checked ) on first use
+        :return: boto3 session
+        """
+        if self._session is None:
+            with self._connect_lock:
+                if self._session is None:
+                    self._session = self._aws_helper.get_aws_connection(validate=False)
+        return self._session
+
+    @property
+    def client_config(self):
+        # botocore.config is imported here so that it is not part of program start up
+        from botocore.config import Config
+        # One client ( and so one connection pool ) is shared by all operations and threads - see s3_client
+        return Config(max_pool_connections=self.max_pool_connections, tcp_keepalive=self.tcp_keepalive,
+                      retries={"mode": self.retry_mode, "max_attempts": self.max_attempts})
+
+    @property
+    def s3_client(self):
+        """
+        S3 client shared by all methods - it is created on first use
+        Creating client is expensive ( service model is loaded ) and every new client comes with new connection pool ;
+        re-using it keeps TCP/TLS connections open between calls
+        boto3 clients are thread safe but boto3 session is not so creation is guarded by lock
+        :return: boto3 S3 client
+        """
+        if self._s3_client is None:
+            with self._connect_lock:
+                if self._s3_client is None:
+                    s3_client = self.session.client('s3', region_name=self.region, config=self.client_config)
+                    self.stats.register(s3_client.meta.events)
+                    self._s3_client = s3_client
+        return self._s3_client
 
     def init_users_bucket(self):
         """
@@ -59,10 +183,13 @@ class s3RepoMain:
         Also create a bootstrap admin user that will be used for maintenance
         :return:
         """
+        if self._users_bucket_ready:
+            # Already checked by this object - saves one request per user in bulk create
+            return True
         try:
             isBucketThere = self.bucket_name_available(self.usersBucket)
             if isBucketThere:
-                logging.debug("Bucket [" + self.usersBucket + "] already there no need to re-create it")
+                logging.debug("Bucket [%s] already there no need to re-create it", self.usersBucket)
             else:
                 self.create_userBucket(self.usersBucket)  # will create user info repo
                 # Create a bootstrap / admin user for management
@@ -71,9 +198,10 @@ class s3RepoMain:
                 if did_we_create_admin_user:
                     logging.info("Admin user has been created successfully")
 
+            self._users_bucket_ready = True
             return True
         except Exception as e:
-            self.logger.error("Error creating users repo" + str(e))
+            self.logger.error("Error creating users repo%s", e)
             raise e
 
     def bucket_name_available(self, bucket_name=None):
@@ -83,7 +211,7 @@ class s3RepoMain:
         :return: True if bucket name does not exists ; else False
         """
         try:
-            self.s3.meta.client.head_bucket(Bucket=bucket_name)
+            self.s3_client.head_bucket(Bucket=bucket_name)
             return True
         except ClientError as e:
             if "403" in str(e.response):
@@ -100,27 +228,49 @@ class s3RepoMain:
         try:
             isBucketThere = self.bucket_name_available(bucket_name)
             if isBucketThere:
-                logging.debug("Bucket [" + bucket_name + "] already there no need to re-create it")
+                logging.debug("Bucket [%s] already there no need to re-create it", bucket_name)
                 return True
             else:
-                s3_client = self.session.client('s3', region_name=self.region)
+                s3_client = self.s3_client
                 location = {'LocationConstraint': self.region}
                 s3_client.create_bucket(Bucket=bucket_name,
                                         CreateBucketConfiguration=location)
 
-                try:
-                    time.sleep(8)  # Sleep before we check if bucket has been created successfully
-                    self.s3.meta.client.head_bucket(Bucket=bucket_name)
-                    self.logger.info("Repo [" + bucket_name + "] has been created successfully")
-
+                if self.wait_for_bucket(bucket_name):
+                    self.logger.info("Repo [%s] has been created successfully", bucket_name)
                     return True
-                except ClientError as e:
-                    logging.error("Failed to create a user repo :" + str(e.response))
+                else:
+                    logging.error("Failed to create a user repo [%s] - it did not show up in time", bucket_name)
                     return False
 
         except Exception as e:
             raise e
 
+    def wait_for_bucket(self, bucket_name, timeout=60, first_delay=0.1, max_delay=5):
+        """
+        Wait until newly created bucket is visible - checks with head_bucket right away and then with exponential
+        back-off ( with jitter ) instead of one fixed sleep
+        :param bucket_name:
+        :param timeout: give up after this many seconds
+        :param first_delay: delay before second check , doubled after every check up to max_delay
+        :param max_delay:
+        :return: True if bucket exists
+        """
+        deadline = time.monotonic() + timeout
+        delay = first_delay
+        while True:
+            try:
+                self.s3_client.head_bucket(Bucket=bucket_name)
+                return True
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchBucket"):
+                    logging.error("Failed to check user repo :%s", e.response)
+                    return False
+            if time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, max_delay)
+
     def delete_userBucket(self, bucket_name):
         """
         Delete user bucket - but before that we will have to delete all files/objects in bucket one by one
@@ -130,25 +280,62 @@ class s3RepoMain:
         isBucketThere = self.bucket_name_available(bucket_name)
         if isBucketThere:
             try:
-                # s3_client = session.client('s3', region_name=region)
-                bucket = self.s3.Bucket(bucket_name)
-                bucket.objects.all().delete()
-                bucket.delete()
-                # s3_client.delete_bucket(Bucket=bucket_name)
-                self.logger.info("Repo [" + bucket_name + "] has been deleted")
+                self.empty_bucket(bucket_name)
+                self.s3_client.delete_bucket(Bucket=bucket_name)
+                self.logger.info("Repo [%s] has been deleted", bucket_name)
                 return True
+            except RuntimeError as e:
+                self.logger.error(str(e))
+                return False
             except ClientError as e:
-                self.logger.info(
-                    ("User [" + bucket_name + "] does not have any repo so skipping it's repo delete part"))
+                self.logger.info("User [%s] does not have any repo so skipping it's repo delete part", bucket_name)
                 self.logger.info(e.response)
                 return True
             except ClientError as e:
                 logging.error(e)
                 return False
         else:
-            self.logger.info("Repo [" + bucket_name + "] does not exists - no need to delete it")
+            self.logger.info("Repo [%s] does not exists - no need to delete it", bucket_name)
             return True
 
+    def empty_bucket(self, bucket_name):
+        """
+        Delete all files/objects in bucket using batch delete ( up to 1000 keys per request ) and abort unfinished
+        multipart uploads
+        :param bucket_name:
+        :return: number of objects deleted
+        :raise RuntimeError: if S3 refused to delete some of the objects
+        """
+        deleted = 0
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, PaginationConfig={"PageSize": 1000}):
+            keys = [{"Key": s3_object["Key"]} for s3_object in page.get("Contents", [])]
+            attempt = 1
+            while keys:
+                # Each listing page has at most 1000 keys - that is exactly one delete_objects batch
+                response = self.s3_client.delete_objects(Bucket=bucket_name, Delete={"Objects": keys, "Quiet": True})
+                errors = response.get("Errors", [])
+                deleted += len(keys) - len(errors)
+                if not errors:
+                    break
+                # Per-key errors come in successful response - botocore does not retry them
+                if attempt >= self.retry_policy.max_attempts or \
+                        not all(self.retry_policy.is_retryable(error.get("Code")) for error in errors):
+                    raise RuntimeError("Failed to delete [" + str(len(errors)) + "] file(s) from repo [" +
+                                       bucket_name + "] first error: " + errors[0]["Key"] + " - " +
+                                       errors[0].get("Code", ""))
+                self.retry_policy.wait("DeleteObjects", errors[0].get("Code"), attempt)
+                keys = [{"Key": error["Key"]} for error in errors]
+                attempt += 1
+
+        paginator = self.s3_client.get_paginator("list_multipart_uploads")
+        for page in paginator.paginate(Bucket=bucket_name):
+            for upload in page.get("Uploads", []):
+                self.s3_client.abort_multipart_upload(Bucket=bucket_name, Key=upload["Key"],
+                                                      UploadId=upload["UploadId"])
+        return deleted
+
+    @instrumented
     def create_user(self, user_name, password, email_id):
         """
         Add one file (entry) in users bucket that holds all the information regarding this user - but as Metadata
@@ -158,7 +345,7 @@ class s3RepoMain:
         :param email_id:
         :return: Return true if user has been created successfully else false
         """
-        self.logger.info(("About to create user [" + user_name + "]"))
+        self.logger.info("About to create user [%s]", user_name)
         if validate_bucket_Name(user_name):
             try:
                 self.init_users_bucket()
@@ -166,36 +353,24 @@ class s3RepoMain:
                 if user_name != self.admin_username:  # Admin user does not need to have Repo / bucket to store file
                     self.create_userBucket(user_name)
 
-                s3_client = self.session.client('s3', region_name=self.region)
-
-                open(user_name, 'a').close()  # Create a zero byte file on system
+                s3_client = self.s3_client
 
                 # Users password is stored as has using helper method that will hash the user password as sha256
-                s3_client.upload_file(
-                    user_name, self.usersBucket, user_name,  # upload zero byte file to S3 but set user info as Metadata
-                    ExtraArgs={"Metadata": {'password': password_helper.hash_password(password), 'email': email_id}}
+                # Zero byte object is written straight from memory - user info is in its Metadata
+                s3_client.put_object(
+                    Bucket=self.usersBucket, Key=user_name, Body=b"",
+                    Metadata={'password': password_helper.hash_password(password), 'email': email_id}
                 )
 
-                # Check to see if user has been inserted in users bucket
-                response = s3_client.head_object(
-                    Bucket=self.usersBucket,
-                    Key=user_name,
-                )
-
-                # Cleanup zero byte file
-                if os.path.exists(user_name):
-                    os.remove(user_name)
-                else:
-                    self.logger.warning("The temporary file does not exist - ignoring it deleting")
-
-                self.logger.info("User [" + user_name + "] has been created/updated in repo")
+                self.auth_cache.invalidate(user_name)
+                self.logger.info("User [%s] has been created/updated in repo", user_name)
                 return True
             except RuntimeWarning as rw:
                 if "Repo already present" in str(rw):
-                    logging.warning("Username/Repo [" + user_name + "] already exists - use different username ")
+                    logging.warning("Username/Repo [%s] already exists - use different username ", user_name)
                     return False
             except Exception as e:
-                self.logger.error("Error while creating user [" + user_name + "], Error: " + str(e.response))
+                self.logger.error("Error while creating user [%s], Error: %s", user_name, e.response)
                 return False
         else:
             self.logger.error(
@@ -203,6 +378,38 @@ class s3RepoMain:
                 "/cloudtrail-s3-bucket-naming-requirements.html")
             raise RuntimeError("User name [" + user_name + "] is invalid as per S3 rules")
 
+    @instrumented
+    def create_users(self, users, concurrency=8):
+        """
+        Create many users at once - users are created in parallel and result is reported per user
+        Users repo is initialised only once for whole batch
+        :param users: list of ( user_name , password , email_id )
+        :param concurrency: number of users created in parallel
+        :return: dict of user_name -> error message ( None if user has been created )
+        """
+        self.init_users_bucket()
+        results = {}
+        with ContextThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = {executor.submit(self.create_user, user_name, password, email_id): user_name
+                       for user_name, password, email_id in users}
+            for count, future in enumerate(as_completed(futures), 1):
+                user_name = futures[future]
+                try:
+                    results[user_name] = None if future.result() else "not created - see log"
+                except Exception as e:
+                    results[user_name] = str(e)
+                self.logger.info("[%s/%s] User [%s] %s", count, len(futures), user_name,
+                                 "created" if results[user_name] is None else "failed: " + results[user_name])
+
+        from prettytable import PrettyTable
+        x = PrettyTable()
+        x.field_names = ["User", "created?", "Error"]
+        for user_name, password, email_id in users:
+            x.add_row([user_name, results[user_name] is None, results[user_name] or ""])
+        print(x)
+        return results
+
+    @instrumented
     def delete_user(self, user_name):
         """
         Delete user - first we delete user bucket that has all the files for repo
@@ -210,25 +417,37 @@ class s3RepoMain:
         :param user_name:
         :return:
         """
-        s3_client = self.session.client('s3', region_name=self.region)
+        s3_client = self.s3_client
 
         if self.delete_userBucket(user_name):
             response = s3_client.delete_object(Bucket=self.usersBucket, Key=user_name)
-            self.logger.info("User [" + user_name + "] & and it's repo content has been deleted from repo")
+            self.auth_cache.invalidate(user_name)
+            self.logger.info("User [%s] & and it's repo content has been deleted from repo", user_name)
             return True
         else:
-            self.logger.error("Error whiling deleting user [" + user_name + "]")
+            self.logger.error("Error whiling deleting user [%s]", user_name)
             return False
 
+    @instrumented
     def authenticate_user(self, user_name, user_password):
         """
         Compare on-way has from what user provided via user_password and what is hash in users repo
         if they match password is good else bad password
+        Hash read from users repo is kept in auth cache ( for auth_cache_ttl seconds ) so repeated calls by same user
+        do not go to users repo every time
         :param user_name:
         :param user_password:
         :return:
         """
-        s3_client = self.session.client('s3', region_name=self.region)
+        password_hash = self.auth_cache.get(user_name)
+        if password_hash is not None:
+            if password_helper.check_password(password_hash, user_password):
+                self.logger.debug("User [%s] has been authenticated successfully ( cached )", user_name)
+                return True
+            # Password may have been changed by some other process - don't trust cache for failures
+            self.auth_cache.invalidate(user_name)
+
+        s3_client = self.s3_client
         try:
             response = s3_client.head_object(
                 Bucket=self.usersBucket,
@@ -236,41 +455,98 @@ class s3RepoMain:
             )
 
             try:
-                if password_helper.check_password(response["Metadata"]["password"], user_password):
-                    self.logger.debug("User [" + user_name + "] has been authenticated successfully")
+                password_hash = response["Metadata"]["password"]
+                if password_helper.check_password(password_hash, user_password):
+                    self.auth_cache.put(user_name, password_hash)
+                    self.logger.debug("User [%s] has been authenticated successfully", user_name)
                     return True
                 else:
-                    self.logger.debug("Failed to authenticate user [" + user_name + "]")
+                    self.logger.debug("Failed to authenticate user [%s]", user_name)
                     return False
             except KeyError as e:
                 self.logger.info("Required key is missing in metadata - this is unexpected error")
         except ClientError as e:
             if '404' in str(e.response):
-                self.logger.info("User [" + user_name + "] does not exists - create it first")
+                self.logger.info("User [%s] does not exists - create it first", user_name)
                 raise ValueError("User [" + user_name + "] not found")
             else:
                 self.logger.info(e)
 
-    def uploadFile(self, user_name, user_password, file_key, file):
+    @instrumented
+    def uploadFile(self, user_name, user_password, file_key, file, multipart=False, part_size=8 * 1024 * 1024,
+                   concurrency=4, dedup=False, compress=False, chunked=False):
         """
         This method enable user to upload the file to users Repo ( S3 bucket )
         While file is getting uploaded we use progress Percentage call to print upload progress
+        In multipart mode file is sent as parts in parallel and finished parts are recorded in local checkpoint (under
+        state folder) - if upload gets interrupted running same upload again only sends parts that are missing
         :param user_name:
         :param user_password:
         :param file_key:
         :param file:
+        :param multipart: use resumable multipart upload
+        :param part_size: part size in bytes for multipart upload ( minimum 5 MB )
+        :param concurrency: number of parts uploaded in parallel for multipart upload
+        :param dedup: hash file first - if same content is already in repo only user-key is recorded ( pointing to
+        existing file ) and nothing is uploaded
+        :param compress: compress file while it is uploaded if it is worth it ( by extension or sample of content ) -
+        True for default codec or codec name ( gzip / zstd ) ; compressed upload can not be resumed
+        :param chunked: store file as content-defined chunks and manifest - only chunks not in repo yet are sent so
+        upload of changed large file costs about size of change ( compress is ignored , concurrency is number of chunks
+        sent in parallel )
         :return:
         """
         if os.path.isfile(file):
             try:
                 if self.authenticate_user(user_name, user_password):
-                    s3_client = self.session.client('s3', region_name=self.region)
-                    self.logger.info(("About to upload file [" + file + "]"))
+                    s3_client = self.s3_client
+                    self.logger.info("About to upload file [%s]", file)
                     fileNamekey = os.path.basename(file);
-                    s3_client.upload_file(
-                        file, user_name, fileNamekey,
-                        Callback=ProgressPercentage(file)
-                    )
+                    extra_args = {}
+                    sha256 = None
+                    if dedup:
+                        sha256 = file_sha256(file)
+                        existing_key = self.add_dedup_alias(user_name, file_key, sha256)
+                        if existing_key is not None:
+                            self.logger.info("Content of file [%s] is already in repo as [%s] - only user-key [%s] has "
+                                             "been recorded", file, existing_key, file_key)
+                            return True
+                        extra_args = {"Metadata": {"sha256": sha256}}
+                    codec = choose_codec(file, None if compress is True else compress) if compress and not chunked \
+                        else None
+                    if chunked:
+                        uploader = ChunkedUploader(s3_client, user_name, fileNamekey, file, concurrency=concurrency,
+                                                   callback=progress_callback(file), extra_args=extra_args)
+                        try:
+                            uploader.upload()
+                        except ClientError as e:
+                            self.logger.error("Chunked upload of file [%s] failed - chunks already sent are not sent "
+                                              "again when upload is run again. Error: %s", file, e)
+                            return False
+                        self.logger.info("[%s] of [%s] chunk(s) of file [%s] were not in repo and have been uploaded ( "
+                                         "%s bytes )", uploader.sent_chunks, len(uploader.chunks), file,
+                                         uploader.sent_bytes)
+                    elif codec is not None:
+                        extra_args.setdefault("Metadata", {})[CODEC_METADATA] = codec
+                        self._upload_compressed(user_name, fileNamekey, file, codec, extra_args, part_size,
+                                                concurrency)
+                    elif multipart:
+                        uploader = MultipartUploader(s3_client, user_name, fileNamekey, file,
+                                                     self.checkpoint_file("upload", user_name, fileNamekey, file),
+                                                     part_size=part_size, concurrency=concurrency,
+                                                     callback=progress_callback(file), extra_args=extra_args)
+                        try:
+                            uploader.upload()
+                        except ClientError as e:
+                            self.logger.error("Upload of file [%s] was interrupted - run same upload again to resume "
+                                              "it. Error: %s", file, e)
+                            return False
+                    else:
+                        s3_client.upload_file(
+                            file, user_name, fileNamekey,
+                            ExtraArgs=extra_args,
+                            Callback=progress_callback(file)
+                        )
 
                     response = s3_client.put_object_tagging(
                         Bucket=user_name,
@@ -288,11 +564,15 @@ class s3RepoMain:
                         Bucket=user_name,
                         Key=fileNamekey,
                     )
-                    print("\n\r")
-                    self.logger.info("File [" + file + "] has been uploaded successfully")
+                    # Listing gives size of manifest / compressed object - size of file itself is kept in index
+                    self.update_index_entries(user_name, [(file_key, fileNamekey)],
+                                              content={sha256: fileNamekey} if sha256 else None,
+                                              sizes={fileNamekey: os.path.getsize(file)} if chunked or codec
+                                              else None)
+                    self.logger.info("File [%s] has been uploaded successfully", file)
                     return True
                 else:
-                    logging.error("User authentication failed for user: " + user_name)
+                    logging.error("User authentication failed for user: %s", user_name)
                     return False
             except ValueError as ve:
                 if "not found" in str(ve):
@@ -302,47 +582,268 @@ class s3RepoMain:
                     self.logger.error(str(ve))
                     return False
         else:
-            self.logger.error("file [" + file + "] does not exists")
+            self.logger.error("file [%s] does not exists", file)
             return False
 
-    def listFiles(self, bucket_name, user_password):
+    def _upload_compressed(self, bucket_name, object_key, file, codec, extra_args, part_size, concurrency):
+        """
+        Upload file compressed on the fly - compressed size is not known up front so it is sent as stream ( multipart
+        once more than one part )
+        :param bucket_name:
+        :param object_key:
+        :param file:
+        :param codec:
+        :param extra_args: ExtraArgs of upload ( metadata with codec )
+        :param part_size:
+        :param concurrency:
+        :return:
+        """
+        from boto3.s3.transfer import TransferConfig
+        config = TransferConfig(multipart_threshold=max(part_size, MIN_PART_SIZE),
+                                multipart_chunksize=max(part_size, MIN_PART_SIZE), max_concurrency=max(1, concurrency))
+        config.max_in_memory_upload_chunks = 2 * max(1, concurrency)
+        with open(file, "rb") as f:
+            reader = CompressingReader(f, codec, callback=progress_callback(file))
+            self.s3_client.upload_fileobj(reader, bucket_name, object_key, ExtraArgs=extra_args, Config=config)
+        self.logger.info("File [%s] has been compressed with [%s] ( %s bytes sent )", file, codec, reader.sent_bytes)
+
+    @instrumented
+    def uploadStream(self, user_name, user_password, file_key, stream, object_key=None, chunk_size=8 * 1024 * 1024,
+                     concurrency=4):
+        """
+        Upload from any readable binary stream ( open file , socket , sys.stdin.buffer ... ) to users Repo
+        Data is read and sent in chunks of chunk_size ( multipart upload once more than one chunk ) and is never
+        written to local disk ; at most 2 x concurrency chunks are held in memory
+        :param user_name:
+        :param user_password:
+        :param file_key: user-key for uploaded data
+        :param stream: binary stream with read() method - it does not need to be seekable
+        :param object_key: name of file in repo ( default is user-key )
+        :param chunk_size: bytes read and sent at a time ( minimum 5 MB )
+        :param concurrency: number of chunks uploaded in parallel
+        :return: True if data has been uploaded
+        """
+        from boto3.s3.transfer import TransferConfig
+        object_key = object_key or file_key
+        if is_reserved_key(object_key):
+            self.logger.error("File name [%s] is reserved for repo use", object_key)
+            return False
+        if not validate_object_key(object_key):
+            self.logger.error("File name [%s] is not valid - it must be relative path without '..' or empty parts",
+                              object_key)
+            return False
+        try:
+            if self.authenticate_user(user_name, user_password):
+                self.logger.info("About to upload stream as [%s]", object_key)
+                config = TransferConfig(multipart_threshold=max(chunk_size, MIN_PART_SIZE),
+                                        multipart_chunksize=max(chunk_size, MIN_PART_SIZE),
+                                        max_concurrency=max(1, concurrency))
+                # Bound memory used for non seekable streams ( default is 10 chunks )
+                config.max_in_memory_upload_chunks = 2 * max(1, concurrency)
+                counter = ByteCounter()
+                try:
+                    self.s3_client.upload_fileobj(
+                        stream, user_name, object_key,
+                        ExtraArgs={"Tagging": urlencode({"user-key": file_key})},
+                        Config=config,
+                        Callback=counter
+                    )
+                except ClientError as e:
+                    self.logger.error("Upload of stream as [%s] failed: %s", object_key, e)
+                    return False
+                self.update_index_entries(user_name, [(file_key, object_key)])
+                self.logger.info("Stream has been uploaded as [%s] ( %s bytes )", object_key, counter.total)
+                return True
+            else:
+                logging.error("User authentication failed for user: %s", user_name)
+                return False
+        except ValueError as ve:
+            self.logger.error(str(ve))
+            return False
+
+    @instrumented
+    def syncDirectory(self, user_name, user_password, directory, key_prefix="", concurrency=8):
+        """
+        Upload whole directory tree to user's repo - only files that are new or changed since they were last uploaded
+        are sent ( files are never deleted from repo )
+        Each file is stored under its relative path ( with optional key prefix ) and that same path is its user-key
+        File is unchanged when remote file has same size and ETag ; local sync state ( in state folder ) remembers
+        size / modification time / ETag of last sync so unchanged local files are not even read
+        :param user_name:
+        :param user_password:
+        :param directory: local directory to upload
+        :param key_prefix: prefix added to every object key / user-key e.g. 'nightly/'
+        :param concurrency: number of files uploaded in parallel
+        :return: True if all new / changed files have been uploaded
+        """
+        if not os.path.isdir(directory):
+            self.logger.error("Directory [%s] does not exists", directory)
+            return False
+        if key_prefix and not validate_object_key(key_prefix + "file"):
+            self.logger.error("Key prefix [%s] is not valid - it must be relative path without '..' or empty parts",
+                              key_prefix)
+            return False
+        try:
+            if self.authenticate_user(user_name, user_password):
+                if self.bucket_name_available(user_name):
+                    try:
+                        s3_client = self.s3_client
+                        # One listing of repo instead of one request per file
+                        remote_files = {}
+                        paginator = s3_client.get_paginator("list_objects_v2")
+                        for page in paginator.paginate(Bucket=user_name, Prefix=key_prefix):
+                            for s3_object in page.get("Contents", []):
+                                remote_files[s3_object["Key"]] = s3_object
+
+                        state_file = self.checkpoint_file("sync", user_name, key_prefix, directory)
+                        sync_state = load_sync_state(state_file)
+                        to_upload = []
+                        skipped = 0
+                        for relative_path, full_path in walk_files(directory):
+                            object_key = key_prefix + relative_path
+                            if is_reserved_key(object_key):
+                                continue
+                            file_stat = os.stat(full_path)
+                            remote = remote_files.get(object_key)
+                            if remote is None or remote["Size"] != file_stat.st_size:
+                                to_upload.append((object_key, full_path))
+                                continue
+                            known = sync_state.get(object_key)
+                            if known and known[0] == file_stat.st_size and known[1] == file_stat.st_mtime and \
+                                    known[2] == remote["ETag"]:
+                                skipped += 1
+                                continue
+                            # Same size but local file was touched ( or never synced from here ) - compare content
+                            local_etag = compute_etag(full_path)
+                            if local_etag == remote["ETag"]:
+                                sync_state[object_key] = [file_stat.st_size, file_stat.st_mtime, local_etag]
+                                skipped += 1
+                            else:
+                                to_upload.append((object_key, full_path))
+
+                        self.logger.info("Sync of [%s]: [%s] file(s) to upload , [%s] unchanged", directory,
+                                         len(to_upload), skipped)
+
+                        uploaded = []
+                        failed = 0
+                        with ContextThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                            futures = {executor.submit(self._sync_upload_file, user_name, object_key, full_path):
+                                       (object_key, full_path) for object_key, full_path in to_upload}
+                            for future in as_completed(futures):
+                                object_key, full_path = futures[future]
+                                try:
+                                    sync_state[object_key] = future.result()
+                                    uploaded.append((object_key, object_key))
+                                    self.logger.info("File [%s] has been uploaded as [%s]", full_path, object_key)
+                                except (ClientError, OSError) as e:
+                                    failed += 1
+                                    self.logger.error("Failed to upload file [%s]: %s", full_path, e)
+
+                        if uploaded:
+                            self.update_index_entries(user_name, uploaded)
+                        save_sync_state(state_file, sync_state)
+                        self.logger.info("Sync of [%s] done: [%s] uploaded , [%s] unchanged , [%s] failed", directory,
+                                         len(uploaded), skipped, failed)
+                        return failed == 0
+                    except ClientError as e:
+                        self.logger.error(e.response)
+                        return False
+                else:
+                    logging.error("Repo [%s] does not exists", user_name)
+                    return False
+            else:
+                logging.error("User authentication failed for user: %s", user_name)
+                return False
+        except ValueError as ve:
+            if "not found" in str(ve):
+                self.logger.error(str(ve))
+                return False
+
+    def _sync_upload_file(self, user_name, object_key, file):
+        """
+        Upload one file for syncDirectory - user-key tag is set in same request
+        Multipart threshold / chunk size match compute_etag so next sync can compare ETag with local file
+        :param user_name:
+        :param object_key:
+        :param file:
+        :return: sync state entry [ size , modification time , ETag ]
+        """
+        from boto3.s3.transfer import TransferConfig
+        check_cancelled()
+        file_stat = os.stat(file)
+        self.s3_client.upload_file(
+            file, user_name, object_key,
+            ExtraArgs={"Tagging": urlencode({"user-key": object_key})},
+            Callback=progress_callback(file),
+            Config=TransferConfig(multipart_threshold=MULTIPART_CHUNK_SIZE, multipart_chunksize=MULTIPART_CHUNK_SIZE)
+        )
+        response = self.s3_client.head_object(Bucket=user_name, Key=object_key)
+        return [file_stat.st_size, file_stat.st_mtime, response["ETag"]]
+
+    @instrumented
+    def iterFiles(self, bucket_name, user_password, prefix="", start_after="", limit=None, concurrency=1,
+                  with_tags=True):
+        """
+        List files stored in user's Repo as records instead of printing them
+        Files are read one listing page at a time so memory use does not grow with size of repo
+        :param bucket_name:
+        :param user_password:
+        :param prefix: only files whose name starts with prefix
+        :param start_after: only files whose name sorts after this one - pass key of last record to get next page
+        :param limit: stop after this many records ( None = all )
+        :param concurrency: number of tags fetched in parallel
+        :param with_tags: fetch user-key of every file ( one extra request per file )
+        :return: generator of FileRecord( key , user_key , size , last_modified )
+        :raise ValueError: if user can't be authenticated or repo does not exists
+        """
+        if not self.authenticate_user(bucket_name, user_password):
+            raise ValueError("User authentication failed for user: " + bucket_name)
+        if not self.bucket_name_available(bucket_name):
+            raise ValueError("Repo [" + bucket_name + "] does not exists")
+        if limit is not None and limit <= 0:
+            return
+        count = 0
+        for record in self.iter_file_records(bucket_name, concurrency, prefix=prefix, start_after=start_after,
+                                             with_tags=with_tags):
+            yield record
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+    @instrumented
+    def listFiles(self, bucket_name, user_password, concurrency=1, stream=False):
         """
         This will list all files stored in user's Repo ( S3 bucket ) - listing will happen using python module PrettyTable
         TO DO : Actually we should return list of file and caller method should use prettyTable or whatever they need
         to print the data
         :param bucket_name:
         :param user_password:
+        :param concurrency: number of tags fetched in parallel ( 1 = one after other )
+        :param stream: print each row as soon as it is available instead of one table at the end
         :return:
         """
         try:
             if self.authenticate_user(bucket_name, user_password):
                 if self.bucket_name_available(bucket_name):
                     try:
-                        bucket = self.s3.Bucket(bucket_name)
+                        from prettytable import PrettyTable
                         x = PrettyTable()
-                        logging.info("Printing content of Repo: " + bucket_name)
+                        logging.info("Printing content of Repo: %s", bucket_name)
                         x.field_names = ["File", "User key/Tag", "lastModified", "Size"]
-                        bucketContent = bucket.objects.all();
                         bHasFiles = False
-                        for my_bucket_object in bucket.objects.all():
+                        for record in self.iter_file_records(bucket_name, concurrency):
+                            row = [record.key, record.user_key, record.last_modified, record.size]
+                            if stream:
+                                if not bHasFiles:
+                                    print(" | ".join(x.field_names))
+                                print(" | ".join(str(column) for column in row))
+                            else:
+                                x.add_row(row)
                             bHasFiles = True
-                            # For this object/key get tag set by user
-                            s3_client = self.session.client('s3', region_name=self.region)
-                            response = s3_client.get_object_tagging(
-                                Bucket=bucket_name,
-                                Key=my_bucket_object.key
-                            )
-                            tag_set = response["TagSet"]
-                            user_tag = ""
-                            for tag in tag_set:
-                                if tag["Key"] == "user-key":
-                                    user_tag = tag["Value"]
-
-                            x.add_row(
-                                [my_bucket_object.key, user_tag, my_bucket_object.last_modified, my_bucket_object.size])
 
                         if bHasFiles:
-                            print(x)
+                            if not stream:
+                                print(x)
                             return True
                         else:
                             self.logger.warning("User's repo is empty")
@@ -351,18 +852,23 @@ class s3RepoMain:
                     except ClientError as e:
                         self.logger.error(e.response)
                 else:
-                    logging.error("Repo [" + bucket_name + "] does not exists")
+                    logging.error("Repo [%s] does not exists", bucket_name)
             else:
-                logging.error("User authentication failed for user: " + bucket_name)
+                logging.error("User authentication failed for user: %s", bucket_name)
                 return False
         except ValueError as ve:
             if "not found" in str(ve):
                 self.logger.error(str(ve))
                 return False
 
-    def getFile(self, bucket_name, user_password, user_Key, output_location):
+    @instrumented
+    def getFile(self, bucket_name, user_password, user_Key, output_location, parallel=False,
+                part_size=8 * 1024 * 1024, concurrency=4):
         """
         Given user-key / tag find a file in user's repo and download it to given location
+        :param parallel: use parallel ranged download with resume ( see downloadFile )
+        :param part_size:
+        :param concurrency:
         :param output_location:
         :param user_Key:
         :param bucket_name:
@@ -373,58 +879,136 @@ class s3RepoMain:
             if self.authenticate_user(bucket_name, user_password):
                 if self.bucket_name_available(bucket_name):
                     try:
-                        bucket = self.s3.Bucket(bucket_name)
                         user_Key = str.strip(user_Key)
-                        did_we_foundFile = False
-                        for my_bucket_object in bucket.objects.all():
-                            # For this object/key get tag set by user
-                            s3_client = self.session.client('s3', region_name=self.region)
-                            response = s3_client.get_object_tagging(
-                                Bucket=bucket_name,
-                                Key=my_bucket_object.key
-                            )
-                            tag_set = response["TagSet"]
-                            for tag in tag_set:
-                                if tag["Key"] == "user-key":
-                                    if user_Key == tag["Value"]:
-                                        did_we_foundFile = True
-                                        output_location = str.strip(output_location)
-                                        if not len(output_location) > 0:
-                                            self.logger.warning("User provided empty location for output location - we "
-                                                                "will use default location [" + self.output_folder + "]")
-                                            output_location = "--"
-                                        self.logger.info(
-                                            "Found file [" + my_bucket_object.key + "] for provided user-key [" + user_Key + "]")
-                                        return self.downloadFile(bucket_name, user_password, my_bucket_object.key,
-                                                                 skip_auth=True, output_location=output_location)
-
-                        if not did_we_foundFile:
-                            logging.warning("No file found matching user key [" + user_Key + "]")
+                        object_key = self.find_object_key(bucket_name, user_Key)
+                        if object_key is not None:
+                            output_location = str.strip(output_location)
+                            if not len(output_location) > 0:
+                                self.logger.warning("User provided empty location for output location - we will use "
+                                                    "default location [%s]", self.output_folder)
+                                output_location = "--"
+                            self.logger.info("Found file [%s] for provided user-key [%s]", object_key, user_Key)
+                            return self.downloadFile(bucket_name, user_password, object_key,
+                                                     skip_auth=True, output_location=output_location,
+                                                     parallel=parallel, part_size=part_size,
+                                                     concurrency=concurrency)
+                        else:
+                            logging.warning("No file found matching user key [%s]", user_Key)
                             return False
 
                     except ClientError as e:
                         self.logger.error(e.response)
                 else:
-                    logging.error("Repo [" + bucket_name + "] does not exists")
+                    logging.error("Repo [%s] does not exists", bucket_name)
                     return False
             else:
-                logging.error("User authentication failed for user: " + bucket_name)
+                logging.error("User authentication failed for user: %s", bucket_name)
                 return False
         except ValueError as ve:
             if "not found" in str(ve):
                 self.logger.error(str(ve))
                 return False
 
-    def downloadFile(self, user_name, user_password, file_name, output_location="--", skip_auth=False):
+    @instrumented
+    def openFile(self, bucket_name, user_password, user_Key):
+        """
+        Given user-key / tag find a file in user's repo and open it for reading - nothing is written to local disk
+        Returned stream has read( size ) , readinto( buffer ) and iter_chunks( chunk_size ) - caller has to close it
+        :param bucket_name:
+        :param user_password:
+        :param user_Key:
+        :return: binary stream of file content or None if file can't be opened ( reason is logged )
+        """
+        try:
+            if self.authenticate_user(bucket_name, user_password):
+                try:
+                    user_Key = str.strip(user_Key)
+                    object_key = self.find_object_key(bucket_name, user_Key)
+                    if object_key is None:
+                        logging.warning("No file found matching user key [%s]", user_Key)
+                        return None
+                    self.logger.info("Found file [%s] for provided user-key [%s]", object_key, user_Key)
+                    response = self.s3_client.get_object(Bucket=bucket_name, Key=object_key)
+                    manifest = load_manifest(response)
+                    if manifest is not None:
+                        return ChunkedStream(self.s3_client, bucket_name, manifest)
+                    return open_object_body(response)
+                except ClientError as e:
+                    if '404' in str(e.response) or 'NoSuchBucket' in str(e.response):
+                        logging.error("File for user-key [%s] or repo [%s] does not exists", user_Key, bucket_name)
+                    else:
+                        self.logger.error(e.response)
+                    return None
+            else:
+                logging.error("User authentication failed for user: %s", bucket_name)
+                return None
+        except ValueError as ve:
+            self.logger.error(str(ve))
+            return None
+
+    @instrumented
+    def iterFile(self, bucket_name, user_password, user_Key, chunk_size=1024 * 1024):
+        """
+        Given user-key / tag yield content of file in user's repo as chunks of at most chunk_size bytes
+        Memory use is bounded by chunk_size whatever the file size is
+        :param bucket_name:
+        :param user_password:
+        :param user_Key:
+        :param chunk_size:
+        :return: generator of bytes
+        :raise ValueError: if file can't be opened
+        """
+        body = self.openFile(bucket_name, user_password, user_Key)
+        if body is None:
+            raise ValueError("File for user-key [" + user_Key + "] can't be read")
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    @instrumented
+    def getFileToStream(self, bucket_name, user_password, user_Key, output_stream, chunk_size=1024 * 1024):
+        """
+        Given user-key / tag write content of file in user's repo to binary stream ( e.g. sys.stdout.buffer )
+        :param bucket_name:
+        :param user_password:
+        :param user_Key:
+        :param output_stream: binary stream with write() method
+        :param chunk_size:
+        :return: True if whole file has been written
+        """
+        body = self.openFile(bucket_name, user_password, user_Key)
+        if body is None:
+            return False
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                output_stream.write(chunk)
+            output_stream.flush()
+            return True
+        finally:
+            body.close()
+
+    @instrumented
+    def downloadFile(self, user_name, user_password, file_name, output_location="--", skip_auth=False, parallel=False,
+                     part_size=8 * 1024 * 1024, concurrency=4):
         """
         Download file from users Repo ( S3 bucket )
         It  will download file in fixed location 'download_to_this_folder' defined as constant
         If file with same name present it will give you warning - but at same time it will overwrite it
+        In parallel mode file is fetched as byte ranges into temporary file next to target ; finished ranges are
+        recorded in side-car checkpoint so interrupted download resumes when run again and target file is only
+        replaced ( renamed ) once download is complete
+        File stored compressed ( see uploadFile ) is decompressed so downloaded file has its original content ; file
+        stored as chunks is re-assembled from its chunks fetched in parallel ( concurrency )
         :param output_location:
         :param skip_auth:
         :param user_name:
         :param user_password:
         :param file_name:
+        :param parallel: use parallel ranged download with resume
+        :param part_size: size of each byte range for parallel download
+        :param concurrency: number of ranges downloaded in parallel
         :return:
         """
         checkUserAuth = True if skip_auth else self.authenticate_user(user_name, user_password)
@@ -441,33 +1025,157 @@ class s3RepoMain:
                         download_to_this_folder = os.path.join(output_location,
                                                                file_name)  # output_location + file_name
                     else:
-                        self.logger.error("Output folder [" + output_location + "] does not exists create it first ")
+                        self.logger.error("Output folder [%s] does not exists create it first ", output_location)
                         return False
 
+                target_folder = os.path.realpath(self.output_folder if output_location == "--" else output_location)
+                if not os.path.realpath(download_to_this_folder).startswith(target_folder + os.sep):
+                    self.logger.error("File [%s] would be written outside of folder [%s] - not downloaded", file_name,
+                                      target_folder)
+                    return False
+
+                if not os.path.exists(os.path.dirname(download_to_this_folder)):
+                    # File uploaded by directory sync can be in sub folder
+                    os.makedirs(os.path.dirname(download_to_this_folder))
+
                 if os.path.isfile(download_to_this_folder):
-                    self.logger.warning(
-                        "File [" + file_name + "] already exists in location [" + self.output_folder + "] it will "
-                                                                                                       "be "
-                                                                                                       "overwritten")
+                    self.logger.warning("File [%s] already exists in location [%s] it will be overwritten", file_name,
+                                        self.output_folder)
 
                 try:
-                    self.s3.Bucket(user_name).download_file(file_name, download_to_this_folder)
+                    if self.download_cache is not None:
+                        if not self._download_cached(user_name, file_name, download_to_this_folder, parallel,
+                                                     part_size, concurrency):
+                            return False
+                    elif parallel:
+                        if self._download_ranged(user_name, file_name, download_to_this_folder, part_size,
+                                                 concurrency) is None:
+                            return False
+                    else:
+                        self._download_object(user_name, file_name, download_to_this_folder, concurrency=concurrency)
                     if os.path.isfile(download_to_this_folder):
-                        self.logger.info(
-                            "File [" + file_name + "] has been downloaded to: [" + download_to_this_folder + "]")
+                        self.logger.info("File [%s] has been downloaded to: [%s]", file_name, download_to_this_folder)
                     return True
                 except ClientError as e:
                     if '404' in str(e.response):
-                        self.logger.info("File [" + file_name + "] does not exists - upload it first")
+                        self.logger.info("File [%s] does not exists - upload it first", file_name)
                     else:
                         self.logger.info(e)
             else:
-                self.logger.error("User authentication failed for user: " + user_name)
+                self.logger.error("User authentication failed for user: %s", user_name)
         except ValueError as ve:
             if "not found" in str(ve):
                 self.self.logger.error(str(ve))
                 return False
 
+    def _download_cached(self, bucket_name, object_key, destination, parallel, part_size, concurrency):
+        """
+        Download through local download cache - when cache has a copy S3 is asked for object only if its ETag is
+        different ( If-None-Match ) ; unchanged object is copied from cache instead of downloaded
+        :param bucket_name:
+        :param object_key:
+        :param destination:
+        :param parallel: use parallel ranged download ( conditional head_object first )
+        :param part_size:
+        :param concurrency:
+        :return: True if destination has latest content , False if object changed during ranged download
+        :raise ClientError: if object can't be read
+        """
+        cached_etag = self.download_cache.lookup(bucket_name, object_key)
+        conditional = {"IfNoneMatch": cached_etag} if cached_etag is not None else {}
+        try:
+            if parallel:
+                if cached_etag is not None:
+                    self.s3_client.head_object(Bucket=bucket_name, Key=object_key, **conditional)
+                etag = self._download_ranged(bucket_name, object_key, destination, part_size, concurrency)
+                if etag is None:
+                    return False
+            else:
+                etag = self._download_object(bucket_name, object_key, destination, concurrency=concurrency,
+                                             **conditional)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("304", "NotModified"):
+                raise e
+            size = self.download_cache.copy_to(bucket_name, object_key, destination, cached_etag)
+            if size is None:
+                # Other program evicted or replaced cached copy since lookup - download it again
+                self.download_cache.invalidate(bucket_name, object_key)
+                return self._download_cached(bucket_name, object_key, destination, parallel, part_size, concurrency)
+            self.logger.info("File [%s] has not changed - [%s] bytes served from local cache", object_key, size)
+            return True
+        self.download_cache.store(bucket_name, object_key, etag, destination)
+        return True
+
+    def _download_ranged(self, bucket_name, object_key, destination, part_size, concurrency):
+        """
+        Parallel ranged download ( see downloadFile ) - chunked file is fetched as its chunks instead and compressed
+        file is decompressed once all ranges are there
+        :param bucket_name:
+        :param object_key:
+        :param destination:
+        :param part_size:
+        :param concurrency:
+        :return: ETag of downloaded object or None if object changed during download
+        :raise ClientError: if object can't be read
+        """
+        downloader = RangedDownloader(self.s3_client, bucket_name, object_key, destination, part_size=part_size,
+                                      concurrency=concurrency)
+        size = downloader.head()
+        if MANIFEST_METADATA in downloader.metadata:
+            return self._download_object(bucket_name, object_key, destination, concurrency=concurrency)
+        downloader.callback = progress_callback(object_key, size=size, label="Downloading")
+        try:
+            etag = downloader.download()
+        except ObjectChangedError as oce:
+            self.logger.error("%s - run download again", oce)
+            return None
+        if downloader.metadata.get(CODEC_METADATA):
+            decompress_file(destination, downloader.metadata[CODEC_METADATA])
+        return etag
+
+    def _download_object(self, bucket_name, object_key, destination, concurrency=4, **kwargs):
+        """
+        Download object - plain object goes through managed transfer ( large object is fetched as ranged parts in
+        parallel ) , compressed object is decompressed while it is written and chunks of chunked file are fetched in
+        parallel ; destination is replaced only when whole file is there
+        :param bucket_name:
+        :param object_key:
+        :param destination:
+        :param concurrency: number of parts / chunks downloaded in parallel
+        :param kwargs: more head_object / get_object arguments ( e.g. IfNoneMatch )
+        :return: ETag of downloaded object
+        :raise ClientError: if object can't be read
+        """
+        from boto3.s3.transfer import TransferConfig
+        response = self.s3_client.head_object(Bucket=bucket_name, Key=object_key, **kwargs)
+        metadata = response.get("Metadata", {})
+        if MANIFEST_METADATA not in metadata and CODEC_METADATA not in metadata:
+            self.s3_client.download_file(bucket_name, object_key, destination,
+                                         Callback=progress_callback(object_key, size=response["ContentLength"],
+                                                                    label="Downloading"),
+                                         Config=TransferConfig(max_concurrency=max(1, concurrency)))
+            return response["ETag"]
+
+        response = self.s3_client.get_object(Bucket=bucket_name, Key=object_key, **kwargs)
+        manifest = load_manifest(response)
+        if manifest is not None:
+            ChunkedDownloader(self.s3_client, bucket_name, manifest, destination, concurrency=concurrency,
+                              callback=progress_callback(object_key, size=manifest["size"],
+                                                         label="Downloading")).download()
+            return response["ETag"]
+        body = open_object_body(response)
+        temp_file = destination + ".s3repo-part"
+        try:
+            with open(temp_file, "wb") as f:
+                for chunk in body.iter_chunks(1024 * 1024):
+                    check_cancelled()
+                    f.write(chunk)
+        finally:
+            body.close()
+        os.replace(temp_file, destination)
+        return response["ETag"]
+
+    @instrumented
     def deleteFile(self, bucket_name, user_password, user_Key):
         """
         Given user-key / tag find a file in user's repo and delete it to given location
@@ -480,40 +1188,39 @@ class s3RepoMain:
             if self.authenticate_user(bucket_name, user_password):
                 if self.bucket_name_available(bucket_name):
                     try:
-                        bucket = self.s3.Bucket(bucket_name)
                         user_Key = str.strip(user_Key)
-                        did_we_foundFile = False
-                        for my_bucket_object in bucket.objects.all():
-                            # For this object/key get tag set by user
-                            s3_client = self.session.client('s3', region_name=self.region)
-                            response = s3_client.get_object_tagging(
-                                Bucket=bucket_name,
-                                Key=my_bucket_object.key
-                            )
-                            tag_set = response["TagSet"]
-                            for tag in tag_set:
-                                if tag["Key"] == "user-key":
-                                    if user_Key == tag["Value"]:
-                                        did_we_foundFile = True
-                                        return self.deleteFileInBucket(bucket_name,user_password,my_bucket_object.key,skip_auth=True)
-
-                        if not did_we_foundFile:
-                            logging.warning("No file found matching user key [" + user_Key + "]")
+                        index = RepoIndex(self.s3_client, bucket_name)
+                        object_key = self.find_object_key(bucket_name, user_Key, index=index)
+                        other_user_keys = [key for key in index.user_keys_of(object_key) if key != user_Key]
+                        if object_key is not None and other_user_keys:
+                            # Dedup file still used by other user-keys - only this user-key goes away
+                            index.update(lambda index: index.remove_user_key(user_Key))
+                            self.s3_client.put_object_tagging(
+                                Bucket=bucket_name, Key=object_key,
+                                Tagging={'TagSet': [{'Key': 'user-key', 'Value': other_user_keys[0]}]})
+                            self.logger.info("User-key [%s] has been deleted - file [%s] is kept as it is used by "
+                                             "other user-key(s)", user_Key, object_key)
+                            return True
+                        elif object_key is not None:
+                            return self.deleteFileInBucket(bucket_name, user_password, object_key, skip_auth=True)
+                        else:
+                            logging.warning("No file found matching user key [%s]", user_Key)
                             return False
 
                     except ClientError as e:
                         self.logger.error(e.response)
                 else:
-                    logging.error("Repo [" + bucket_name + "] does not exists")
+                    logging.error("Repo [%s] does not exists", bucket_name)
                     return False
             else:
-                logging.error("User authentication failed for user: " + bucket_name)
+                logging.error("User authentication failed for user: %s", bucket_name)
                 return False
         except ValueError as ve:
             if "not found" in str(ve):
                 self.logger.error(str(ve))
                 return False
 
+    @instrumented
     def deleteFileInBucket(self, user_name, user_password, file_name, skip_auth=False):
         """
         Delete object from users repo
@@ -527,65 +1234,480 @@ class s3RepoMain:
         try:
             if checkUserAuth:
                 try:
-                    s3_client = self.session.client('s3', region_name=self.region)
+                    s3_client = self.s3_client
                     s3_client.delete_object(Bucket=user_name, Key=file_name)
-                    self.logger.info(
-                        "File [" + file_name + "] has been deleted")
+                    self.remove_from_index(user_name, file_name)
+                    if self.download_cache is not None:
+                        self.download_cache.invalidate(user_name, file_name)
+                    self.logger.info("File [%s] has been deleted", file_name)
                     return True
                 except ClientError as e:
                     if '404' in str(e.response):
-                        self.logger.info("File [" + file_name + "] does not exists - upload it first")
+                        self.logger.info("File [%s] does not exists - upload it first", file_name)
                     else:
                         self.logger.info(e)
             else:
-                self.logger.error("User authentication failed for user: " + user_name)
+                self.logger.error("User authentication failed for user: %s", user_name)
         except ValueError as ve:
             if "not found" in str(ve):
                 self.self.logger.error(str(ve))
                 return False
 
-    def tear_down_all(self, _admin_password):
+    def checkpoint_file(self, operation, bucket_name, object_key, local_file):
+        """
+        Path of local checkpoint file used to resume interrupted transfer
+        :param operation: 'upload' or 'download'
+        :param bucket_name:
+        :param object_key:
+        :param local_file:
+        :return: path under state folder ( folder is created if needed )
+        """
+        if not os.path.exists(self.state_folder):
+            os.makedirs(self.state_folder)
+        name = hashlib.sha1((bucket_name + "/" + object_key + "|" + os.path.abspath(local_file)).encode()).hexdigest()
+        return os.path.join(self.state_folder, operation + "-" + name + ".json")
+
+    def find_object_key(self, bucket_name, user_Key, index=None, scan_on_miss=False):
+        """
+        Find object key in user's repo for given user-key / tag
+        Lookup is done using repo index - when repo has index it is trusted so unknown user-key costs one request ,
+        not one per file ( index that got out of sync is fixed by rebuild_index ) ; tags of every object in bucket are
+        only scanned when repo has no index yet or caller asks for it
+        :param bucket_name:
+        :param user_Key:
+        :param index: optional RepoIndex - it is loaded here so caller can use it afterwards
+        :param scan_on_miss: scan tags also when user-key is not in existing index ; user-key found that way is added
+        to index
+        :return: object key or None if no file has given user-key
+        """
+        s3_client = self.s3_client
+        if index is None:
+            index = RepoIndex(s3_client, bucket_name)
+        if index.load():
+            object_key = index.lookup(user_Key)
+            if object_key is not None or not scan_on_miss:
+                return object_key
+            self.logger.debug("User-key [%s] is not in index of repo [%s] - scanning tags of all files", user_Key,
+                              bucket_name)
+        else:
+            self.logger.debug("Repo [%s] has no index - scanning tags of all files", bucket_name)
+        for record in self.iter_file_records(bucket_name):
+            if record.user_key == user_Key:
+                if index.exists:
+                    # Repair index so next lookup does not need scan
+                    index.update(lambda index: index.add_alias(user_Key, record.key))
+                return record.key
+        return None
+
+    def iter_file_records(self, bucket_name, concurrency=1, prefix="", start_after="", with_tags=True):
+        """
+        Walk files in user's repo ( one listing page of up to 1000 files at a time ) together with their user-key / tag
+        With concurrency > 1 tags are fetched by a thread pool ; at most 2 x concurrency requests are in flight and
+        files are still returned in listing order
+        :param bucket_name:
+        :param concurrency:
+        :param prefix: only files whose name starts with prefix
+        :param start_after: only files whose name sorts after this one ( to continue earlier listing )
+        :param with_tags: fetch user-key of every file ( one request per file ) - user_key is None when False
+        :return: generator of FileRecord ; user_key is empty string if file has no tag
+        """
+        # Shared client is used by all threads - boto3 clients are thread safe ( creating them is not )
+        s3_client = self.s3_client
+        # Size of chunked / compressed files
+        index = RepoIndex(s3_client, bucket_name)
+        index.load()
+
+        def get_tag(object_key):
+            # For this object/key get tag set by user
+            response = s3_client.get_object_tagging(
+                Bucket=bucket_name,
+                Key=object_key
+            )
+            return get_user_key(response["TagSet"]) or ""
+
+        def list_objects():
+            paginator = s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, StartAfter=start_after):
+                for s3_object in page.get("Contents", []):
+                    if not is_reserved_key(s3_object["Key"]):
+                        yield s3_object
+
+        def to_record(s3_object, user_key):
+            return FileRecord(s3_object["Key"], user_key, index.file_size(s3_object["Key"], s3_object["Size"]),
+                              s3_object["LastModified"])
+
+        if not with_tags or concurrency <= 1:
+            for s3_object in list_objects():
+                yield to_record(s3_object, get_tag(s3_object["Key"]) if with_tags else None)
+            return
+
+        with ContextThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = deque()
+            for s3_object in list_objects():
+                pending.append((s3_object, executor.submit(get_tag, s3_object["Key"])))
+                if len(pending) >= 2 * concurrency:
+                    done_object, future = pending.popleft()
+                    yield to_record(done_object, future.result())
+            while pending:
+                done_object, future = pending.popleft()
+                yield to_record(done_object, future.result())
+
+    def update_index(self, bucket_name, user_Key, object_key):
+        """
+        Record user-key -> object key mapping in repo index
+        If repo does not have index yet it is first re-built from existing tags so older files are not lost
+        :param bucket_name:
+        :param user_Key:
+        :param object_key:
+        :return:
+        """
+        self.update_index_entries(bucket_name, [(user_Key, object_key)])
+
+    def update_index_entries(self, bucket_name, entries, content=None, sizes=None):
+        """
+        Record many user-key -> object key mappings in repo index with one index read and one write
+        :param bucket_name:
+        :param entries: list of ( user-key , object key )
+        :param content: optional dict of sha256 -> object key for files uploaded in dedup mode
+        :param sizes: optional dict of object key -> file size for files stored as chunks or compressed
+        :return:
+        """
+        def change(index):
+            if not index.exists:
+                index.rebuild()
+            for user_Key, object_key in entries:
+                index.put(user_Key, object_key)
+            for sha256, object_key in (content or {}).items():
+                index.put_content(sha256, object_key)
+            for object_key, size in (sizes or {}).items():
+                index.put_size(object_key, size)
+
+        RepoIndex(self.s3_client, bucket_name).update(change)
+
+    def add_dedup_alias(self, bucket_name, user_Key, sha256):
+        """
+        If file with given content is already in repo record user-key for it ( no upload needed )
+        Content is looked up in repo index and confirmed by sha256 stored in metadata of that file
+        :param bucket_name:
+        :param user_Key:
+        :param sha256: sha256 of file content
+        :return: object key of existing file or None if content is not in repo yet
+        """
+        index = RepoIndex(self.s3_client, bucket_name)
+        if not index.load():
+            return None
+        object_key = index.lookup_content(sha256)
+        if object_key is None:
+            return None
+        try:
+            response = self.s3_client.head_object(Bucket=bucket_name, Key=object_key)
+            if response["Metadata"].get("sha256") != sha256:
+                object_key = None
+        except ClientError as e:
+            if '404' not in str(e.response):
+                raise e
+            object_key = None
+        if object_key is None:
+            # File was overwritten or deleted outside of repo - forget stale hash
+            index.update(lambda index: index.content.pop(sha256, None) is not None)
+            return None
+        index.update(lambda index: index.add_alias(user_Key, object_key))
+        return object_key
+
+    def remove_from_index(self, bucket_name, object_key):
+        """
+        Remove all user-keys pointing to given object key from repo index
+        :param bucket_name:
+        :param object_key:
+        :return:
+        """
+        RepoIndex(self.s3_client, bucket_name).update(lambda index: bool(index.exists and
+                                                                           index.remove_object(object_key)))
+
+    @instrumented
+    def rebuild_index(self, user_name, user_password, chunk_grace_seconds=GC_GRACE_SECONDS):
+        """
+        Re-create repo index of user from 'user-key' tags of all files in user's repo
+        Chunks no chunked file uses any more ( file deleted or overwritten ) are deleted at same time and sizes of
+        chunked files are read back from their manifests
+        :param user_name:
+        :param user_password:
+        :param chunk_grace_seconds: unused chunks younger than this are kept ( upload may still be running )
+        :return: True if index has been re-built else False
+        """
+        try:
+            if self.authenticate_user(user_name, user_password):
+                if self.bucket_name_available(user_name):
+                    try:
+                        s3_client = self.s3_client
+                        sizes, deleted, freed = collect_chunks(s3_client, user_name, chunk_grace_seconds)
+
+                        def change(index):
+                            index.sizes.update(sizes)
+                            return index.rebuild()
+
+                        # Loaded first so extra user-keys of dedup files are kept
+                        count = RepoIndex(s3_client, user_name).update(change)
+                        self.logger.info("Index of repo [%s] has been re-built with [%s] user-key(s) , [%s] unused "
+                                         "chunk(s) deleted ( %s bytes )", user_name, count, deleted, freed)
+                        return True
+                    except ClientError as e:
+                        self.logger.error(e.response)
+                        return False
+                    except RuntimeError as e:
+                        self.logger.error(str(e))
+                        return False
+                else:
+                    logging.error("Repo [%s] does not exists", user_name)
+                    return False
+            else:
+                logging.error("User authentication failed for user: %s", user_name)
+                return False
+        except ValueError as ve:
+            if "not found" in str(ve):
+                self.logger.error(str(ve))
+                return False
+
+    @instrumented
+    def tear_down_all(self, _admin_password, concurrency=8):
         """
         This is a special method that will tear down all the S3 buckets that this program has created
         This can be used to cleanup
+        User repos are deleted in parallel ( concurrency at a time ) ; each finished user is written to journal file
+        in state folder so if tear down is interrupted ( or some users failed ) running it again skips users that are
+        already done ( head_bucket confirms their repo is gone ) - users repo itself is only deleted when every user
+        repo has been deleted
         ***************** BE MINDFUL WHEN USING THIS METHOD ******************
         :param _admin_password:
-        :return:
+        :param concurrency: number of user repos deleted in parallel
+        :return: True if all user repos and users repo have been deleted else False
         """
         try:
             logging.warning("About to destroy all users and user repo")
             if self.authenticate_user(self.admin_username, _admin_password):
                 if self.bucket_name_available(self.usersBucket):
                     try:
-                        bucket = self.s3.Bucket(self.usersBucket)
+                        from prettytable import PrettyTable
                         x = PrettyTable()
-                        logging.info("Printing content of Repo: " + self.usersBucket)
-                        x.field_names = ["File", "lastModified", "Size", "deleted?"]
-                        bHasFiles = False
-                        for my_bucket_object in bucket.objects.all():
-                            bHasFiles = True
-                            did_we_delete = self.delete_userBucket(my_bucket_object.key)
-                            x.add_row(
-                                [my_bucket_object.key, my_bucket_object.last_modified, my_bucket_object.size,
-                                 did_we_delete])
+                        logging.info("Printing content of Repo: %s", self.usersBucket)
+                        x.field_names = ["File", "lastModified", "Size", "deleted?", "Error"]
 
-                        if bHasFiles:
-                            print(x)
-                            logging.warning("About to destroy main user repo")
-                            self.delete_userBucket(self.usersBucket)
-                            logging.info("Tear down complete")
-                            return True
-                        else:
+                        journal_file = os.path.join(self.state_folder, "tear_down.json")
+                        done_users = self._load_journal(journal_file)
+                        users = []
+                        paginator = self.s3_client.get_paginator("list_objects_v2")
+                        for page in paginator.paginate(Bucket=self.usersBucket):
+                            users.extend(page.get("Contents", []))
+                        if not users and not done_users:
                             self.logger.warning("User's repo is empty")
+                            return False
+
+                        # Journal could be left by tear down of other environment ( or repo re-created since ) - user
+                        # is only skipped if its repo is really gone
+                        journaled = [user["Key"] for user in users if user["Key"] in done_users]
+                        with ContextThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                            still_there = [name for name, there in
+                                           zip(journaled, executor.map(self.bucket_name_available, journaled))
+                                           if there]
+                        if still_there:
+                            self.logger.warning("[%s] user repo(s) in tear down journal still exist - they will be "
+                                                "deleted again", len(still_there))
+                            done_users.difference_update(still_there)
+
+                        pending = [user for user in users if user["Key"] not in done_users]
+                        if len(pending) < len(users):
+                            self.logger.info("Resuming tear down - [%s] user repo(s) were already deleted",
+                                             len(users) - len(pending))
+                        for user in users:
+                            if user["Key"] in done_users:
+                                x.add_row([user["Key"], user["LastModified"], user["Size"], True, "(earlier run)"])
+
+                        journal_lock = threading.Lock()
+                        failed = 0
+                        with ContextThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                            # Failed user is left for next run ( journal ) - its requests were already retried by
+                            # botocore
+                            futures = {executor.submit(self._tear_down_user, user["Key"]): user for user in pending}
+                            for count, future in enumerate(as_completed(futures), 1):
+                                user = futures[future]
+                                error = future.exception()
+                                if error is None:
+                                    with journal_lock:
+                                        done_users.add(user["Key"])
+                                        self._save_journal(journal_file, done_users)
+                                    self.logger.info("[%s/%s] Repo of user [%s] deleted", count, len(pending),
+                                                     user["Key"])
+                                else:
+                                    failed += 1
+                                    self.logger.error("[%s/%s] Failed to delete repo of user [%s]: %s", count,
+                                                      len(pending), user["Key"], error)
+                                x.add_row([user["Key"], user["LastModified"], user["Size"], error is None,
+                                           "" if error is None else str(error)])
+
+                        print(x)
+                        if failed:
+                            self.logger.error("[%s] user repo(s) could not be deleted - run tear down again to retry "
+                                              "them", failed)
+                            return False
+
+                        logging.warning("About to destroy main user repo")
+                        try:
+                            self._tear_down_user(self.usersBucket)
+                        except RuntimeError as e:
+                            # Journal is kept - next run only has to delete users repo
+                            self.logger.error("Users repo [%s] could not be deleted - run tear down again to retry "
+                                              "it: %s", self.usersBucket, e)
+                            return False
+                        self._users_bucket_ready = False
+                        self.auth_cache.invalidate()
+                        if os.path.exists(journal_file):
+                            os.remove(journal_file)
+                        logging.info("Tear down complete")
+                        return True
 
                     except ClientError as e:
-                        self.logger.error(e.response)
+                        self.logger.error("Tear down failed with [%s] %s - run tear down again to resume",
+                                          e.response["Error"].get("Code", ""), e.response["Error"].get("Message", ""))
+                        return False
                 else:
-                    self.logger.error("Repo [" + self.usersBucket + "] does not exists")
+                    self.logger.error("Repo [%s] does not exists", self.usersBucket)
             else:
-                self.logger.error("User authentication failed for user: " + self.admin_username)
+                self.logger.error("User authentication failed for user: %s", self.admin_username)
                 return False
         except ValueError as ve:
             if "not found" in str(ve):
                 self.logger.error(str(ve))
                 return False
+
+    def _tear_down_user(self, user_name):
+        """
+        Delete repo of one user ( or users repo ) for tear down - unlike delete_userBucket errors are raised so they
+        can be reported
+        :param user_name:
+        :return: number of files deleted
+        """
+        try:
+            deleted = self.empty_bucket(user_name)
+            self.s3_client.delete_bucket(Bucket=user_name)
+            return deleted
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchBucket", "404"):
+                # e.g. admin user - it never had a repo
+                return 0
+            raise e
+
+    def _load_journal(self, journal_file):
+        if os.path.isfile(journal_file):
+            with open(journal_file) as f:
+                return set(json.load(f))
+        return set()
+
+    def _save_journal(self, journal_file, done_users):
+        if not os.path.exists(self.state_folder):
+            os.makedirs(self.state_folder)
+        with open(journal_file + ".tmp", "w") as f:
+            json.dump(sorted(done_users), f)
+        os.replace(journal_file + ".tmp", journal_file)
+
+    @instrumented
+    def iter_usage(self, _admin_password, concurrency=8, top=3):
+        """
+        Storage used by every user - user repos are scanned in parallel ( concurrency at a time ) and result of each
+        user is returned as soon as its scan finishes ( not in users repo order )
+        Only object listing is read ( no tags ) so each repo costs one request per 1000 files
+        :param _admin_password:
+        :param concurrency: number of user repos scanned in parallel
+        :param top: number of largest files reported per user
+        :return: generator of UserUsage ; error is set ( and counts are 0 ) if repo of that user could not be scanned
+        :raise ValueError: if admin can't be authenticated or users repo does not exists
+        """
+        if not self.authenticate_user(self.admin_username, _admin_password):
+            raise ValueError("User authentication failed for user: " + self.admin_username)
+        if not self.bucket_name_available(self.usersBucket):
+            raise ValueError("Repo [" + self.usersBucket + "] does not exists")
+
+        def list_users():
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.usersBucket):
+                for user in page.get("Contents", []):
+                    if user["Key"] != self.admin_username:  # Admin user does not have Repo
+                        yield user["Key"]
+
+        with ContextThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = {executor.submit(self._user_usage, user_name, top): user_name for user_name in list_users()}
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except ClientError as e:
+                    yield UserUsage(futures[future], 0, 0, 0, 0, [], e.response["Error"]["Message"])
+
+    @instrumented
+    def usage_report(self, _admin_password, concurrency=8, top=3):
+        """
+        Print storage used by every user - one line per user as soon as it is scanned , then table of all users
+        sorted by size and grand total
+        :param _admin_password:
+        :param concurrency: number of user repos scanned in parallel
+        :param top: number of largest files shown per user
+        :return: list of UserUsage or False if report could not be created
+        """
+        try:
+            results = []
+            for count, usage in enumerate(self.iter_usage(_admin_password, concurrency, top), 1):
+                results.append(usage)
+                if usage.error:
+                    self.logger.error("[%s] Failed to scan repo of user [%s]: %s", count, usage.user_name, usage.error)
+                else:
+                    self.logger.info("[%s] User [%s] files: %s bytes: %s", count, usage.user_name, usage.files,
+                                     usage.bytes)
+        except ValueError as ve:
+            self.logger.error(str(ve))
+            return False
+        except ClientError as e:
+            self.logger.error(e.response)
+            return False
+
+        from prettytable import PrettyTable
+        x = PrettyTable()
+        x.field_names = ["User", "Files", "Bytes", "Overhead bytes", "Largest files", "Error"]
+        for usage in sorted(results, key=lambda usage: usage.bytes, reverse=True):
+            x.add_row([usage.user_name, usage.files, usage.bytes, usage.overhead_bytes,
+                       "\n".join(key + " (" + str(size) + ")" for key, size in usage.largest), usage.error or ""])
+        x.add_row(["TOTAL", sum(usage.files for usage in results), sum(usage.bytes for usage in results),
+                   sum(usage.overhead_bytes for usage in results), "", ""])
+        print(x)
+        return results
+
+    def _user_usage(self, user_name, top=3):
+        """
+        Scan repo of one user for usage report - objects under reserved prefix ( index etc. ) are counted as overhead
+        except chunks : they are content of chunked files which is counted with file size from index
+        :param user_name:
+        :param top:
+        :return: UserUsage
+        """
+        files = 0
+        total_bytes = 0
+        overhead_files = 0
+        overhead_bytes = 0
+        largest = []  # min-heap of ( size , key ) - smallest of the top files is first
+        index = RepoIndex(self.s3_client, user_name)
+        index.load()
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=user_name):
+            for s3_object in page.get("Contents", []):
+                if s3_object["Key"].startswith(CHUNK_PREFIX):
+                    continue
+                if is_reserved_key(s3_object["Key"]):
+                    overhead_files += 1
+                    overhead_bytes += s3_object["Size"]
+                    continue
+                size = index.file_size(s3_object["Key"], s3_object["Size"])
+                files += 1
+                total_bytes += size
+                if len(largest) < top:
+                    heapq.heappush(largest, (size, s3_object["Key"]))
+                elif top > 0 and size > largest[0][0]:
+                    heapq.heapreplace(largest, (size, s3_object["Key"]))
+        largest = [(key, size) for size, key in sorted(largest, reverse=True)]
+        return UserUsage(user_name, files, total_bytes, overhead_files, overhead_bytes, largest, None)
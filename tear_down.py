@@ -6,7 +6,7 @@ from getpass import getpass
 import s3repo
 from s3repo.s3repomain import *
 
-s3repo = s3RepoMain()
+s3repo = s3RepoMain(lazy_connect=True)
 logger = logger_setup.logger
 logger.name = "s3repo.tearDownAll"
 
@@ -20,9 +20,23 @@ def yes_or_no(question):
             return False
 
 
+def usage():
+    programName = os.path.basename(sys.argv[0])
+    logger.info("%s [concurrency]", programName)
+
+
+# Number of user repos deleted in parallel
+concurrency = 8
+if len(sys.argv) > 2 or (len(sys.argv) == 2 and (not sys.argv[1].isdigit() or int(sys.argv[1]) < 1)):
+    logger.error("Optional argument must be a positive number ( concurrency )")
+    usage()
+    sys.exit(-1)
+if len(sys.argv) == 2:
+    concurrency = int(sys.argv[1])
+
 logger.info(
     "About to start tear down of Repo")
 
 if yes_or_no("Delete all users and their repos ? "):
     input_admin_password = getpass("Enter admin password: ")
-    s3repo.tear_down_all(input_admin_password)
+    s3repo.tear_down_all(input_admin_password, concurrency=concurrency)
@@ -1,9 +1,25 @@
+import asyncio
+import io
+import json
 import os
+import shutil
+import subprocess
 import sys
+import threading
 import unittest
 import uuid
 import warnings
 
+from botocore.exceptions import ClientError
+
+from s3repo.daemon import DaemonClient, DaemonUnavailable, RepoDaemon
+from s3repo.helper import chunked_storage
+from s3repo.helper.ProgressPercentage import ProgressPercentage, TransferProgress
+from s3repo.helper.download_cache import DownloadCache
+from s3repo.helper.multipart_upload import MIN_PART_SIZE
+from s3repo.helper.repo_index import RepoIndex
+from s3repo.helper.retry_policy import RetryPolicy
+from s3repo.s3repoasync import AsyncS3Repo
 from s3repo.s3repomain import s3RepoMain
 
 warnings.simplefilter("ignore", ResourceWarning)
@@ -37,6 +53,7 @@ class TestS3RepoOperations(unittest.TestCase):
         self.file_key = "my firstFile"
         self.input_file = "testfile.txt"
         self.input_file_text = uuid.uuid4().hex
+        self.startup_budget_seconds = 0.25
         self.s3repo = s3RepoMain()
 
     def setUp(self):
@@ -63,6 +80,8 @@ class TestS3RepoOperations(unittest.TestCase):
             "did not "
             "return True")
         self.assertEqual(self.s3repo.listFiles(self.user_name, self.password), True, "list user did not return True")
+        self.assertEqual(self.s3repo.listFiles(self.user_name, self.password, concurrency=4, stream=True), True,
+                         "list user ( concurrent ) did not return True")
         # self.assertEqual(self.s3repo.downloadFile(self.user_name, self.password, self.input_file), True,
         #                  "Download file did not "
         #                  "return True")
@@ -121,6 +140,796 @@ class TestS3RepoOperations(unittest.TestCase):
                                                                                                 "return True")
         self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
 
+    def test_auth_cache(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.authenticate_user(self.user_name, self.password), True,
+                         "authenticate_user did not return True")
+        self.assertNotEqual(self.s3repo.auth_cache.get(self.user_name), None, "User was not cached")
+        self.assertEqual(self.s3repo.authenticate_user(self.user_name, self.password_2), False,
+                         "[Cached] authenticate_user with wrong password did not return False")
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+        self.assertEqual(self.s3repo.auth_cache.get(self.user_name), None, "Deleted user still cached")
+        self.assertRaises(ValueError, self.s3repo.authenticate_user, self.user_name, self.password)
+
+    def test_index_lookup(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file), True,
+                         "Upload file did not return True")
+        self.assertEqual(self.s3repo.find_object_key(self.user_name, self.file_key), self.input_file,
+                         "Index did not return uploaded file")
+        self.assertEqual(self.s3repo.rebuild_index(self.user_name, self.password), True,
+                         "Rebuild index did not return True")
+        self.assertEqual(self.s3repo.find_object_key(self.user_name, self.file_key), self.input_file,
+                         "Re-built index did not return uploaded file")
+        self.assertEqual(self.s3repo.deleteFile(self.user_name, self.password, self.file_key), True,
+                         "Delete file did not return True")
+        self.assertEqual(self.s3repo.find_object_key(self.user_name, self.file_key), None,
+                         "Index still has deleted file")
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_iter_files(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file), True,
+                         "Upload file did not return True")
+        records = list(self.s3repo.iterFiles(self.user_name, self.password, limit=10))
+        self.assertEqual([(record.key, record.user_key, record.size) for record in records],
+                         [(self.input_file, self.file_key, len(self.input_file_text))],
+                         "iterFiles did not return uploaded file")
+        self.assertEqual(list(self.s3repo.iterFiles(self.user_name, self.password, start_after=self.input_file)), [],
+                         "iterFiles returned file before start_after")
+        self.assertEqual(list(self.s3repo.iterFiles(self.user_name, self.password, prefix="no-such-prefix")), [],
+                         "iterFiles returned file not matching prefix")
+        self.assertRaises(ValueError, list, self.s3repo.iterFiles(self.user_name, self.password_2))
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_usage_report(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file), True,
+                         "Upload file did not return True")
+        report = self.s3repo.usage_report(self.s3repo.admin_password, concurrency=2, top=1)
+        usage = [user_usage for user_usage in report if user_usage.user_name == self.user_name][0]
+        self.assertEqual((usage.files, usage.bytes, usage.largest),
+                         (1, len(self.input_file_text), [(self.input_file, len(self.input_file_text))]),
+                         "Usage report does not match uploaded file")
+        # Index is not a user file
+        self.assertEqual(usage.overhead_files, 1, "Index is not counted as overhead")
+        self.assertEqual(self.s3repo.usage_report(self.password_2), False,
+                         "Usage report with wrong admin password did not return False")
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_instrumentation(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file,
+                                                multipart=True, concurrency=2), True,
+                         "Multipart upload file did not return True")
+        self.s3repo.stats.reset()
+        self.assertEqual(self.s3repo.getFile(self.user_name, self.password, self.file_key, output_location=""), True,
+                         "getFile file did not return True")
+        # downloadFile called by getFile is counted as getFile
+        self.assertEqual(self.s3repo.stats.api_call_counts("downloadFile"), {}, "Nested method has its own calls")
+        self.assertGreater(self.s3repo.stats.api_call_counts("getFile")["GetObject"], 0, "getFile has no GetObject")
+        self.assertEqual(self.s3repo.stats.snapshot()["getFile"]["bytes_received"] >= len(self.input_file_text), True,
+                         "getFile bytes not counted")
+        self.assertIn('s3repo_api_calls_total{method="getFile",operation="GetObject"}',
+                      self.s3repo.stats.to_prometheus(), "Prometheus dump has no getFile calls")
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_retry_policy(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.client_config.retries["mode"], "adaptive", "Client is not in adaptive retry mode")
+        self.assertEqual(self.s3repo.client_config.retries["max_attempts"], 3, "Client does not make 3 attempts")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file), True,
+                         "Upload file did not return True")
+        s3_client = self.s3repo.s3_client
+        delete_objects = s3_client.delete_objects
+        batches = []
+        failures = ["SlowDown"]
+
+        def throttled_delete(**kwargs):
+            # Keys failed as a whole batch and are not deleted - as S3 does with per-key errors
+            batches.append(sorted(item["Key"] for item in kwargs["Delete"]["Objects"]))
+            if failures:
+                code = failures.pop()
+                return {"Errors": [{"Key": item["Key"], "Code": code, "Message": code}
+                                   for item in kwargs["Delete"]["Objects"]]}
+            return delete_objects(**kwargs)
+
+        self.s3repo.retry_policy.base_delay = 0
+        s3_client.delete_objects = throttled_delete
+        try:
+            # Non retryable error is not retried
+            failures.append("AccessDenied")
+            self.assertRaises(RuntimeError, self.s3repo.empty_bucket, self.user_name)
+            self.assertEqual(len(batches), 1, "Key that failed with AccessDenied was retried")
+            batches.clear()
+            self.s3repo.stats.reset()
+            self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+        finally:
+            del s3_client.delete_objects
+            self.s3repo.retry_policy.base_delay = RetryPolicy().base_delay
+        self.assertEqual(len(batches), 2, "Keys throttled in delete_objects were not retried")
+        self.assertEqual(batches[1], batches[0], "Retry did not send the keys returned in Errors")
+        self.assertEqual(self.s3repo.stats.policy_retries[("delete_user", "DeleteObjects", "SlowDown")], 1,
+                         "Retry was not counted")
+        self.assertEqual(self.s3repo.bucket_name_available(self.user_name), False, "Repo was not deleted")
+
+    def test_daemon(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        socket_file = os.path.join(self.s3repo.state_folder, "test-daemon.sock")
+        daemon = RepoDaemon(repo=self.s3repo, path=socket_file)
+        server = threading.Thread(target=daemon.serve)
+        server.start()
+        try:
+            client = DaemonClient(socket_file)
+            self.assertEqual(client.available(), True, "Daemon is not available")
+            self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id),
+                             True, "Create user did not return True")
+            self.assertEqual(client.call("uploadFile", user_name=self.user_name, user_password=self.password,
+                                         file_key=self.file_key, file=os.path.abspath(self.input_file)), True,
+                             "Upload file ( daemon ) did not return True")
+            self.assertEqual([record["user_key"] for record in client.iterate("iterFiles", bucket_name=self.user_name,
+                                                                              user_password=self.password)],
+                             [self.file_key], "iterFiles ( daemon ) did not return uploaded file")
+            self.assertRaises(ValueError, list, client.iterate("iterFiles", bucket_name=self.user_name,
+                                                               user_password=self.password_2))
+            self.assertEqual(client.call("getFile", bucket_name=self.user_name, user_password=self.password,
+                                         user_Key=self.file_key, output_location=""), True,
+                             "getFile ( daemon ) did not return True")
+            self.assertEqual(self.checkFile(), True, "checkFile file did not return True")
+            self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+        finally:
+            DaemonClient(socket_file).call("shutdown")
+            server.join()
+        self.assertRaises(DaemonUnavailable, DaemonClient(socket_file).call, "ping")
+
+    def test_download_cache(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        repo = s3RepoMain(download_cache_bytes=1024 * 1024)
+        cache_folder = os.path.join(repo.state_folder, "test-download-cache")
+        repo.download_cache.folder = cache_folder
+        repo.download_cache.index_file = os.path.join(cache_folder, "cache.json")
+        try:
+            self.assertEqual(repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                             "Create user did not return True")
+            self.assertEqual(repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file), True,
+                             "Upload file did not return True")
+            self.assertEqual(repo.getFile(self.user_name, self.password, self.file_key, output_location=""), True,
+                             "getFile file did not return True")
+            repo.stats.reset()
+            self.assertEqual(repo.getFile(self.user_name, self.password, self.file_key, output_location=""), True,
+                             "getFile file ( cached ) did not return True")
+            self.assertEqual(self.checkFile(), True, "checkFile file did not return True")
+            # Conditional head_object says object is unchanged - it is not downloaded again
+            self.assertEqual(repo.stats.api_errors[("getFile", "HeadObject", "304")], 1,
+                             "Unchanged file was not served from cache")
+            # New content under same name must not come from cache
+            self.input_file_text = uuid.uuid4().hex
+            with open(self.input_file, "w") as f:
+                f.write(self.input_file_text)
+            self.assertEqual(repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file), True,
+                             "Upload file did not return True")
+            self.assertEqual(repo.getFile(self.user_name, self.password, self.file_key, output_location="",
+                                          parallel=True, concurrency=2), True, "getFile file did not return True")
+            self.assertEqual(self.checkFile(), True, "checkFile file ( changed ) did not return True")
+            self.assertEqual(repo.delete_user(self.user_name), True, "Delete user did not return True")
+        finally:
+            shutil.rmtree(cache_folder, ignore_errors=True)
+
+    def test_download_cache_processes(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        cache_folder = os.path.join(self.s3repo.state_folder, "test-shared-cache")
+        # Programs sharing cache folder must not lose each other's index entries
+        code = "import sys\n" \
+               "from s3repo.helper.download_cache import DownloadCache\n" \
+               "cache = DownloadCache(sys.argv[1], 1024 * 1024)\n" \
+               "for number in range(25):\n" \
+               "    cache.store('bucket', sys.argv[2] + str(number), 'etag', sys.argv[3])\n"
+        try:
+            programs = [subprocess.Popen([sys.executable, "-c", code, cache_folder, "program%d-" % number,
+                                          os.path.abspath(self.input_file)],
+                                         cwd=os.path.dirname(os.path.abspath(__file__))) for number in range(4)]
+            self.assertEqual([program.wait() for program in programs], [0] * 4, "Cache program failed")
+            cache = DownloadCache(cache_folder, 1024 * 1024)
+            self.assertEqual(len(cache._load()), 100, "Cache index lost entries of concurrent programs")
+            self.assertEqual(cache.lookup("bucket", "program2-7"), "etag", "Cached file not found")
+        finally:
+            shutil.rmtree(cache_folder, ignore_errors=True)
+
+    def test_multipart_transfer(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file,
+                                                multipart=True, concurrency=2), True,
+                         "Multipart upload file did not return True")
+        self.assertEqual(self.s3repo.getFile(self.user_name, self.password, self.file_key, output_location="",
+                                             parallel=True, part_size=8, concurrency=2), True,
+                         "getFile file ( parallel ) did not return True")
+        self.assertEqual(self.checkFile(), True, "checkFile file did not return True")
+        # File of several parts - upload that fails half way is resumed by sending only the missing part
+        multipart_file = "multipart_testfile.bin"
+        content = os.urandom(2 * MIN_PART_SIZE + 1024)
+        with open(multipart_file, "wb") as f:
+            f.write(content)
+        output_file = os.path.join(self.s3repo.output_folder, multipart_file)
+        s3_client = self.s3repo.s3_client
+        upload_part = s3_client.upload_part
+
+        def fail_second_part(**kwargs):
+            if kwargs["PartNumber"] == 2:
+                raise ClientError({"Error": {"Code": "RequestTimeout", "Message": "Part failed"}}, "UploadPart")
+            return upload_part(**kwargs)
+
+        try:
+            s3_client.upload_part = fail_second_part
+            try:
+                self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, "multipart key", multipart_file,
+                                                        multipart=True, part_size=MIN_PART_SIZE, concurrency=1),
+                                 False, "Interrupted multipart upload did not return False")
+            finally:
+                del s3_client.upload_part
+            self.s3repo.stats.reset()
+            self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, "multipart key", multipart_file,
+                                                    multipart=True, part_size=MIN_PART_SIZE, concurrency=1), True,
+                             "Resumed multipart upload did not return True")
+            self.assertEqual(self.s3repo.stats.api_call_counts("uploadFile")["UploadPart"], 1,
+                             "Resumed upload did not send only the missing part")
+            self.assertEqual(self.s3repo.stats.api_call_counts("uploadFile")["CreateMultipartUpload"], 0,
+                             "Resumed upload started new multipart upload")
+            self.assertEqual(self.s3repo.getFile(self.user_name, self.password, "multipart key", output_location="",
+                                                 parallel=True, concurrency=2), True,
+                             "getFile file ( parallel ) did not return True")
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), content, "Downloaded file is not same as uploaded in parts")
+            # Plain download of large file goes through managed transfer - ranged parts , not one stream
+            self.s3repo.stats.reset()
+            self.assertEqual(self.s3repo.getFile(self.user_name, self.password, "multipart key", output_location=""),
+                             True, "getFile file did not return True")
+            self.assertGreater(self.s3repo.stats.api_call_counts("getFile")["GetObject"], 1,
+                               "Large file was not downloaded in ranged parts")
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), content, "Downloaded file is not same as uploaded in parts")
+        finally:
+            for path in (multipart_file, output_file):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_dedup_upload(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file,
+                                                dedup=True), True, "Upload file did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, "second key", self.input_file,
+                                                dedup=True), True, "Dedup upload file did not return True")
+        self.assertEqual(self.s3repo.find_object_key(self.user_name, "second key"), self.input_file,
+                         "Second user-key does not point to existing file")
+        self.assertEqual(self.s3repo.deleteFile(self.user_name, self.password, self.file_key), True,
+                         "Delete file did not return True")
+        # File is still used by second user-key
+        self.assertEqual(self.s3repo.getFile(self.user_name, self.password, "second key", output_location=""), True,
+                         "getFile file did not return True")
+        self.assertEqual(self.checkFile(), True, "checkFile file did not return True")
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_stream_transfer(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        with open(self.input_file, "rb") as stream:
+            self.assertEqual(self.s3repo.uploadStream(self.user_name, self.password, self.file_key, stream,
+                                                      object_key=self.input_file), True,
+                             "Upload stream did not return True")
+        self.assertEqual(b"".join(self.s3repo.iterFile(self.user_name, self.password, self.file_key, chunk_size=8)),
+                         self.input_file_text.encode(), "Streamed file content is not same as uploaded")
+        self.assertEqual(self.s3repo.getFile(self.user_name, self.password, self.file_key, output_location=""), True,
+                         "getFile file did not return True")
+        self.assertEqual(self.checkFile(), True, "checkFile file did not return True")
+        # File names that would escape download folder are refused
+        for object_key in ("../../escaped.txt", "/abs/path", "sub//file", "./file", "sub/"):
+            with open(self.input_file, "rb") as stream:
+                self.assertEqual(self.s3repo.uploadStream(self.user_name, self.password, "escape", stream,
+                                                          object_key=object_key), False,
+                                 "Upload stream with file name [" + object_key + "] did not return False")
+        # Such file put into repo by other means is not downloaded outside target folder
+        target_folder = os.path.join(self.s3repo.output_folder, "traversal", "a")
+        os.makedirs(target_folder, exist_ok=True)
+        self.s3repo.s3_client.put_object(Bucket=self.user_name, Key="../escaped.txt", Body=b"escaped")
+        self.s3repo.update_index(self.user_name, "escape", "../escaped.txt")
+        try:
+            self.assertEqual(self.s3repo.getFile(self.user_name, self.password, "escape", target_folder), False,
+                             "getFile of file outside target folder did not return False")
+            self.assertEqual(os.path.exists(os.path.join(self.s3repo.output_folder, "traversal", "escaped.txt")),
+                             False, "File was written outside target folder")
+        finally:
+            shutil.rmtree(os.path.join(self.s3repo.output_folder, "traversal"))
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_compressed_transfer(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file,
+                                                compress="gzip"), True, "Compressed upload file did not return True")
+        response = self.s3repo.s3_client.head_object(Bucket=self.user_name, Key=self.input_file)
+        self.assertEqual(response["Metadata"].get("s3repo-codec"), "gzip", "Codec was not recorded in metadata")
+        self.assertEqual(b"".join(self.s3repo.iterFile(self.user_name, self.password, self.file_key, chunk_size=8)),
+                         self.input_file_text.encode(), "Streamed file content is not same as uploaded")
+        self.assertEqual(self.s3repo.getFile(self.user_name, self.password, self.file_key, output_location=""), True,
+                         "getFile file did not return True")
+        self.assertEqual(self.checkFile(), True, "checkFile file did not return True")
+        self.assertEqual(self.s3repo.getFile(self.user_name, self.password, self.file_key, output_location="",
+                                             parallel=True, part_size=8, concurrency=2), True,
+                         "getFile file ( parallel ) did not return True")
+        self.assertEqual(self.checkFile(), True, "checkFile file did not return True")
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_chunked_upload(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        chunked_file = "chunked_testfile.log"
+        lines = ["line %d %s\n" % (number, uuid.uuid4().hex) for number in range(60000)]
+        with open(chunked_file, "w") as f:
+            f.writelines(lines)
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, chunked_file,
+                                                chunked=True), True, "Chunked upload file did not return True")
+        chunks = self.s3repo.s3_client.list_objects_v2(Bucket=self.user_name, Prefix=".s3repo/chunks/")["KeyCount"]
+        self.assertGreater(chunks, 1, "File was not cut into chunks")
+        # Small change in middle of file only adds chunk(s) around change
+        lines.insert(30000, "changed line\n")
+        with open(chunked_file, "w") as f:
+            f.writelines(lines)
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, chunked_file,
+                                                chunked=True), True, "Chunked re-upload file did not return True")
+        self.assertLessEqual(self.s3repo.s3_client.list_objects_v2(Bucket=self.user_name,
+                                                                   Prefix=".s3repo/chunks/")["KeyCount"], chunks + 2,
+                             "Re-upload sent more than changed chunks")
+        with open(chunked_file, "rb") as f:
+            content = f.read()
+        output_file = os.path.join(self.s3repo.output_folder, chunked_file)
+        for parallel in (False, True):
+            self.assertEqual(self.s3repo.getFile(self.user_name, self.password, self.file_key, output_location="",
+                                                 parallel=parallel, concurrency=4), True,
+                             "getFile file did not return True")
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), content, "Re-assembled file is not same as uploaded")
+        self.assertEqual(b"".join(self.s3repo.iterFile(self.user_name, self.password, self.file_key)), content,
+                         "Streamed file content is not same as uploaded")
+        # Listing and usage report give size of file , not of its manifest
+        record = next(self.s3repo.iter_file_records(self.user_name))
+        self.assertEqual(record.size, len(content), "Listed size of chunked file is not its size")
+        usage = self.s3repo._user_usage(self.user_name)
+        self.assertEqual((usage.files, usage.bytes), (1, len(content)), "Usage of chunked file is not its size")
+        # Chunks S3 refuses to delete fail rebuild index and stay in repo
+        s3_client = self.s3repo.s3_client
+
+        def refuse_delete(**kwargs):
+            return {"Errors": [{"Key": item["Key"], "Code": "AccessDenied"} for item in kwargs["Delete"]["Objects"]]}
+
+        s3_client.delete_objects = refuse_delete
+        try:
+            self.assertEqual(self.s3repo.rebuild_index(self.user_name, self.password, chunk_grace_seconds=0), False,
+                             "Rebuild index did not return False when chunks were not deleted")
+        finally:
+            del s3_client.delete_objects
+        self.assertGreater(s3_client.list_objects_v2(Bucket=self.user_name, Prefix=".s3repo/chunks/")["KeyCount"],
+                           chunks, "Chunks not deleted were lost")
+        # File uploaded while manifests are being read re-uses unused chunks - they must not be deleted
+        read_manifests = chunked_storage._read_manifests
+        race_key = "race_" + chunked_file
+        all_chunks = s3_client.list_objects_v2(Bucket=self.user_name, Prefix=".s3repo/chunks/")["Contents"]
+
+        def upload_between(s3_client_, bucket_name, known, chunks_=None):
+            if known:
+                manifest = {"version": chunked_storage.MANIFEST_VERSION,
+                            "size": sum(item["Size"] for item in all_chunks),
+                            "chunks": [[item["Key"][len(chunked_storage.CHUNK_PREFIX):], item["Size"]]
+                                       for item in all_chunks]}
+                s3_client_.put_object(Bucket=bucket_name, Key=race_key, Body=json.dumps(manifest),
+                                      Metadata={chunked_storage.MANIFEST_METADATA: "1"})
+            return read_manifests(s3_client_, bucket_name, known, chunks_)
+
+        chunked_storage._read_manifests = upload_between
+        try:
+            self.assertEqual(self.s3repo.rebuild_index(self.user_name, self.password, chunk_grace_seconds=0), True,
+                             "Rebuild index did not return True")
+        finally:
+            chunked_storage._read_manifests = read_manifests
+        self.assertEqual(s3_client.list_objects_v2(Bucket=self.user_name, Prefix=".s3repo/chunks/")["KeyCount"],
+                         len(all_chunks), "Chunks of file uploaded during rebuild index were deleted")
+        s3_client.delete_object(Bucket=self.user_name, Key=race_key)
+        # Chunks only first version used are deleted , chunks of current version are kept
+        self.assertEqual(self.s3repo.rebuild_index(self.user_name, self.password, chunk_grace_seconds=0), True,
+                         "Rebuild index did not return True")
+        manifest = json.loads(self.s3repo.s3_client.get_object(Bucket=self.user_name,
+                                                               Key=chunked_file)["Body"].read())
+        remaining = self.s3repo.s3_client.list_objects_v2(Bucket=self.user_name, Prefix=".s3repo/chunks/")
+        self.assertEqual(set(item["Key"] for item in remaining["Contents"]),
+                         set(".s3repo/chunks/" + sha256 for sha256, length in manifest["chunks"]),
+                         "Rebuild index did not delete exactly the unused chunks")
+        self.assertEqual(next(self.s3repo.iter_file_records(self.user_name)).size, len(content),
+                         "Size of chunked file lost by rebuild index")
+        self.assertEqual(self.s3repo.deleteFile(self.user_name, self.password, self.file_key), True,
+                         "Delete file did not return True")
+        self.assertEqual(self.s3repo.rebuild_index(self.user_name, self.password, chunk_grace_seconds=0), True,
+                         "Rebuild index did not return True")
+        self.assertEqual(self.s3repo.s3_client.list_objects_v2(Bucket=self.user_name,
+                                                               Prefix=".s3repo/chunks/")["KeyCount"], 0,
+                         "Chunks of deleted file were not deleted")
+        os.remove(output_file)
+        os.remove(chunked_file)
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_sync_directory(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        sync_folder = os.path.join(self.s3repo.output_folder, "sync-test")
+        os.makedirs(os.path.join(sync_folder, "sub"), exist_ok=True)
+        for name in ("first.txt", os.path.join("sub", "second.txt")):
+            with open(os.path.join(sync_folder, name), "w") as f:
+                f.write(self.input_file_text)
+        try:
+            self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id),
+                             True, "Create user did not return True")
+            self.assertEqual(self.s3repo.syncDirectory(self.user_name, self.password, sync_folder), True,
+                             "Sync directory did not return True")
+            # Nothing changed - second sync must not upload anything
+            self.s3repo.stats.reset()
+            self.assertEqual(self.s3repo.syncDirectory(self.user_name, self.password, sync_folder), True,
+                             "Second sync directory did not return True")
+            calls = self.s3repo.stats.api_call_counts("syncDirectory")
+            self.assertEqual((calls["PutObject"], calls["CreateMultipartUpload"]), (0, 0),
+                             "Second sync uploaded unchanged files")
+            # Same size but new content - only that file is uploaded again
+            changed_text = uuid.uuid4().hex
+            with open(os.path.join(sync_folder, "first.txt"), "w") as f:
+                f.write(changed_text)
+            self.s3repo.stats.reset()
+            self.assertEqual(self.s3repo.syncDirectory(self.user_name, self.password, sync_folder), True,
+                             "Third sync directory did not return True")
+            # Changed file and repo index
+            self.assertEqual(self.s3repo.stats.api_call_counts("syncDirectory")["PutObject"], 2,
+                             "Sync did not upload only the changed file")
+            self.assertEqual(self.s3repo.s3_client.get_object(Bucket=self.user_name, Key="first.txt")["Body"].read(),
+                             changed_text.encode(), "Changed file was not uploaded")
+            self.assertEqual(self.s3repo.find_object_key(self.user_name, "sub/second.txt"), "sub/second.txt",
+                             "Synced file not found by its user-key")
+            self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+        finally:
+            shutil.rmtree(sync_folder)
+
+    def test_async_operations(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+
+        async def run_operations():
+            async with AsyncS3Repo(repo=self.s3repo, max_concurrency=4) as repo:
+                self.assertEqual(await repo.create_user(self.user_name, self.password, self.email_id), True,
+                                 "Create user did not return True")
+                self.assertEqual(await repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file),
+                                 True, "Upload file did not return True")
+                results = await asyncio.gather(repo.authenticate_user(self.user_name, self.password),
+                                               repo.listFiles(self.user_name, self.password),
+                                               repo.getFile(self.user_name, self.password, self.file_key, ""))
+                self.assertEqual(results, [True, True, True], "Parallel operations did not return True")
+                self.assertEqual(await repo.deleteFile(self.user_name, self.password, self.file_key), True,
+                                 "Delete file did not return True")
+
+        asyncio.run(run_operations())
+        self.assertEqual(self.checkFile(), True, "checkFile file did not return True")
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_async_cancellation(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        lock = threading.Lock()
+        release = threading.Event()
+        running = []
+        started = []
+        most_running = []
+
+        def work(number):
+            with lock:
+                started.append(number)
+                running.append(number)
+                most_running.append(len(running))
+            release.wait(10)
+            with lock:
+                running.remove(number)
+            return number
+
+        async def run_queued():
+            async with AsyncS3Repo(repo=self.s3repo, max_concurrency=2) as repo:
+                tasks = [asyncio.ensure_future(repo._run(work, number)) for number in range(5)]
+                while len(started) < 2:
+                    await asyncio.sleep(0.01)
+                # Call still in queue is cancelled before it starts
+                tasks[4].cancel()
+                await asyncio.sleep(0.05)
+                release.set()
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                self.assertEqual(results[:4], [0, 1, 2, 3], "Queued calls did not finish")
+                self.assertIsInstance(results[4], asyncio.CancelledError, "Queued call was not cancelled")
+
+        asyncio.run(run_queued())
+        self.assertNotIn(4, started, "Cancelled queued call was run")
+        self.assertLessEqual(max(most_running), 2, "More than max_concurrency calls ran at same time")
+
+        # Running ranged download stops between parts
+        with open(self.input_file, "w") as f:
+            f.write(self.input_file_text * 4096)
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        self.assertEqual(self.s3repo.uploadFile(self.user_name, self.password, self.file_key, self.input_file), True,
+                         "Upload file did not return True")
+        parts = len(self.input_file_text) * 4096 // 1024
+
+        async def run_cancelled_download():
+            self.s3repo.stats.reset()
+            async with AsyncS3Repo(repo=self.s3repo, max_concurrency=1) as repo:
+                task = asyncio.ensure_future(repo.getFile(self.user_name, self.password, self.file_key, "",
+                                                          parallel=True, part_size=1024, concurrency=2))
+                while self.s3repo.stats.api_call_counts("getFile")["GetObject"] < 5:
+                    await asyncio.sleep(0.005)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+            # Repo closed - download thread has ended
+            return self.s3repo.stats.api_call_counts("getFile")["GetObject"]
+
+        self.assertLess(asyncio.run(run_cancelled_download()), parts, "Cancelled download fetched every part")
+        # Download resumes from parts that were fetched
+        self.assertEqual(self.s3repo.getFile(self.user_name, self.password, self.file_key, output_location="",
+                                             parallel=True, part_size=1024, concurrency=2), True,
+                         "getFile file did not return True")
+        with open(os.path.join(self.s3repo.output_folder, self.input_file)) as f:
+            self.assertEqual(f.read(), self.input_file_text * 4096, "Resumed download is not same as uploaded")
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_concurrent_index_updates(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        folder = "concurrent_upload"
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        files = []
+        for number in range(16):
+            files.append(os.path.join(folder, "file%d.txt" % number))
+            with open(files[-1], "w") as f:
+                f.write(uuid.uuid4().hex)
+        self.assertEqual(self.s3repo.create_user(self.user_name, password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+
+        async def upload_all():
+            async with AsyncS3Repo(repo=self.s3repo, max_concurrency=16) as repo:
+                return await asyncio.gather(*[repo.uploadFile(self.user_name, self.password, "key%d" % number, file)
+                                              for number, file in enumerate(files)])
+
+        self.assertEqual(asyncio.run(upload_all()), [True] * 16, "Concurrent uploads did not return True")
+        # No index update may be lost by concurrent writers
+        index = RepoIndex(self.s3repo.s3_client, self.user_name)
+        index.load()
+        self.assertEqual(sorted(index.keys), sorted("key%d" % number for number in range(16)),
+                         "Index lost user-keys of concurrent uploads")
+        # Existing index is trusted - user-key missing from it costs no tag scan
+        index.update(lambda index: index.remove_user_key("key3"))
+        self.s3repo.stats.reset()
+        self.assertEqual(self.s3repo.getFile(self.user_name, self.password, "key3", output_location=""), False,
+                         "getFile of user-key missing from index did not return False")
+        calls = self.s3repo.stats.api_call_counts("getFile")
+        self.assertEqual((calls["ListObjectsV2"], calls["GetObjectTagging"]), (0, 0),
+                         "User-key missing from index caused tag scan")
+        # Scan on request finds it and repairs index
+        self.assertEqual(self.s3repo.find_object_key(self.user_name, "key3", scan_on_miss=True), "file3.txt",
+                         "User-key missing from index was not found")
+        index.load()
+        self.assertEqual(index.lookup("key3"), "file3.txt", "Index was not repaired")
+        shutil.rmtree(folder)
+        self.assertEqual(self.s3repo.delete_user(self.user_name), True, "Delete user did not return True")
+
+    def test_create_users(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        valid = ["w9batchuser%d" % number for number in range(3)]
+        self.assertEqual(self.s3repo.create_user(valid[0], password=self.password, email_id=self.email_id), True,
+                         "Create user did not return True")
+        # Mixed batch - new users , already existing user ( gets new password ) and invalid user name
+        batch = [(user, self.password_2, self.email_id) for user in valid] + \
+                [(self.invalid_user_name, self.password, self.email_id)]
+        results = self.s3repo.create_users(batch, concurrency=4)
+        self.assertEqual(sorted(results), sorted(valid + [self.invalid_user_name]), "Not every user has a result")
+        self.assertEqual([results[user] for user in valid], [None] * 3, "Valid users were not created")
+        self.assertIsNotNone(results[self.invalid_user_name], "Invalid user has no error")
+        self.assertEqual(self.s3repo.bucket_name_available(self.invalid_user_name.lower()), False,
+                         "Repo was created for invalid user")
+        for user in valid:
+            self.assertEqual(self.s3repo.authenticate_user(user, self.password_2), True,
+                             "User of batch can not authenticate")
+            self.assertEqual(self.s3repo.delete_user(user), True, "Delete user did not return True")
+
+    def test_wait_for_bucket(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        bucket_name = "w9waitbucket"
+        self.assertEqual(self.s3repo.wait_for_bucket(bucket_name, timeout=0.3, first_delay=0.05), False,
+                         "Missing bucket was reported as there")
+        # Bucket that shows up while waiting is found
+        timer = threading.Timer(0.2, self.s3repo.s3_client.create_bucket, kwargs={
+            "Bucket": bucket_name, "CreateBucketConfiguration": {"LocationConstraint": self.s3repo.region}})
+        timer.start()
+        try:
+            self.assertEqual(self.s3repo.wait_for_bucket(bucket_name, timeout=10, first_delay=0.05), True,
+                             "Bucket created while waiting was not found")
+        finally:
+            timer.join()
+            self.s3repo.s3_client.delete_bucket(Bucket=bucket_name)
+
+    def test_tear_down_all(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        users = ["w9teardown%d" % number for number in range(3)]
+        for user in users:
+            self.assertEqual(self.s3repo.create_user(user, password=self.password, email_id=self.email_id), True,
+                             "Create user did not return True")
+        journal_file = os.path.join(self.s3repo.state_folder, "tear_down.json")
+        tear_down_user = self.s3repo._tear_down_user
+
+        def fail_for(failing_user):
+            def failing_tear_down(user_name):
+                if user_name == failing_user:
+                    raise RuntimeError("Simulated failure")
+                return tear_down_user(user_name)
+            return failing_tear_down
+
+        try:
+            # One user fails - users repo is kept and users already done are in journal
+            self.s3repo._tear_down_user = fail_for(users[1])
+            self.assertEqual(self.s3repo.tear_down_all(self.s3repo.admin_password), False,
+                             "Tear down with failed user did not return False")
+            self.assertEqual(self.s3repo.bucket_name_available(users[1]), True, "Repo of failed user was deleted")
+            self.assertEqual(self.s3repo.bucket_name_available(users[0]), False, "Repo of user was not deleted")
+            with open(journal_file) as f:
+                self.assertEqual(set(users) - set(json.load(f)), {users[1]}, "Journal does not have done users")
+            # Repo of journaled user is there again ( e.g. journal left by other environment ) - it is not skipped
+            self.assertEqual(self.s3repo.create_userBucket(users[0]), True, "Create user bucket did not return True")
+            # Users repo fails - journal is kept so it can be retried
+            self.s3repo._tear_down_user = fail_for(self.s3repo.usersBucket)
+            self.assertEqual(self.s3repo.tear_down_all(self.s3repo.admin_password), False,
+                             "Tear down with failed users repo did not return False")
+            self.assertEqual(self.s3repo.bucket_name_available(users[1]), False, "Repo of user was not deleted")
+            self.assertEqual(self.s3repo.bucket_name_available(users[0]), False,
+                             "Repo of user in stale journal was skipped")
+            self.assertEqual(self.s3repo.bucket_name_available(self.s3repo.usersBucket), True,
+                             "Users repo was deleted")
+            self.assertEqual(os.path.exists(journal_file), True, "Journal was removed although users repo is there")
+            # Resume finishes the job
+            del self.s3repo._tear_down_user
+            self.assertEqual(self.s3repo.tear_down_all(self.s3repo.admin_password), True,
+                             "Resumed tear down did not return True")
+            self.assertEqual(self.s3repo.bucket_name_available(self.s3repo.usersBucket), False,
+                             "Users repo was not deleted")
+            self.assertEqual(os.path.exists(journal_file), False, "Journal was not removed")
+        finally:
+            if os.path.exists(journal_file):
+                os.remove(journal_file)
+
+    def test_startup_budget(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        # Command line programs import s3repo and create s3RepoMain with lazy_connect - this must stay cheap
+        # ( no boto3 import , no AWS call ) as it is paid by every single command
+        code = "import sys, time\n" \
+               "start = time.perf_counter()\n" \
+               "from s3repo.s3repomain import s3RepoMain\n" \
+               "s3RepoMain(lazy_connect=True)\n" \
+               "print(time.perf_counter() - start)\n" \
+               "print('boto3' in sys.modules)\n"
+        output = subprocess.check_output([sys.executable, "-c", code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().split()
+        print("Start up time: " + output[0] + " seconds")
+        self.assertLess(float(output[0]), self.startup_budget_seconds, "Start up took longer than budget")
+        self.assertEqual(output[1], "False", "boto3 was imported during start up")
+
+    def test_progress(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        # Progress of stream that is not a terminal is not drawn
+        self.assertEqual(TransferProgress(stream=io.StringIO()).enabled, False, "Progress drawn for non-terminal")
+        output = io.StringIO()
+        progress = TransferProgress(stream=output, interval=60, enabled=True)
+        first = ProgressPercentage("first", size=3000000, label="Downloading", progress=progress)
+        second = ProgressPercentage("second", size=4000000, label="Downloading", progress=progress)
+        second.resume(1000000)
+        for i in range(3000):
+            first(1000)
+            second(1000)
+        lines = output.getvalue().split("\r")
+        # One draw on first callback and one when each transfer finishes - not one per callback
+        self.assertLessEqual(len(lines), 5, "Progress was drawn on every callback")
+        self.assertIn("Downloading: 1/2 files", lines[-2], "Progress of finished file was not aggregated")
+        self.assertIn("Downloading: 2/2 files  7.00 / 7.00 MB  (100.00%)", lines[-1], "Final progress is wrong")
+        self.assertEqual(output.getvalue()[-1], "\n", "Progress line was not ended")
+
+    def test_logging(self):
+        print("###########################################")
+        print("Running unit test: " + self._testMethodName)
+        print("###########################################")
+        log_file = os.path.abspath("test_logging.log")
+        if os.path.exists(log_file):
+            os.remove(log_file)
+        # Debug record below configured level must not even format its arguments ; records still on queue are
+        # written when program ends
+        code = "from s3repo.helper import logger_setup\n" \
+               "class Costly(object):\n" \
+               "    formatted = 0\n" \
+               "    def __str__(self):\n" \
+               "        Costly.formatted += 1\n" \
+               "        return 'costly'\n" \
+               "logger_setup.logger.debug('Debug record [%s]', Costly())\n" \
+               "logger_setup.logger.warning('Warning record [%s]', 'kept')\n" \
+               "print(Costly.formatted)\n"
+        environment = dict(os.environ, S3REPO_LOG_LEVEL="warning", S3REPO_LOG_FILE=log_file,
+                           S3REPO_LOG_CONSOLE="none")
+        output = subprocess.check_output([sys.executable, "-c", code], env=environment,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().split()
+        self.assertEqual(output, ["0"], "Debug record was formatted although level is WARNING")
+        with open(log_file) as f:
+            content = f.read()
+        os.remove(log_file)
+        self.assertIn("Warning record [kept]", content, "Warning record was not written to log file")
+        self.assertNotIn("Debug record", content, "Debug record was written to log file")
+
     def tearDown(self):
         if os.path.exists(self.input_file):
             os.remove(self.input_file)